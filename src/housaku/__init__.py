@@ -0,0 +1,2 @@
+app_name = "housaku"
+app_description = "A powerful personal search engine built on top of SQLite's FTS5."
@@ -1,38 +1,40 @@
+from importlib import import_module
 import rich_click as click
-from housaku.commands import (
-    config,
-    index,
-    purge,
-    search_documents,
-    start_tui,
-    start_web,
-    vacuum,
-)
-from housaku.db import init_db
-from housaku.settings import Settings
+from housaku import app_description
+from housaku.commands import commands
+
+
+# Subcommands are only imported when they are run or their help is shown, so
+# every one of them only pays for its own dependencies.
+class LazyGroup(click.RichGroup):
+    def __init__(self, *args, lazy_commands: dict[str, str], **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.lazy_commands = lazy_commands
+
+    def list_commands(self, ctx: click.Context) -> list[str]:
+        return sorted([*super().list_commands(ctx), *self.lazy_commands])
 
-settings = Settings()
-init_db(settings.sqlite_url)
+    def get_command(self, ctx: click.Context, name: str) -> click.Command | None:
+        if name not in self.lazy_commands:
+            return super().get_command(ctx, name)
+
+        module, attribute = self.lazy_commands[name].split(":")
+        return getattr(import_module(module), attribute)
 
 
 @click.group(
-    help=settings.description,
+    cls=LazyGroup,
+    lazy_commands=commands,
+    help=app_description,
     epilog="Check out https://github.com/dnlzrgz/housaku for more details",
     context_settings=dict(
         help_option_names=["-h", "--help"],
     ),
 )
-@click.version_option(version=settings.version)
+@click.version_option(package_name="housaku")
 @click.pass_context
 def cli(ctx: click.Context) -> None:
-    ctx.ensure_object(dict)
-    ctx.obj["settings"] = settings
+    from housaku.settings import get_settings
 
-
-cli.add_command(index)
-cli.add_command(start_web)
-cli.add_command(start_tui)
-cli.add_command(search_documents)
-cli.add_command(config)
-cli.add_command(purge)
-cli.add_command(vacuum)
+    ctx.ensure_object(dict)
+    ctx.obj["settings"] = get_settings()
@@ -1,17 +1,18 @@
-from housaku.commands.index import index
-from housaku.commands.start_web import start_web
-from housaku.commands.start_tui import start_tui
-from housaku.commands.search import search_documents
-from housaku.commands.config import config
-from housaku.commands.purge import purge
-from housaku.commands.vacuum import vacuum
+# Every command, by name, and where to find it. Commands are imported only
+# when they are used, so running one of them doesn't import the dependencies
+# of the rest.
+commands = {
+    "index": "housaku.commands.index:index",
+    "web": "housaku.commands.start_web:start_web",
+    "tui": "housaku.commands.start_tui:start_tui",
+    "search": "housaku.commands.search:search_documents",
+    "config": "housaku.commands.config:config",
+    "purge": "housaku.commands.purge:purge",
+    "rebuild": "housaku.commands.rebuild:rebuild",
+    "vacuum": "housaku.commands.vacuum:vacuum",
+    "migrate": "housaku.commands.migrate:migrate",
+    "shards": "housaku.commands.shards:shards",
+    "watch": "housaku.commands.watch:watch",
+}
 
-__all__ = [
-    "index",
-    "start_web",
-    "start_tui",
-    "search_documents",
-    "config",
-    "purge",
-    "vacuum",
-]
+__all__ = ["commands"]
@@ -1,7 +1,6 @@
 import os
 import subprocess
 import rich_click as click
-from housaku.settings import config_file_path
 from housaku.utils import console
 
 
@@ -10,6 +9,8 @@ from housaku.utils import console
     help="Opens the configuration file.",
 )
 def config() -> None:
+    from housaku.settings import config_file_path
+
     editor = os.environ.get("EDITOR", None)
     try:
         if editor:
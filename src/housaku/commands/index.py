@@ -1,12 +1,8 @@
-import asyncio
-import concurrent.futures
-from functools import partial
 from multiprocessing import cpu_count
+from pathlib import Path
 import rich_click as click
-from housaku.db import rebuild_fts
-from housaku.feeds import index_feed
-from housaku.files import list_files, index_file
-from housaku.utils import console
+from housaku.files import EXECUTORS
+from housaku.utils import console, set_verbose
 
 
 @click.command(
@@ -23,54 +19,184 @@ from housaku.utils import console
     "-t",
     "--max-threads",
     type=click.IntRange(min=1),
-    default=cpu_count() // 2,
+    default=max(1, cpu_count() // 2),
     help="Maximum number of threads to use for indexing (default: half of CPU cores).",
 )
+@click.option(
+    "--executor",
+    type=click.Choice(EXECUTORS, case_sensitive=False),
+    default="auto",
+    help="Where to extract text from documents. 'auto' uses processes for PDFs, EPUBs and Office documents, and threads for everything else.",
+)
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=500,
+    help="Maximum number of documents written per transaction.",
+)
+@click.option(
+    "--flush-interval",
+    type=click.FloatRange(min=0),
+    default=0.2,
+    help="Maximum number of seconds to wait before committing a batch.",
+)
+@click.option(
+    "-v",
+    "--verbose",
+    is_flag=True,
+    help="Show a message for every document indexed, skipped or removed.",
+)
+@click.option(
+    "--metrics-json",
+    type=click.Path(dir_okay=False, writable=True, path_type=Path),
+    help="Write the throughput, timings and queue depths of the run to this file.",
+)
+@click.option(
+    "--shard",
+    "shards",
+    multiple=True,
+    help="Only index the documents and posts that belong to this shard. Can be used multiple times.",
+)
 @click.pass_context
-def index(ctx: click.Context, include: tuple, max_threads: int) -> None:
+def index(
+    ctx: click.Context,
+    include: tuple,
+    max_threads: int,
+    executor: str,
+    batch_size: int,
+    flush_interval: float,
+    verbose: bool,
+    metrics_json: Path | None,
+    shards: tuple[str, ...],
+) -> None:
+    import asyncio
+    from housaku.db import BatchWriter, init_db
+    from housaku.feeds import index_feed
+    from housaku.files import FileIndexer
+    from housaku.metrics import Metrics
+    from housaku.progress import IndexProgress
+    from housaku.shards import create_shard, plan_shards
+
     settings = ctx.obj["settings"]
+    passage_size = settings.passages.size if settings.passages.enabled else None
     index_files = "files" in include or len(include) == 0
     index_feeds = "feeds" in include or len(include) == 0
+    storage = settings.storage.layout()
+    sharded = settings.shards.mode != "none"
 
-    with console.status(
-        "[green]Start indexing... Please, wait a moment.",
-        spinner="arrow",
-    ) as status:
-        if index_files:
-            partial_function = partial(index_file, settings.sqlite_url)
-            try:
-                for dir in set(settings.files.include):
-                    status.update(
-                        f"[green]Indexing documents from '{dir.name}'... Please wait, this may take a moment.[/]"
-                    )
-                    files = list_files(dir, set(settings.files.exclude))
+    plans = plan_shards(
+        settings.sqlite_url,
+        list(dict.fromkeys(settings.files.include)) if index_files else [],
+        settings.feeds.urls if index_feeds else [],
+        settings.shards.mode,
+        settings.shards.count,
+    )
+    if shards:
+        missing = set(shards) - {plan.shard.name for plan in plans}
+        if missing:
+            console.print(f"[red][Err][/] unknown shards: {', '.join(sorted(missing))}")
+            return
+
+        plans = [plan for plan in plans if plan.shard.name in shards]
+
+    set_verbose(verbose)
+    metrics = Metrics()
 
-                    with concurrent.futures.ThreadPoolExecutor(
-                        max_workers=max_threads
-                    ) as executor:
-                        executor.map(partial_function, files)
+    with IndexProgress(metrics, console=console, transient=True) as progress:
+        task = progress.add_task("Start indexing... Please, wait a moment.")
+        outdated = False
+        for plan in plans:
+            sqlite_url = plan.shard.sqlite_url
+            into = f" into '{plan.shard.name}'" if sharded else ""
+
+            # Documents are always written using the layout the database
+            # already has.
+            try:
+                if sharded:
+                    layout = create_shard(settings.sqlite_url, plan.shard, storage)
+                else:
+                    layout = init_db(sqlite_url, storage)
             except Exception as e:
                 console.print(
-                    f"[red][Err][/] something went wrong while indexing files: {e}"
+                    f"[red][Err][/] something went wrong while creating shard '{plan.shard.name}': {e}"
                 )
+                continue
 
-        if index_feeds:
-            status.update(
-                "[green]Indexing feeds and posts... Please wait, this may take a moment."
-            )
-            try:
-                urls = settings.feeds.urls
-                asyncio.run(index_feed(settings.sqlite_url, urls))
-            except Exception as e:
+            if layout != storage and not outdated:
+                outdated = True
                 console.print(
-                    f"[red][Err][/] something went wrong while indexing feeds: {e}"
+                    "[yellow][Migrate][/] the storage settings changed, run `housaku migrate` to apply them."
                 )
 
+            if plan.roots:
+                try:
+                    with (
+                        BatchWriter(
+                            sqlite_url,
+                            batch_size=batch_size,
+                            flush_interval=flush_interval,
+                            metrics=metrics,
+                        ) as writer,
+                        FileIndexer(
+                            sqlite_url,
+                            writer,
+                            max_workers=max_threads,
+                            executor=executor.lower(),
+                            hash_content=settings.files.hash_content,
+                            max_bytes=settings.files.max_document_size,
+                            passage_size=passage_size,
+                            metrics=metrics,
+                        ) as indexer,
+                    ):
+                        for dir in plan.roots:
+                            progress.update(
+                                task,
+                                description=f"Indexing documents from '{dir.name}'{into}",
+                            )
+                            indexer.index(
+                                dir, set(settings.files.exclude), plan.partition
+                            )
+                except Exception as e:
+                    console.print(
+                        f"[red][Err][/] something went wrong while indexing files: {e}"
+                    )
+
+            if plan.feeds:
+                progress.update(task, description=f"Indexing feeds and posts{into}")
+                try:
+                    asyncio.run(
+                        index_feed(
+                            sqlite_url,
+                            plan.feeds,
+                            passage_size,
+                            settings.feeds.max_connections,
+                            settings.feeds.max_connections_per_host,
+                            settings.feeds.timeout,
+                            settings.feeds.retries,
+                            parse_executor=settings.feeds.parse_executor,
+                            metrics=metrics,
+                        )
+                    )
+                except Exception as e:
+                    console.print(
+                        f"[red][Err][/] something went wrong while indexing feeds: {e}"
+                    )
+
+    indexed = metrics.get("files.indexed")
+    console.print(
+        f"[green][Ok][/] indexing done: {indexed} files "
+        f"({metrics.rate('files.indexed'):.1f}/s), "
+        f"{metrics.get('posts.indexed')} posts, "
+        f"{metrics.get('files.skipped')} skipped and "
+        f"{metrics.get('files.failed') + metrics.get('posts.failed')} failed "
+        f"in {metrics.elapsed:.2f}s.",
+        highlight=False,
+    )
+
+    if metrics_json:
         try:
-            status.update("[green]Wrapping things up...")
-            rebuild_fts(settings.sqlite_url)
-            console.print("[green][Ok][/] indexing done.")
-        except Exception as e:
+            metrics.write_json(metrics_json)
+        except OSError as e:
             console.print(
-                f"[red][Err][/] something went wrong while rebuilding the fts5 table: {e}"
+                f"[red][Err][/] something went wrong while writing the metrics: {e}"
             )
@@ -0,0 +1,44 @@
+import click
+from housaku.db import database_size, migrate_db, with_db
+from housaku.shards import list_databases
+from housaku.utils import console
+
+
+@click.command(
+    name="migrate",
+    help="Moves the stored documents to the storage layout set in the configuration file.",
+)
+@click.pass_context
+def migrate(ctx: click.Context) -> None:
+    from rich.filesize import decimal
+
+    settings = ctx.obj["settings"]
+    storage = settings.storage.layout()
+
+    try:
+        for database in list_databases(settings.sqlite_url):
+            with with_db(database.sqlite_url) as conn:
+                size = database_size(conn.cursor())
+
+            with console.status(
+                f"[green]Migrating '{database.name}'...", spinner="arrow"
+            ):
+                migrated = migrate_db(database.sqlite_url, storage)
+
+            if not migrated:
+                console.print(
+                    f"[yellow][Skip][/] '{database.name}' already uses \"{storage.mode}\" storage."
+                )
+                continue
+
+            with with_db(database.sqlite_url) as conn:
+                new_size = database_size(conn.cursor())
+
+            console.print(
+                f"[green][Ok][/] '{database.name}' moved to \"{storage.mode}\" storage! "
+                f"{decimal(size)} → {decimal(new_size)}"
+            )
+    except Exception as e:
+        console.print(
+            f"[red][Err][/] something went wrong while migrating the database: {e}"
+        )
@@ -1,5 +1,7 @@
+from pathlib import Path
 import click
 from housaku.db import init_db, clear_db
+from housaku.shards import unregister_shards
 from housaku.utils import console
 
 
@@ -12,8 +14,13 @@ def purge(ctx: click.Context) -> None:
     settings = ctx.obj["settings"]
 
     try:
+        # Shards are removed altogether, so they can be planned again.
+        for shard in unregister_shards(settings.sqlite_url):
+            for suffix in ("", "-wal", "-shm"):
+                Path(f"{shard.sqlite_url}{suffix}").unlink(missing_ok=True)
+
         clear_db(settings.sqlite_url)
-        init_db(settings.sqlite_url)
+        init_db(settings.sqlite_url, settings.storage.layout())
         console.print("[green][Ok][/] database purged correctly!")
     except Exception as e:
         console.print(f"[red][Err][/] something went wrong while purging database: {e}")
@@ -0,0 +1,35 @@
+import click
+from housaku.db import rebuild_fts
+from housaku.shards import list_databases
+from housaku.utils import console
+
+
+@click.command(
+    name="rebuild",
+    help="Rebuilds the full-text search index from the stored documents.",
+)
+@click.option(
+    "--shard",
+    "shards",
+    multiple=True,
+    help="Only rebuild this shard, while the rest can still be searched. Can be used multiple times.",
+)
+@click.pass_context
+def rebuild(ctx: click.Context, shards: tuple[str, ...]) -> None:
+    settings = ctx.obj["settings"]
+
+    try:
+        for database in list_databases(settings.sqlite_url, shards):
+            with console.status(
+                f"[green]Rebuilding the fts5 table of '{database.name}'...",
+                spinner="arrow",
+            ):
+                rebuild_fts(
+                    database.sqlite_url,
+                    settings.passages.size if settings.passages.enabled else None,
+                )
+        console.print("[green][Ok][/] full-text search index rebuilt!")
+    except Exception as e:
+        console.print(
+            f"[red][Err][/] something went wrong while rebuilding the fts5 table: {e}"
+        )
@@ -1,9 +1,6 @@
 import urllib.parse
 from time import perf_counter
 import rich_click as click
-from rich.table import Table
-from housaku.files import SUPPORTED_EXTENSIONS
-from housaku.search import search
 from housaku.utils import console
 
 
@@ -24,13 +21,66 @@ from housaku.utils import console
     default=10,
     help="Limit the number of documents returned.",
 )
+@click.option(
+    "-p",
+    "--page",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Page of results to show, each one with up to --limit documents.",
+)
+@click.option(
+    "--type",
+    "types",
+    multiple=True,
+    help="Only show documents of this type, like pdf or https. Can be repeated.",
+)
+@click.option(
+    "--path",
+    help="Only show documents under this directory or URL.",
+)
+@click.option(
+    "--since",
+    help="Only show documents modified or published on or after this date.",
+)
+@click.option(
+    "--until",
+    help="Only show documents modified or published on or before this date.",
+)
 @click.pass_context
-def search_documents(ctx: click.Context, query: str, limit: int) -> None:
+def search_documents(
+    ctx: click.Context,
+    query: str,
+    limit: int,
+    page: int,
+    types: tuple[str, ...],
+    path: str | None,
+    since: str | None,
+    until: str | None,
+) -> None:
+    from rich.table import Table
+    from rich.text import Text
+    from housaku.files import SUPPORTED_EXTENSIONS
+    from housaku.search import make_filters, merge_filters, parse_filters, search
+    from housaku.utils import highlight_snippet
+
     settings = ctx.obj["settings"]
     start_time = perf_counter()
 
     try:
-        results = search(settings.sqlite_url, query, limit)
+        # Filters can also be written in the query, like "type:pdf", but the
+        # options take precedence.
+        query, filters = parse_filters(query)
+        filters = merge_filters(filters, make_filters(types, path, since, until))
+
+        results = search(
+            settings.sqlite_url,
+            query,
+            limit,
+            settings.passages.enabled,
+            settings.search.snippet_size,
+            offset=(page - 1) * limit,
+            filters=filters,
+        )
     except Exception as e:
         console.print(f"[red][Err][/] Something went wrong with your query: {e}")
         return
@@ -46,16 +96,22 @@ def search_documents(ctx: click.Context, query: str, limit: int) -> None:
     table.add_column("Type", width=20)
     table.add_column("Document", overflow="ellipsis", highlight=False, no_wrap=True)
 
-    for uri, title, doc_type, content in results:
+    for uri, title, doc_type, content, result_page, highlights, _ in results:
         encoded_uri = urllib.parse.quote(uri, safe=":/")
+        if result_page:
+            encoded_uri = f"{encoded_uri}#page={result_page}"
+
         doc_title = title if title else uri
 
         link = f"[link={uri}]{doc_title}[/]"
         if doc_type in SUPPORTED_EXTENSIONS:
             link = f"[link=file://{encoded_uri}]{doc_title}[/]"
 
+        snippet = highlight_snippet(
+            content, highlights, settings.search.highlight_style, "dim"
+        )
         table.add_row(
-            doc_type, f"[bold underline]{link}[/] [dim]{content.replace("\n", "")}[/]"
+            doc_type, Text.from_markup(f"[bold underline]{link}[/] ").append(snippet)
         )
 
     console.print(table)
@@ -0,0 +1,82 @@
+import os
+import click
+from housaku.db import database_size, with_db
+from housaku.shards import get_shards, set_attached
+from housaku.utils import console
+
+
+@click.group(
+    name="shards",
+    help="Lists, attaches and detaches the shards documents are split across.",
+)
+def shards() -> None:
+    pass
+
+
+@shards.command(name="list", help="Lists every shard and how many documents it has.")
+@click.pass_context
+def list_shards(ctx: click.Context) -> None:
+    from rich.filesize import decimal
+    from rich.table import Table
+
+    settings = ctx.obj["settings"]
+
+    try:
+        with with_db(settings.sqlite_url) as conn:
+            registered = get_shards(conn.cursor())
+    except Exception as e:
+        console.print(f"[red][Err][/] something went wrong while listing shards: {e}")
+        return
+
+    if not registered:
+        console.print("[yellow]No shards found.[/]")
+        return
+
+    table = Table(title="Shards", expand=True)
+    table.add_column("Name")
+    table.add_column("Status")
+    table.add_column("Documents", justify="right")
+    table.add_column("Size", justify="right")
+    table.add_column("Path", overflow="fold")
+
+    for shard in registered:
+        status = "[green]attached[/]" if shard.attached else "[yellow]detached[/]"
+        if not os.path.exists(shard.sqlite_url):
+            table.add_row(shard.name, "[red]missing[/]", "-", "-", shard.sqlite_url)
+            continue
+
+        with with_db(shard.sqlite_url) as conn:
+            cursor = conn.cursor()
+            (count,) = cursor.execute("SELECT COUNT(*) FROM documents").fetchone()
+            size = database_size(cursor)
+
+        table.add_row(shard.name, status, f"{count}", decimal(size), shard.sqlite_url)
+
+    console.print(table)
+
+
+@shards.command(name="attach", help="Includes a shard in searches again.")
+@click.argument("name")
+@click.pass_context
+def attach(ctx: click.Context, name: str) -> None:
+    settings = ctx.obj["settings"]
+
+    if set_attached(settings.sqlite_url, name, True):
+        console.print(f"[green][Ok][/] shard '{name}' attached!")
+    else:
+        console.print(f"[red][Err][/] there is no shard named '{name}'.")
+
+
+@shards.command(
+    name="detach",
+    help="Leaves a shard out of searches, for example while it's rebuilt.",
+)
+@click.argument("name")
+@click.pass_context
+def detach(ctx: click.Context, name: str) -> None:
+    settings = ctx.obj["settings"]
+
+    if set_attached(settings.sqlite_url, name, False):
+        console.print(f"[green][Ok][/] shard '{name}' detached!")
+    else:
+        console.print(f"[red][Err][/] there is no shard named '{name}'.")
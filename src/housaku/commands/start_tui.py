@@ -1,5 +1,4 @@
 import click
-from housaku.tui import app as tui_app
 
 
 @click.command(
@@ -8,5 +7,7 @@ from housaku.tui import app as tui_app
 )
 @click.pass_context
 def start_tui(ctx: click.Context) -> None:
+    from housaku.tui import app as tui_app
+
     settings = ctx.obj["settings"]
     tui_app(settings).run()
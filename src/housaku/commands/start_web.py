@@ -1,6 +1,4 @@
 import rich_click as click
-from uvicorn import run
-from housaku.web import app as web_app
 
 
 @click.command(
@@ -14,4 +12,7 @@ from housaku.web import app as web_app
     help="Port.",
 )
 def start_web(port: int) -> None:
+    from uvicorn import run
+    from housaku.web import app as web_app
+
     run(web_app, host="127.0.0.1", port=port)
@@ -1,19 +1,91 @@
 import click
-from housaku.db import with_db
+from housaku.db import database_size, get_storage, table_sizes, with_db
+from housaku.shards import list_databases
 from housaku.utils import console
 
 
 @click.command(
     name="vacuum",
-    help="Reclaims unused spaced in the database.",
+    help="Reclaims unused spaced in the database, and reports its size and search latency.",
+)
+@click.option(
+    "--shard",
+    "shards",
+    multiple=True,
+    help="Only vacuum this shard. Can be used multiple times.",
 )
 @click.pass_context
-def vacuum(ctx: click.Context) -> None:
+def vacuum(ctx: click.Context, shards: tuple[str, ...]) -> None:
+    from rich.filesize import decimal
+    from rich.table import Table
+    from housaku.search import common_terms, time_searches
+
     settings = ctx.obj["settings"]
 
     try:
-        with with_db(settings.sqlite_url) as conn:
-            conn.execute("VACUUM")
-            console.print("[green][Ok][/] unused space has been reclaimed!")
+        databases = list_databases(settings.sqlite_url, shards)
     except Exception as e:
         console.print(f"[red][Err][/] something went wrong while reclaiming space: {e}")
+        return
+
+    terms = []
+    for database in databases:
+        name = f"'{database.name}' " if len(databases) > 1 else ""
+
+        try:
+            with with_db(database.sqlite_url) as conn:
+                size = database_size(conn.cursor())
+                conn.execute("VACUUM")
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+                cursor = conn.cursor()
+                new_size = database_size(cursor)
+                storage = get_storage(cursor)
+                sizes = table_sizes(cursor)
+                terms.extend(t for t in common_terms(cursor) if t not in terms)
+
+            console.print(
+                f"[green][Ok][/] {name}unused space has been reclaimed! "
+                f"{decimal(size)} → {decimal(new_size)}"
+            )
+        except Exception as e:
+            console.print(
+                f"[red][Err][/] something went wrong while reclaiming space: {e}"
+            )
+            continue
+
+        if not sizes:
+            continue
+
+        table = Table(
+            title=f"{name}storage: {storage.mode}, detail={storage.detail}, "
+            f"columnsize={int(storage.columnsize)}",
+            title_justify="left",
+            expand=True,
+        )
+        table.add_column("Table", ratio=3)
+        table.add_column("Size", justify="right", ratio=1)
+        for table_name, table_size in sizes.items():
+            table.add_row(table_name, decimal(table_size))
+
+        console.print(table)
+
+    terms = terms[:5]
+    if not terms:
+        return
+
+    # Searching for the most common terms right after vacuuming, with nothing
+    # cached yet, shows how long the slowest searches take.
+    try:
+        timings = sorted(time_searches(settings.sqlite_url, terms))
+    except Exception as e:
+        console.print(f"[red][Err][/] something went wrong while searching: {e}")
+        return
+
+    p50 = timings[len(timings) // 2] * 1000
+    p90 = timings[int(len(timings) * 0.9)] * 1000
+    console.print(
+        f"Searched {len(terms)} common terms ({', '.join(terms)}) "
+        f"{len(timings) // len(terms)} times: p50 {p50:.1f}ms, "
+        f"p90 {p90:.1f}ms, max {timings[-1] * 1000:.1f}ms"
+    )
@@ -0,0 +1,195 @@
+from multiprocessing import cpu_count
+import rich_click as click
+from housaku.files import EXECUTORS
+from housaku.utils import console, set_verbose
+
+
+@click.command(
+    name="watch",
+    short_help="Keep the index up to date while files change.",
+)
+@click.option(
+    "-t",
+    "--max-threads",
+    type=click.IntRange(min=1),
+    default=max(1, cpu_count() // 2),
+    help="Maximum number of threads to use for indexing (default: half of CPU cores).",
+)
+@click.option(
+    "--executor",
+    type=click.Choice(EXECUTORS, case_sensitive=False),
+    default="auto",
+    help="Where to extract text from documents. 'auto' uses processes for PDFs, EPUBs and Office documents, and threads for everything else.",
+)
+@click.option(
+    "--skip-scan",
+    is_flag=True,
+    help="Don't index what changed while housaku wasn't watching before starting.",
+)
+@click.option(
+    "-v",
+    "--verbose",
+    is_flag=True,
+    help="Show a message for every document indexed, skipped or removed.",
+)
+@click.pass_context
+def watch(
+    ctx: click.Context,
+    max_threads: int,
+    executor: str,
+    skip_scan: bool,
+    verbose: bool,
+) -> None:
+    import asyncio
+    import threading
+    from contextlib import ExitStack
+    from housaku.db import BatchWriter, init_db
+    from housaku.feeds import index_feed
+    from housaku.files import FileIndexer
+    from housaku.metrics import Metrics
+    from housaku.shards import create_shard, plan_shards
+    from housaku.watch import Watcher, apply_changes
+
+    settings = ctx.obj["settings"]
+    passage_size = settings.passages.size if settings.passages.enabled else None
+    exclude = set(settings.files.exclude)
+    storage = settings.storage.layout()
+    sharded = settings.shards.mode != "none"
+
+    plans = plan_shards(
+        settings.sqlite_url,
+        list(dict.fromkeys(settings.files.include)),
+        settings.feeds.urls,
+        settings.shards.mode,
+        settings.shards.count,
+    )
+
+    set_verbose(verbose)
+    metrics = Metrics()
+
+    for plan in plans:
+        if sharded:
+            create_shard(settings.sqlite_url, plan.shard, storage)
+        else:
+            init_db(plan.shard.sqlite_url, storage)
+
+    # Files and feeds of a shard share its writer, so there is a single one
+    # writing to every database.
+    writers: dict[str, BatchWriter] = {}
+
+    def index_feeds() -> None:
+        for plan in plans:
+            if not plan.feeds:
+                continue
+
+            try:
+                asyncio.run(
+                    index_feed(
+                        plan.shard.sqlite_url,
+                        plan.feeds,
+                        passage_size,
+                        settings.feeds.max_connections,
+                        settings.feeds.max_connections_per_host,
+                        settings.feeds.timeout,
+                        settings.feeds.retries,
+                        writer=writers[plan.shard.name],
+                        parse_executor=settings.feeds.parse_executor,
+                        metrics=metrics,
+                    )
+                )
+            except Exception as e:
+                console.print(
+                    f"[red][Err][/] something went wrong while indexing feeds: {e}"
+                )
+
+    # Feeds can't be watched, so they are just checked again every
+    # `feed_interval` seconds. The thread sleeps in between.
+    stopped = threading.Event()
+
+    def poll_feeds() -> None:
+        while not stopped.wait(settings.watch.feed_interval):
+            index_feeds()
+
+    with ExitStack() as stack:
+        targets = []
+        for plan in plans:
+            writer = stack.enter_context(
+                BatchWriter(plan.shard.sqlite_url, metrics=metrics)
+            )
+            writers[plan.shard.name] = writer
+            if not plan.roots:
+                continue
+
+            indexer = stack.enter_context(
+                FileIndexer(
+                    plan.shard.sqlite_url,
+                    writer,
+                    max_workers=max_threads,
+                    executor=executor.lower(),
+                    hash_content=settings.files.hash_content,
+                    max_bytes=settings.files.max_document_size,
+                    passage_size=passage_size,
+                    metrics=metrics,
+                )
+            )
+            targets.append((plan, indexer))
+
+        roots = list(dict.fromkeys(root for plan, _ in targets for root in plan.roots))
+        try:
+            watcher = stack.enter_context(
+                Watcher(
+                    roots,
+                    exclude,
+                    settings.watch.debounce,
+                    settings.watch.max_delay,
+                )
+            )
+        except OSError as e:
+            console.print(
+                f"[red][Err][/] something went wrong while watching files: {e}"
+            )
+            return
+
+        # Watches are set up before the first scan, so nothing that changes
+        # while it runs is missed.
+        if not skip_scan:
+            with console.status("Indexing what changed since the last run..."):
+                for plan, indexer in targets:
+                    for dir in plan.roots:
+                        indexer.index(dir, exclude, plan.partition)
+
+                index_feeds()
+
+        poller = None
+        if settings.feeds.urls and settings.watch.feed_interval > 0:
+            poller = threading.Thread(target=poll_feeds, daemon=True)
+            poller.start()
+
+        console.print(
+            f"[green][Ok][/] watching {len(roots)} directories for changes, press Ctrl+C to stop."
+        )
+
+        def on_changes(changes) -> None:
+            indexed = metrics.get("files.indexed")
+            try:
+                apply_changes(targets, changes, exclude)
+            except Exception as e:
+                console.print(
+                    f"[red][Err][/] something went wrong while indexing files: {e}"
+                )
+                return
+
+            console.print(
+                f"[green][Ok][/] {metrics.get('files.indexed') - indexed} files indexed "
+                f"and {len(changes.deleted)} removed.",
+                highlight=False,
+            )
+
+        try:
+            watcher.run(on_changes)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stopped.set()
+            if poller:
+                poller.join()
@@ -1,9 +1,286 @@
+import queue
+import re
 import sqlite3
+import threading
+import zlib
 from contextlib import contextmanager
+from pathlib import Path
+from time import monotonic
+from typing import Callable
+from housaku.metrics import Metrics
+from housaku.models import Doc, Storage
+from housaku.utils import console, split_passages, uri_dir
 
+UPSERT_DOCUMENT = """
+INSERT INTO documents (
+    uri, title, type, body, last_modified, size, inode, content_hash, truncated, dir
+)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(uri) DO UPDATE SET
+    dir = excluded.dir,
+    title = excluded.title,
+    type = excluded.type,
+    body = excluded.body,
+    last_modified = excluded.last_modified,
+    size = excluded.size,
+    inode = excluded.inode,
+    content_hash = excluded.content_hash,
+    truncated = excluded.truncated
+"""
 
-def init_db(sqlite_url: str) -> None:
-    conn = sqlite3.connect(sqlite_url)
+INSERT_PASSAGE = """
+INSERT INTO passages (document_id, page, body)
+VALUES (?, ?, ?)
+"""
+
+INSERT_DOCUMENT_FTS = """
+INSERT INTO documents_fts (rowid, uri, body)
+VALUES (?, ?, ?)
+"""
+
+BUMP_GENERATION = """
+INSERT INTO meta (key, value) VALUES ('generation', 1)
+ON CONFLICT(key) DO UPDATE SET value = value + 1
+"""
+
+TOUCH_DOCUMENT = """
+UPDATE documents
+SET last_modified = ?, size = ?, inode = ?
+WHERE uri = ?
+"""
+
+# Lengths of the prefixes indexed by the FTS5 tables.
+FTS_PREFIXES = "2 3"
+
+# Documents can be stored in different ways, trading the size of the database
+# for what can be done with it:
+# - "plain" keeps their text as it is.
+# - "compressed" keeps it compressed with zlib, and the FTS5 table reads it
+#   through a view that decompresses it.
+# - "contentless" only keeps an excerpt of it, and the FTS5 table doesn't keep
+#   any text at all, so previews are made from the excerpts. Since the text is
+#   gone, documents can't be moved to any other mode without indexing them
+#   again.
+STORAGE_MODES = ("plain", "compressed", "contentless")
+FTS_DETAILS = ("full", "column", "none")
+
+# Deleting from contentless FTS5 tables needs `contentless_delete`.
+CONTENTLESS_SQLITE_VERSION = (3, 43, 0)
+
+# Number of words kept from every document in "contentless" mode, which is
+# the largest snippet that can be shown.
+EXCERPT_SIZE = 64
+
+COMPRESSION_LEVEL = 6
+
+# Columns added after the documents table was first released, so existing
+# databases need to be migrated.
+
+DOCUMENT_COLUMNS = {
+    "size": "INTEGER",
+    "inode": "INTEGER",
+    "content_hash": "TEXT",
+    "truncated": "INTEGER NOT NULL DEFAULT 0",
+    "dir": "TEXT",
+}
+
+# Triggers that keep the FTS5 tables in sync with the tables they index.
+DOCUMENT_TRIGGERS = ("documents_ai", "documents_ad", "documents_au")
+PASSAGE_TRIGGERS = ("passages_ai", "passages_ad")
+
+
+# Values that are already compressed, or were never compressed, are returned
+# as they are, so both functions can be applied to any row.
+def compress(value: str | bytes | None) -> bytes | None:
+    if isinstance(value, str):
+        return zlib.compress(value.encode(), COMPRESSION_LEVEL)
+
+    return value
+
+
+def decompress(value: str | bytes | None) -> str | None:
+    if isinstance(value, bytes):
+        return zlib.decompress(value).decode()
+
+    return value
+
+
+def excerpt(value: str | None) -> str | None:
+    if value is None:
+        return None
+
+    return " ".join(value.split(maxsplit=EXCERPT_SIZE)[:EXCERPT_SIZE])
+
+
+# The functions used by the views and triggers of the "compressed" mode, and
+# by migrations, have to be registered on every connection.
+def register_functions(conn: sqlite3.Connection) -> None:
+    conn.create_function("housaku_compress", 1, compress, deterministic=True)
+    conn.create_function("housaku_decompress", 1, decompress, deterministic=True)
+    conn.create_function("housaku_excerpt", 1, excerpt, deterministic=True)
+
+
+def check_storage(storage: Storage) -> None:
+    if storage.mode not in STORAGE_MODES:
+        raise ValueError(f'Invalid storage mode "{storage.mode}"')
+
+    if storage.detail not in FTS_DETAILS:
+        raise ValueError(f'Invalid detail "{storage.detail}"')
+
+    if storage.mode == "contentless":
+        if sqlite3.sqlite_version_info < CONTENTLESS_SQLITE_VERSION:
+            raise ValueError(
+                f"contentless storage needs SQLite 3.43 or newer, not {sqlite3.sqlite_version}"
+            )
+
+        if not storage.columnsize:
+            raise ValueError("contentless storage needs columnsize to be enabled")
+
+
+# Reads the storage layout of an existing database from the definition of its
+# FTS5 table, or returns None if it doesn't have one yet.
+def get_storage(cursor: sqlite3.Cursor) -> Storage | None:
+    cursor.execute("SELECT sql FROM sqlite_master WHERE name = 'documents_fts';")
+    row = cursor.fetchone()
+    if row is None:
+        return None
+
+    (sql,) = row
+    if "content=''" in sql:
+        mode = "contentless"
+    elif "documents_text" in sql:
+        mode = "compressed"
+    else:
+        mode = "plain"
+
+    detail = re.search(r"detail=(\w+)", sql)
+    return Storage(
+        mode,
+        detail[1] if detail else "full",
+        "columnsize=0" not in sql,
+        "UNINDEXED" not in sql,
+    )
+
+
+def create_fts(cursor: sqlite3.Cursor, storage: Storage) -> None:
+    check_storage(storage)
+
+    options = f"detail={storage.detail}"
+    if not storage.columnsize:
+        options += ", columnsize=0"
+
+    if storage.mode == "compressed":
+        cursor.execute("""
+        CREATE VIEW IF NOT EXISTS documents_text AS
+        SELECT rowid AS id, uri, housaku_decompress(body) AS body
+        FROM documents;
+        """)
+        content = "content=documents_text, content_rowid=id"
+    elif storage.mode == "contentless":
+        content = "content='', contentless_delete=1"
+    else:
+        content = "content=documents"
+
+    # Creates virtual FTS5 table for full-text search. The prefix indexes
+    # keep queries like "hou*", used while typing, from scanning every term.
+    cursor.execute(f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5 (
+        {"uri" if storage.index_uri else "uri UNINDEXED"},
+        body,
+        {content},
+        tokenize="porter unicode61",
+        prefix='{FTS_PREFIXES}',
+        {options}
+    );
+    """)
+
+    # Passages are already snippet-sized, so they are always stored as they
+    # are.
+    cursor.execute(f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS passages_fts USING fts5 (
+        body,
+        content=passages,
+        tokenize="porter unicode61",
+        prefix='{FTS_PREFIXES}',
+        {options}
+    );
+    """)
+
+
+def create_triggers(cursor: sqlite3.Cursor, storage: Storage) -> None:
+    # In "contentless" mode the text of documents is only known when they are
+    # written, so `write_document()` indexes them and the triggers only have
+    # to remove them.
+    if storage.mode == "contentless":
+        cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS documents_ad AFTER DELETE ON documents BEGIN
+            DELETE FROM documents_fts WHERE rowid = old.rowid;
+        END;
+        """)
+        cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS documents_au AFTER UPDATE OF uri, body ON documents BEGIN
+            DELETE FROM documents_fts WHERE rowid = old.rowid;
+        END;
+        """)
+    else:
+        old, new = (
+            ("housaku_decompress(old.body)", "housaku_decompress(new.body)")
+            if storage.mode == "compressed"
+            else ("old.body", "new.body")
+        )
+        cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS documents_ai AFTER INSERT ON documents BEGIN
+            INSERT INTO documents_fts (rowid, uri, body)
+            VALUES (new.rowid, new.uri, {new});
+        END;
+        """)
+        cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS documents_ad AFTER DELETE ON documents BEGIN
+            INSERT INTO documents_fts (documents_fts, rowid, uri, body)
+            VALUES ('delete', old.rowid, old.uri, {old});
+        END;
+        """)
+        cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS documents_au AFTER UPDATE OF uri, body ON documents BEGIN
+            INSERT INTO documents_fts (documents_fts, rowid, uri, body)
+            VALUES ('delete', old.rowid, old.uri, {old});
+            INSERT INTO documents_fts (rowid, uri, body)
+            VALUES (new.rowid, new.uri, {new});
+        END;
+        """)
+
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS passages_ai AFTER INSERT ON passages BEGIN
+        INSERT INTO passages_fts (rowid, body) VALUES (new.rowid, new.body);
+    END;
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS passages_ad AFTER DELETE ON passages BEGIN
+        INSERT INTO passages_fts (passages_fts, rowid, body)
+        VALUES ('delete', old.rowid, old.body);
+    END;
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS documents_passages_ad AFTER DELETE ON documents BEGIN
+        DELETE FROM passages WHERE document_id = old.rowid;
+    END;
+    """)
+
+
+def drop_fts(cursor: sqlite3.Cursor) -> None:
+    for trigger in (*DOCUMENT_TRIGGERS, *PASSAGE_TRIGGERS):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {trigger};")
+
+    cursor.execute("DROP TABLE IF EXISTS documents_fts;")
+    cursor.execute("DROP TABLE IF EXISTS passages_fts;")
+    cursor.execute("DROP VIEW IF EXISTS documents_text;")
+
+
+# Creates the database, or migrates an existing one, and returns the storage
+# layout it uses. Existing databases keep their layout, since changing it is
+# done explicitly with `migrate_db()`.
+def init_db(sqlite_url: str, storage: Storage = Storage()) -> Storage:
+    conn = connect(sqlite_url)
     cursor = conn.cursor()
 
     # Creates the documents table.
@@ -13,23 +290,115 @@ def init_db(sqlite_url: str) -> None:
         title TEXT,
         type TEXT NOT NULL,
         body TEXT NOT NULL,
-        last_modified TEXT
+        last_modified TEXT,
+        size INTEGER,
+        inode INTEGER,
+        content_hash TEXT,
+        truncated INTEGER NOT NULL DEFAULT 0,
+        dir TEXT
     );
     """)
 
+    cursor.execute("PRAGMA table_info(documents);")
+    columns = {row[1] for row in cursor.fetchall()}
+    for column, column_type in DOCUMENT_COLUMNS.items():
+        if column not in columns:
+            cursor.execute(f"ALTER TABLE documents ADD COLUMN {column} {column_type};")
+
     # Adds index for `uri` column.
     cursor.execute("CREATE INDEX IF NOT EXISTS idx_uri ON documents(uri);")
 
-    # Creates virtual FTS5 table for full-text search
+    # Adds indexes for the columns used to filter search results.
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_type ON documents(type);")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_dir ON documents(dir);")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_last_modified ON documents(CAST(last_modified AS REAL));"
+    )
+
+    # Fills the `dir` column of documents indexed before it existed.
+    cursor.execute("SELECT rowid, uri FROM documents WHERE dir IS NULL;")
+    missing = [(uri_dir(uri), rowid) for rowid, uri in cursor.fetchall()]
+    if missing:
+        cursor.executemany("UPDATE documents SET dir = ? WHERE rowid = ?;", missing)
+        conn.commit()
+
+    storage = get_storage(cursor) or storage
+
+    # FTS5 tables created before they had prefix indexes are dropped here and
+    # rebuilt from their content tables once they are created again.
+    outdated_fts = []
+    for table in ("documents_fts", "passages_fts"):
+        cursor.execute("SELECT sql FROM sqlite_master WHERE name = ?;", (table,))
+        row = cursor.fetchone()
+        if row and "prefix" not in row[0]:
+            cursor.execute(f"DROP TABLE {table};")
+            outdated_fts.append(table)
+
+    # Creates the passages table, which holds long documents split into
+    # smaller chunks, and has its own FTS5 table.
     cursor.execute("""
-    CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5 (
-        uri,
-        body,
-        content=documents,
-        tokenize="porter unicode61"
+    CREATE TABLE IF NOT EXISTS passages (
+        document_id INTEGER NOT NULL,
+        page INTEGER,
+        body TEXT NOT NULL
+    );
+    """)
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_passages_document ON passages(document_id);"
+    )
+
+    # Holds counters like the index generation, which changes every time the
+    # documents are modified so that cached results can be invalidated.
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
     );
     """)
 
+    # Remembers the validators and entries of every feed from the last time it
+    # was fetched, so it is only downloaded and parsed again if it changed.
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS feeds (
+        url TEXT PRIMARY KEY,
+        etag TEXT,
+        last_modified TEXT,
+        entry_ids TEXT NOT NULL DEFAULT '[]',
+        checked_at REAL
+    );
+    """)
+
+    # Registry of the shards documents are split across, if any.
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS shards (
+        name TEXT PRIMARY KEY,
+        sqlite_url TEXT NOT NULL,
+        attached INTEGER NOT NULL DEFAULT 1
+    );
+    """)
+
+    # Keeps the FTS5 tables in sync with the documents table. If the triggers
+    # didn't exist yet, the FTS5 table is rebuilt once so that it matches the
+    # content it is going to be incrementally updated from.
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger';")
+    triggers = {name for (name,) in cursor.fetchall()}
+    missing_triggers = "documents_ad" not in triggers
+
+    create_fts(cursor, storage)
+    create_triggers(cursor, storage)
+
+    if missing_triggers and "documents_fts" not in outdated_fts:
+        outdated_fts.append("documents_fts")
+
+    # Contentless tables have nothing to be rebuilt from, and new ones are
+    # empty anyway.
+    if storage.mode == "contentless" and "documents_fts" in outdated_fts:
+        outdated_fts.remove("documents_fts")
+
+    for table in outdated_fts:
+        cursor.execute(f"INSERT INTO {table}({table}) VALUES('rebuild');")
+        conn.commit()
+
     # Settings
     cursor.execute("PRAGMA journal_mode = WAL;")
     cursor.execute("PRAGMA foreign_keys = ON;")
@@ -43,14 +412,84 @@ def init_db(sqlite_url: str) -> None:
     conn.commit()
     conn.close()
 
+    return storage
+
+
+# Moves the documents to another storage layout and recreates the FTS5 tables
+# with it, all in one transaction. Returns False if the database already used
+# that layout.
+def migrate_db(sqlite_url: str, storage: Storage) -> bool:
+    check_storage(storage)
+    current = init_db(sqlite_url, storage)
+    if current == storage:
+        return False
+
+    if current.mode == "contentless":
+        raise ValueError(
+            "documents stored in contentless mode have to be purged and indexed again"
+        )
+
+    conn = connect(sqlite_url)
+    cursor = conn.cursor()
+
+    try:
+        cursor.execute("BEGIN;")
+        drop_fts(cursor)
+
+        if storage.mode == "compressed":
+            cursor.execute("UPDATE documents SET body = housaku_compress(body);")
+        elif current.mode == "compressed":
+            cursor.execute("UPDATE documents SET body = housaku_decompress(body);")
+
+        create_fts(cursor, storage)
+
+        # The text of documents is indexed before it's replaced by excerpts,
+        # and the triggers are only created afterwards so they don't remove it
+        # from the index again.
+        if storage.mode == "contentless":
+            cursor.execute(
+                "INSERT INTO documents_fts (rowid, uri, body) SELECT rowid, uri, body FROM documents;"
+            )
+            cursor.execute("UPDATE documents SET body = housaku_excerpt(body);")
+        else:
+            cursor.execute(
+                "INSERT INTO documents_fts(documents_fts) VALUES('rebuild');"
+            )
+
+        cursor.execute("INSERT INTO passages_fts(passages_fts) VALUES('rebuild');")
+        create_triggers(cursor, storage)
+        cursor.execute(BUMP_GENERATION)
+
+        conn.commit()
+    except:
+        conn.rollback()
+        conn.close()
+        raise
+
+    # The space taken by the old layout is only given back once vacuumed.
+    cursor.execute("VACUUM;")
+    conn.close()
+
+    return True
+
 
 def clear_db(sqlite_url: str) -> None:
-    conn = sqlite3.connect(sqlite_url)
+    conn = connect(sqlite_url)
     cursor = conn.cursor()
 
+    drop_fts(cursor)
     cursor.execute("DROP TABLE IF EXISTS documents;")
-    cursor.execute("DROP TABLE IF EXISTS documents_fts;")
+    cursor.execute("DROP TABLE IF EXISTS passages;")
+    cursor.execute("DROP TABLE IF EXISTS feeds;")
     cursor.execute("DROP INDEX IF EXISTS idx_uri;")
+    cursor.execute("DROP INDEX IF EXISTS idx_type;")
+    cursor.execute("DROP INDEX IF EXISTS idx_dir;")
+    cursor.execute("DROP INDEX IF EXISTS idx_last_modified;")
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);"
+    )
+    cursor.execute(BUMP_GENERATION)
+    conn.commit()
 
     cursor.execute("VACUUM;")
 
@@ -58,19 +497,150 @@ def clear_db(sqlite_url: str) -> None:
     conn.close()
 
 
-def rebuild_fts(sqlite_url: str) -> None:
-    conn = sqlite3.connect(sqlite_url)
+def rebuild_fts(sqlite_url: str, passage_size: int | None = None) -> None:
+    conn = connect(sqlite_url)
     cursor = conn.cursor()
 
-    cursor.execute("INSERT INTO documents_fts(documents_fts) VALUES('rebuild');")
+    # Documents stored in "contentless" mode only have an excerpt left, so
+    # neither their passages nor their FTS5 table can be rebuilt from it.
+    contentless = (get_storage(cursor) or Storage()).mode == "contentless"
+
+    # Documents indexed before passages were enabled are split using their
+    # stored body, so they won't have page numbers.
+    if passage_size and not contentless:
+        cursor.execute("""
+        SELECT rowid, housaku_decompress(body) FROM documents
+        WHERE rowid NOT IN (SELECT document_id FROM passages)
+        """)
+        for rowid, body in cursor.fetchall():
+            cursor.executemany(
+                INSERT_PASSAGE,
+                [
+                    (rowid, page, text)
+                    for page, text in split_passages([(None, body)], passage_size)
+                ],
+            )
+
+    if not contentless:
+        cursor.execute("INSERT INTO documents_fts(documents_fts) VALUES('rebuild');")
+
+    cursor.execute("INSERT INTO passages_fts(passages_fts) VALUES('rebuild');")
+    cursor.execute(BUMP_GENERATION)
 
     conn.commit()
     conn.close()
 
 
+def bump_generation(cursor: sqlite3.Cursor) -> None:
+    cursor.execute(BUMP_GENERATION)
+
+
+def get_generation(cursor: sqlite3.Cursor) -> int:
+    cursor.execute("SELECT value FROM meta WHERE key = 'generation';")
+    result = cursor.fetchone()
+    return result[0] if result else 0
+
+
+# Size of the database in bytes, including the pages that are free but not
+# given back yet.
+def database_size(cursor: sqlite3.Cursor) -> int:
+    (page_count,) = cursor.execute("PRAGMA page_count;").fetchone()
+    (page_size,) = cursor.execute("PRAGMA page_size;").fetchone()
+    return page_count * page_size
+
+
+# Bytes taken by every table along with its indexes, where the shadow tables
+# of the FTS5 tables are counted as part of them. It's empty if SQLite wasn't
+# compiled with the `dbstat` table.
+def table_sizes(cursor: sqlite3.Cursor) -> dict[str, int]:
+    try:
+        cursor.execute("""
+        SELECT s.name, m.tbl_name, SUM(s.pgsize)
+        FROM dbstat AS s
+        LEFT JOIN sqlite_master AS m ON m.name = s.name
+        GROUP BY s.name
+        """)
+        rows = cursor.fetchall()
+    except sqlite3.OperationalError:
+        return {}
+
+    sizes: dict[str, int] = {}
+    for name, table, size in rows:
+        table = table or name
+        for fts in ("documents_fts", "passages_fts"):
+            if table.startswith(f"{fts}_"):
+                table = fts
+
+        sizes[table] = sizes.get(table, 0) + size
+
+    return dict(sorted(sizes.items(), key=lambda item: item[1], reverse=True))
+
+
+def write_document(
+    cursor: sqlite3.Cursor, doc: Doc, storage: Storage = Storage()
+) -> None:
+    body = doc.body
+    if storage.mode == "compressed":
+        body = compress(body)
+    elif storage.mode == "contentless":
+        body = excerpt(body)
+
+    cursor.execute(
+        f"{UPSERT_DOCUMENT} RETURNING rowid",
+        (
+            doc.uri,
+            doc.title,
+            doc.doc_type,
+            body,
+            doc.last_modified,
+            doc.size,
+            doc.inode,
+            doc.content_hash,
+            doc.truncated,
+            uri_dir(doc.uri),
+        ),
+    )
+    (rowid,) = cursor.fetchone()
+
+    if storage.mode == "contentless":
+        cursor.execute(INSERT_DOCUMENT_FTS, (rowid, doc.uri, doc.body))
+
+    # Passages are always replaced, so that documents don't keep stale ones
+    # if passages were disabled since they were last indexed.
+    cursor.execute("DELETE FROM passages WHERE document_id = ?", (rowid,))
+    if doc.passages:
+        cursor.executemany(
+            INSERT_PASSAGE,
+            [(rowid, page, body) for page, body in doc.passages],
+        )
+
+
+def connect(sqlite_url: str, read_only: bool = False) -> sqlite3.Connection:
+    if read_only:
+        conn = sqlite3.connect(
+            f"{Path(sqlite_url).resolve().as_uri()}?mode=ro",
+            uri=True,
+            check_same_thread=False,
+            cached_statements=256,
+        )
+    else:
+        conn = sqlite3.connect(sqlite_url)
+
+    # These settings and functions are per connection, so they need to be
+    # applied every time.
+    register_functions(conn)
+    conn.execute("PRAGMA busy_timeout = 5000;")
+    conn.execute("PRAGMA synchronous = NORMAL;")
+    conn.execute("PRAGMA temp_store = MEMORY;")
+    conn.execute("PRAGMA cache_size = -32000;")
+    conn.execute("PRAGMA mmap_size = 268435456;")
+
+    return conn
+
+
 @contextmanager
 def with_db(sqlite_url: str):
-    conn = sqlite3.connect(sqlite_url)
+    conn = connect(sqlite_url)
 
     try:
         yield conn
@@ -80,3 +650,236 @@ def with_db(sqlite_url: str):
         raise
     finally:
         conn.close()
+
+
+# Single writer that drains a bounded queue of statements on its own thread and
+# commits them in batches of `batch_size` statements or every `flush_interval`
+# seconds, whichever comes first. The queue is bounded both by the number of
+# statements and by the size of the documents waiting in it, so a few huge
+# documents can't pile up in memory either.
+class BatchWriter:
+    _stop = object()
+
+    def __init__(
+        self,
+        sqlite_url: str,
+        batch_size: int = 500,
+        flush_interval: float = 0.2,
+        max_queue_size: int | None = None,
+        metrics: Metrics | None = None,
+        max_queue_bytes: int = 64 * 1024 * 1024,
+    ) -> None:
+        self.sqlite_url = sqlite_url
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue_bytes = max_queue_bytes
+        self.metrics = metrics or Metrics()
+        self.storage = Storage()
+
+        self._queue = queue.Queue(maxsize=max_queue_size or batch_size * 4)
+        self._queued_bytes = 0
+        self._room = threading.Condition()
+        self._thread = threading.Thread(
+            target=self._run,
+            name="housaku-writer",
+            daemon=True,
+        )
+
+    def __enter__(self) -> "BatchWriter":
+        self.start()
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def close(self) -> None:
+        if self._thread.is_alive():
+            try:
+                self._put(self._stop)
+            except RuntimeError:
+                pass
+            self._thread.join()
+
+    # Statements that change what searches return must set `invalidates`, so
+    # the generation is only bumped, and cached results dropped, by batches
+    # that really changed documents.
+    def execute(self, sql: str, params: tuple = (), invalidates: bool = False) -> None:
+        self._put((lambda cursor: cursor.execute(sql, params), invalidates, 0))
+
+    def upsert(self, doc: Doc) -> None:
+        size = len(doc.body) + sum(len(text) for _, text in doc.passages or ())
+        self._reserve(size)
+        try:
+            self._put(
+                (lambda cursor: write_document(cursor, doc, self.storage), True, size)
+            )
+        except RuntimeError:
+            self._release(size)
+            raise
+
+    # Touches don't change the text of documents, but `since:` and `until:`
+    # filter on their modification time, so cached results are dropped too.
+    def touch(self, uri: str, last_modified: float, size: int, inode: int) -> None:
+        self.execute(
+            TOUCH_DOCUMENT, (last_modified, size, inode, uri), invalidates=True
+        )
+
+    # Waits for room in the queue only while the writer thread is alive, so
+    # producers fail instead of blocking forever if it ever stops.
+    def _put(self, item: object) -> None:
+        while True:
+            if not self._thread.is_alive():
+                raise RuntimeError("the writer is not running")
+
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    # Waits until the documents already queued leave room for `size` more
+    # bytes, counting one per character of text. A document larger than the
+    # limit still gets in on its own.
+    def _reserve(self, size: int) -> None:
+        with self._room:
+            while (
+                self._queued_bytes and self._queued_bytes + size > self.max_queue_bytes
+            ):
+                if not self._thread.is_alive():
+                    raise RuntimeError("the writer is not running")
+
+                self._room.wait(0.1)
+
+            self._queued_bytes += size
+            self.metrics.gauge("writer.queue_bytes", self._queued_bytes)
+
+    def _release(self, size: int) -> None:
+        with self._room:
+            self._queued_bytes -= size
+            self._room.notify_all()
+
+    def _run(self) -> None:
+        conn = connect(self.sqlite_url)
+        self.storage = get_storage(conn.cursor()) or Storage()
+
+        try:
+            stopped = False
+            while not stopped:
+                item = self._queue.get()
+                if item is self._stop:
+                    break
+
+                batch = [item]
+                deadline = monotonic() + self.flush_interval
+                while len(batch) < self.batch_size:
+                    timeout = deadline - monotonic()
+                    if timeout <= 0:
+                        break
+
+                    try:
+                        item = self._queue.get(timeout=timeout)
+                    except queue.Empty:
+                        break
+
+                    if item is self._stop:
+                        stopped = True
+                        break
+
+                    batch.append(item)
+
+                self.metrics.gauge("writer.queue", self._queue.qsize())
+                with self.metrics.time("writer.commit"):
+                    self._commit(conn, batch)
+                self.metrics.count("writer.writes", len(batch))
+                self._release(sum(size for _, _, size in batch))
+        finally:
+            conn.close()
+
+    def _commit(
+        self, conn: sqlite3.Connection, batch: list[tuple[Callable, bool, int]]
+    ) -> None:
+        invalidates = any(invalidates for _, invalidates, _ in batch)
+        try:
+            with conn:
+                cursor = conn.cursor()
+                for write, _, _ in batch:
+                    write(cursor)
+                if invalidates:
+                    bump_generation(cursor)
+            return
+        except Exception:
+            pass
+
+        # Something in the batch failed, so we retry each statement on its
+        # own to avoid losing the rest of them.
+        for write, _, _ in batch:
+            try:
+                with conn:
+                    write(conn.cursor())
+            except Exception as e:
+                console.print(f"[red][Err][/] something went wrong while writing: {e}")
+
+        if invalidates:
+            with conn:
+                bump_generation(conn.cursor())
+
+
+# Pool of read-only connections that are reused across searches, so they keep
+# their page cache and prepared statements. Connections are only created when
+# needed, up to `size`, and can be used from any thread but only by one of
+# them at a time.
+class ConnectionPool:
+    def __init__(self, sqlite_url: str, size: int = 4) -> None:
+        self.sqlite_url = sqlite_url
+        self.size = size
+
+        self._connections = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+
+            self._connections.put(conn)
+
+    def close(self) -> None:
+        with self._lock:
+            while self._created:
+                self._connections.get().close()
+                self._created -= 1
+
+    def _acquire(self) -> sqlite3.Connection:
+        try:
+            return self._connections.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                conn = connect(self.sqlite_url, read_only=True)
+                self._created += 1
+                return conn
+
+        return self._connections.get()
+
+
+_pools: dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(sqlite_url: str, size: int = 4) -> ConnectionPool:
+    with _pools_lock:
+        pool = _pools.get(sqlite_url)
+        if pool is None:
+            pool = _pools[sqlite_url] = ConnectionPool(sqlite_url, size)
+
+        return pool
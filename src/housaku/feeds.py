@@ -1,71 +1,422 @@
-from typing import Any
+from collections import defaultdict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import get_context
+from time import time
+from typing import Any, Callable, Mapping, NamedTuple
 from urllib.parse import urlparse
 import asyncio
+import calendar
+import json
+import os
+import random
 import aiohttp
 import feedparser
-from housaku.db import with_db
-from housaku.utils import clean_html, console
+from housaku.db import BatchWriter, with_db
+from housaku.models import Doc
+from housaku.metrics import Metrics
+from housaku.utils import clean_html, console, log, split_passages
 
+UPSERT_FEED = """
+INSERT INTO feeds (url, etag, last_modified, entry_ids, checked_at)
+VALUES (?, ?, ?, ?, ?)
+ON CONFLICT(url) DO UPDATE SET
+    etag = excluded.etag,
+    last_modified = excluded.last_modified,
+    entry_ids = excluded.entry_ids,
+    checked_at = excluded.checked_at;
+"""
 
-async def fetch_feed(client: aiohttp.ClientSession, feed_url: str) -> list[Any]:
-    resp = await client.get(feed_url)
-    if resp.status >= 400:
-        raise Exception(f"something went wrong while fetching '{feed_url}'")
+PARSE_EXECUTORS = ("thread", "process")
 
-    content = await resp.text()
+# Responses worth retrying, since they are usually temporary.
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class FetchError(Exception):
+    pass
+
+
+class FeedState(NamedTuple):
+    etag: str | None = None
+    last_modified: str | None = None
+    entry_ids: tuple[str, ...] = ()
+
+
+# Shares one pool of connections between every request, limiting how many of
+# them run at once in total and against the same host. Requests that fail
+# because of the network or a temporary error are retried with exponential
+# backoff.
+class Crawler:
+    def __init__(
+        self,
+        max_connections: int = 32,
+        max_connections_per_host: int = 4,
+        timeout: float = 30.0,
+        retries: int = 2,
+        backoff: float = 0.5,
+    ) -> None:
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+
+        self._limiter = asyncio.Semaphore(max_connections)
+        self._host_limiters: defaultdict[str, asyncio.Semaphore] = defaultdict(
+            lambda: asyncio.Semaphore(max_connections_per_host)
+        )
+        self._client: aiohttp.ClientSession | None = None
+
+    async def __aenter__(self) -> "Crawler":
+        connector = aiohttp.TCPConnector(
+            limit=self.max_connections,
+            limit_per_host=self.max_connections_per_host,
+            ttl_dns_cache=300,
+        )
+        self._client = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(
+                total=self.timeout,
+                sock_connect=min(self.timeout, 10),
+            ),
+        )
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    async def fetch(self, url: str, slots: asyncio.Semaphore | None = None) -> str:
+        _, text, _ = await self.get(url, slots=slots)
+        return text
+
+    # Returns the status, body and headers of a response. The body of a
+    # "304 Not Modified" response is always empty. With `slots`, one of them is
+    # taken right before reading the body, once the limits of the crawler are
+    # already held, and it's up to the caller to release it.
+    async def get(
+        self,
+        url: str,
+        headers: dict[str, str] | None = None,
+        slots: asyncio.Semaphore | None = None,
+    ) -> tuple[int, str, Mapping[str, str]]:
+        host = urlparse(url).netloc
+        for attempt in range(self.retries + 1):
+            try:
+                # The slot of the host is taken first, so requests waiting on
+                # a busy host don't hold slots other hosts could use.
+                async with self._host_limiters[host], self._limiter:
+                    async with self._client.get(url, headers=headers) as resp:
+                        if resp.status in RETRY_STATUSES and attempt < self.retries:
+                            raise FetchError(f"'{url}' returned {resp.status}")
+
+                        if resp.status >= 400:
+                            raise Exception(
+                                f"something went wrong while fetching '{url}'"
+                            )
+
+                        if resp.status == 304:
+                            return resp.status, "", resp.headers.copy()
+
+                        if slots is None:
+                            return resp.status, await resp.text(), resp.headers.copy()
+
+                        await slots.acquire()
+                        try:
+                            text = await resp.text()
+                        except BaseException:
+                            slots.release()
+                            raise
+
+                        return resp.status, text, resp.headers.copy()
+            except (aiohttp.ClientError, asyncio.TimeoutError, FetchError) as e:
+                if attempt >= self.retries:
+                    raise Exception(
+                        f"something went wrong while fetching '{url}': {e or type(e).__name__}"
+                    ) from e
+
+            # The backoff is waited without holding any of the limits.
+            await asyncio.sleep(self.backoff * 2**attempt * random.uniform(1, 1.5))
+
+        raise Exception(f"something went wrong while fetching '{url}'")
+
+
+def load_feed_states(sqlite_url: str, feeds: list[str]) -> dict[str, FeedState]:
+    with with_db(sqlite_url) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+        SELECT url, etag, last_modified, entry_ids
+        FROM feeds
+        WHERE url IN (SELECT value FROM json_each(?))
+            """,
+            (json.dumps(feeds),),
+        )
+        return {
+            url: FeedState(etag, last_modified, tuple(json.loads(entry_ids)))
+            for url, etag, last_modified, entry_ids in cursor.fetchall()
+        }
+
+
+def save_feed_state(writer: BatchWriter, feed_url: str, state: FeedState) -> None:
+    writer.execute(
+        UPSERT_FEED,
+        (
+            feed_url,
+            state.etag,
+            state.last_modified,
+            json.dumps(list(state.entry_ids)),
+            time(),
+        ),
+    )
+
+
+# Returns which of the given URIs are already indexed, with a single query.
+def find_indexed(sqlite_url: str, uris: list[str]) -> set[str]:
+    with with_db(sqlite_url) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+        SELECT uri
+        FROM documents
+        WHERE uri IN (SELECT value FROM json_each(?))
+            """,
+            (json.dumps(uris),),
+        )
+        return {uri for (uri,) in cursor.fetchall()}
+
+
+def entry_id(entry: Any) -> str:
+    return entry.get("id") or entry.get("link", "")
+
+
+# Parsing feeds and cleaning pages is CPU-bound, so it runs on an executor
+# instead of the event loop. One of its `slots` is taken before reading the
+# body of anything that will be parsed, and released once it's parsed, so at
+# most `max_pending` documents are in memory waiting to be parsed at the same
+# time, and downloads wait instead of piling up when parsing falls behind.
+class Parser:
+    def __init__(
+        self,
+        executor: str = "process",
+        max_workers: int | None = None,
+        max_pending: int | None = None,
+    ) -> None:
+        if executor not in PARSE_EXECUTORS:
+            raise ValueError(
+                f"executor must be one of {', '.join(PARSE_EXECUTORS)}, not '{executor}'"
+            )
+
+        self.executor = executor
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.max_workers * 2
+
+        self.slots = asyncio.Semaphore(self.max_pending)
+        self._executor: Executor | None = None
+
+    async def __aenter__(self) -> "Parser":
+        # Workers are spawned, since forking while the writer thread holds a
+        # connection is unsafe.
+        if self.executor == "process":
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=get_context("spawn"),
+            )
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        if self._executor is not None:
+            await asyncio.to_thread(self._executor.shutdown)
+            self._executor = None
+
+    async def run(self, fn: Callable, *args: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+
+def parse_feed(content: str) -> tuple[bool, list[Any]]:
     d = feedparser.parse(content)
-    if d.bozo:
+    return bool(d.bozo), [entry for entry in d.entries]
+
+
+# Returns the entries of a feed and its new state, or no entries at all if
+# the feed didn't change since it was last fetched.
+async def fetch_feed(
+    crawler: Crawler,
+    parser: Parser,
+    feed_url: str,
+    state: FeedState | None = None,
+) -> tuple[list[Any] | None, FeedState]:
+    state = state or FeedState()
+    headers = {}
+    if state.etag:
+        headers["If-None-Match"] = state.etag
+    if state.last_modified:
+        headers["If-Modified-Since"] = state.last_modified
+
+    status, content, response_headers = await crawler.get(
+        feed_url, headers, parser.slots
+    )
+    if status == 304:
+        return None, state
+
+    try:
+        bozo, entries = await parser.run(parse_feed, content)
+    finally:
+        parser.slots.release()
+
+    if bozo:
         raise Exception(f"failed to parse '{feed_url}'")
 
-    return [entry for entry in d.entries]
+    return entries, FeedState(
+        response_headers.get("ETag"),
+        response_headers.get("Last-Modified"),
+        tuple(entry_id(entry) for entry in entries),
+    )
+
+
+# Returns when an entry was published, or last updated, as a timestamp so
+# posts can be filtered by date like files.
+def published_at(entry: Any) -> float | None:
+    published = entry.get("published_parsed") or entry.get("updated_parsed")
+    if not published:
+        return None
 
+    return float(calendar.timegm(published))
 
-async def fetch_post(client: aiohttp.ClientSession, post_url: str) -> str:
-    resp = await client.get(post_url)
-    if resp.status >= 400:
-        raise Exception(f"something went wrong while fetching '{post_url}'")
 
-    html = await resp.text()
-    cleaned_html = clean_html(html)
-    return cleaned_html
+async def fetch_post(crawler: Crawler, parser: Parser, post_url: str) -> str:
+    html = await crawler.fetch(post_url, parser.slots)
+    try:
+        return await parser.run(clean_html, html)
+    finally:
+        parser.slots.release()
 
 
-async def index_feed(sqlite_url: str, feeds: list[str]) -> None:
-    async def process_feed(client: aiohttp.ClientSession, feed_url: str):
+# Writes go through a single batched writer, and no connection is held while
+# waiting for the network.
+async def index_feed(
+    sqlite_url: str,
+    feeds: list[str],
+    passage_size: int | None = None,
+    max_connections: int = 32,
+    max_connections_per_host: int = 4,
+    timeout: float = 30.0,
+    retries: int = 2,
+    writer: BatchWriter | None = None,
+    parse_executor: str = "process",
+    metrics: Metrics | None = None,
+) -> None:
+    metrics = metrics or Metrics()
+
+    async def process_entry(crawler: Crawler, parser: Parser, entry: Any) -> None:
+        uri = f"{entry.link}"
+        body = await fetch_post(crawler, parser, entry.link)
+        title = entry.get("title", entry.link)
+        protocol = urlparse(entry.link).scheme
+
+        doc = Doc(
+            uri=uri,
+            title=title,
+            body=body,
+            doc_type=protocol,
+            last_modified=published_at(entry),
+            passages=split_passages([(None, body)], passage_size)
+            if passage_size
+            else None,
+        )
+        await asyncio.to_thread(writer.upsert, doc)
+        metrics.count("posts.indexed")
+        metrics.count("bytes.indexed", len(body.encode()))
+        log(f'[green][Ok][/] indexed "{uri}".')
+
+    async def process_feed(crawler: Crawler, parser: Parser, feed_url: str):
+        previous = states.get(feed_url)
         try:
-            entries = await fetch_feed(client, feed_url)
-            for entry in entries:
-                with with_db(sqlite_url) as conn:
-                    cursor = conn.cursor()
-                    entry_link = entry.link
-                    uri = f"{entry_link}"
-
-                    cursor.execute(
-                        "SELECT uri FROM documents WHERE uri = ?",
-                        (uri,),
-                    )
-                    result = cursor.fetchone()
-
-                    if result:
-                        console.print(f'[yellow][Skip][/] already indexed "{uri}".')
-                        return
-
-                    body = await fetch_post(client, entry_link)
-                    title = entry.get("title", entry_link)
-                    protocol = urlparse(entry_link).scheme
-
-                    cursor.execute(
-                        """
-                    INSERT INTO documents (uri, title, type, body)
-                    VALUES (?, ?, ?, ?)
-                    """,
-                        (uri, title, protocol, body),
-                    )
-                    console.print(f'[green][Ok][/] indexed "{uri}".')
+            entries, state = await fetch_feed(crawler, parser, feed_url, previous)
         except Exception as e:
-            # TODO: Improve error message
             console.print(f"[red][Err][/] {e}")
+            return
+
+        try:
+            await process_entries(crawler, parser, feed_url, previous, entries, state)
+        except Exception as e:
+            console.print(
+                f"[red][Err][/] something went wrong while indexing '{feed_url}': {e}"
+            )
+
+    async def process_entries(
+        crawler: Crawler,
+        parser: Parser,
+        feed_url: str,
+        previous: FeedState | None,
+        entries: list[Any] | None,
+        state: FeedState,
+    ) -> None:
+        if entries is None:
+            metrics.count("feeds.not_modified")
+            log(f'[yellow][Skip][/] not modified "{feed_url}".')
+            await asyncio.to_thread(save_feed_state, writer, feed_url, state)
+            return
+
+        # Entries without a link are valid, but there is no post to fetch.
+        # Entries seen the last time the feed was fetched are not looked up
+        # again, and the rest are looked up all at once.
+        seen = set(previous.entry_ids) if previous else set()
+        entries = [
+            entry
+            for entry in entries
+            if entry.get("link") and entry_id(entry) not in seen
+        ]
+        indexed = await asyncio.to_thread(
+            find_indexed, sqlite_url, [f"{entry.link}" for entry in entries]
+        )
+        for uri in indexed:
+            log(f'[yellow][Skip][/] already indexed "{uri}".')
+
+        # Posts are fetched concurrently, within the limits of the crawler.
+        new_entries = [entry for entry in entries if f"{entry.link}" not in indexed]
+        results = await asyncio.gather(
+            *[process_entry(crawler, parser, entry) for entry in new_entries],
+            return_exceptions=True,
+        )
+
+        failed = set()
+        for entry, result in zip(new_entries, results):
+            if isinstance(result, Exception):
+                failed.add(entry_id(entry))
+                metrics.count("posts.failed")
+                console.print(f"[red][Err][/] {result}")
+
+        # If some post couldn't be indexed the validators are not kept, so the
+        # feed is fetched again and the post retried the next time.
+        if failed:
+            state = FeedState(
+                entry_ids=tuple(i for i in state.entry_ids if i not in failed)
+            )
+
+        await asyncio.to_thread(save_feed_state, writer, feed_url, state)
+
+    states = await asyncio.to_thread(load_feed_states, sqlite_url, feeds)
+
+    own_writer = writer is None
+    if own_writer:
+        writer = BatchWriter(sqlite_url, metrics=metrics)
+        writer.start()
 
-    async with aiohttp.ClientSession() as client:
-        tasks = [process_feed(client, feed) for feed in feeds]
-        await asyncio.gather(*tasks)
+    try:
+        async with (
+            Crawler(
+                max_connections, max_connections_per_host, timeout, retries
+            ) as crawler,
+            Parser(parse_executor) as parser,
+        ):
+            tasks = [process_feed(crawler, parser, feed) for feed in feeds]
+            await asyncio.gather(*tasks)
+    finally:
+        if own_writer:
+            await asyncio.to_thread(writer.close)
@@ -1,117 +1,532 @@
 from pathlib import Path
 import fnmatch
-from collections import deque
-import pymupdf
+import hashlib
+import json
+import os
+import re
+import threading
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from typing import Callable, Iterable, Iterator, NamedTuple
 from housaku.models import Doc
-from housaku.db import with_db
-from housaku.utils import console
+from housaku.db import BatchWriter, bump_generation, with_db
+from housaku.metrics import Metrics
+from housaku.utils import console, log, split_passages
 
 PLAIN_TEXT_EXTENSIONS = {".txt", ".md", ".csv"}
 COMPLEX_DOCUMENT_EXTENSIONS = {".pdf", ".epub", ".docx", ".pptx", ".xlsx"}
 SUPPORTED_EXTENSIONS = PLAIN_TEXT_EXTENSIONS.union(COMPLEX_DOCUMENT_EXTENSIONS)
+EXECUTORS = ("auto", "thread", "process")
+PLAIN_TEXT_CHUNK_SIZE = 1 << 20
 
-pymupdf.JM_mupdf_show_errors = 0
 
+def compile_patterns(patterns: Iterable[str]) -> re.Pattern | None:
+    if not patterns:
+        return None
 
-def list_files(root: Path, exclude: set[str] = set()) -> list[Path]:
-    exclude_set = set(exclude)
-    pending_dirs = deque([root])
-    files = []
-
-    if root.is_dir():
-        while pending_dirs:
-            dir = pending_dirs.popleft()
-            for path in dir.iterdir():
-                if any(fnmatch.fnmatch(path.name, pattern) for pattern in exclude_set):
+    return re.compile(
+        "|".join(f"(?:{fnmatch.translate(pattern)})" for pattern in patterns)
+    )
+
+
+def scan_dir(
+    dir: str,
+    excluded: re.Pattern | None = None,
+) -> tuple[list[tuple[Path, os.stat_result]], list[str]]:
+    files, dirs = [], []
+    with os.scandir(dir) as entries:
+        for entry in entries:
+            if excluded and excluded.match(entry.name):
+                continue
+
+            # The type of the entry comes from the directory listing itself, so
+            # only files need an extra call to `stat`. Symlinked files keep the
+            # path of the link, so they belong to the root they were found in.
+            if entry.is_dir():
+                dirs.append(entry.path)
+            elif entry.is_file():
+                files.append((Path(entry.path), entry.stat()))
+
+    return files, dirs
+
+
+def walk_files(
+    root: Path,
+    exclude: Iterable[str] = (),
+    max_workers: int = 4,
+    on_error: Callable[[OSError], None] | None = None,
+) -> Iterator[tuple[Path, os.stat_result]]:
+    excluded = compile_patterns(exclude)
+    root = root.resolve()
+
+    if not root.is_dir():
+        if not (excluded and excluded.match(root.name)):
+            yield root, root.stat()
+        return
+
+    # Each directory is scanned as a separate task, and the files are yielded
+    # as soon as each one of them is done.
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {executor.submit(scan_dir, f"{root}", excluded)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    files, dirs = future.result()
+                except OSError as e:
+                    if on_error is None:
+                        raise
+
+                    on_error(e)
                     continue
 
-                if path.is_dir():
-                    pending_dirs.append(path)
+                for dir in dirs:
+                    pending.add(executor.submit(scan_dir, dir, excluded))
+
+                yield from files
 
-                if path.is_file():
-                    files.append(path.resolve())
-    else:
-        if not any(fnmatch.fnmatch(root.name, pattern) for pattern in exclude_set):
-            files.append(root.resolve())
 
-    return files
+def list_files(root: Path, exclude: set[str] = set()) -> list[Path]:
+    return [file for file, _ in walk_files(root, exclude)]
 
 
-def read_file(file: Path) -> Doc:
+def read_file(
+    file: Path,
+    max_bytes: int | None = None,
+    passage_size: int | None = None,
+) -> Doc:
+    chunks, truncated = take_text(iter_text(file), max_bytes)
+
+    return Doc(
+        uri=f"{file.absolute()}",
+        title=file.name,
+        body="".join(text for _, text in chunks),
+        doc_type=file.suffix,
+        truncated=truncated,
+        passages=split_passages(chunks, passage_size) if passage_size else None,
+    )
+
+
+def iter_text(file: Path) -> Iterator[tuple[int | None, str]]:
     doc_type = file.suffix
     if doc_type in PLAIN_TEXT_EXTENSIONS:
-        body = read_plain_text(file)
+        return iter_plain_text(file)
     elif doc_type in COMPLEX_DOCUMENT_EXTENSIONS:
-        body = read_complex(file)
+        return iter_complex(file)
     else:
         raise Exception(f'Unsupported file format "{file.suffix}"')
 
-    return Doc(
-        uri=f"{file.resolve()}",
-        title=file.name,
-        body=body,
-        doc_type=doc_type,
-    )
 
+# Collects the chunks of text of a document, stopping as soon as the document
+# reaches `max_bytes` (encoded as UTF-8) so that the rest of the file is never
+# read. Returns the chunks and whether the document was truncated.
+def take_text(
+    chunks: Iterable[tuple[int | None, str]],
+    max_bytes: int | None = None,
+) -> tuple[list[tuple[int | None, str]], bool]:
+    taken = []
+    size = 0
 
-def read_plain_text(file: Path) -> str:
+    for page, text in chunks:
+        if max_bytes:
+            encoded = text.encode()
+            if size + len(encoded) > max_bytes:
+                text = encoded[: max_bytes - size].decode(errors="ignore")
+                taken.append((page, text))
+                return taken, True
+
+            size += len(encoded)
+
+        taken.append((page, text))
+
+    return taken, False
+
+
+def join_text(
+    chunks: Iterable[tuple[int | None, str]],
+    max_bytes: int | None = None,
+) -> tuple[str, bool]:
+    taken, truncated = take_text(chunks, max_bytes)
+    return "".join(text for _, text in taken), truncated
+
+
+def iter_plain_text(
+    file: Path,
+    chunk_size: int = PLAIN_TEXT_CHUNK_SIZE,
+) -> Iterator[tuple[None, str]]:
     with open(file, "r") as f:
-        return f.read()
+        while chunk := f.read(chunk_size):
+            yield None, chunk
 
 
-def read_complex(file: Path) -> str:
-    body = ""
+# PyMuPDF takes a while to import, so it's only imported the first time a
+# document needs it.
+def load_pymupdf():
+    import pymupdf
+
+    pymupdf.JM_mupdf_show_errors = 0
+    return pymupdf
+
+
+def iter_complex(file: Path) -> Iterator[tuple[int, str]]:
+    pymupdf = load_pymupdf()
     with pymupdf.open(file) as doc:
         for page in doc:
-            body += page.get_text()
+            yield page.number + 1, page.get_text()
+
 
+def read_plain_text(file: Path) -> str:
+    body, _ = join_text(iter_plain_text(file))
     return body
 
 
-def index_file(sqlite_url: str, file: Path) -> None:
-    try:
-        with with_db(sqlite_url) as conn:
-            cursor = conn.cursor()
+def read_complex(file: Path) -> str:
+    body, _ = join_text(iter_complex(file))
+    return body
 
-            cursor.execute(
-                "SELECT last_modified FROM documents WHERE uri = ?",
-                (f"{file.resolve()}",),
+
+class FileState(NamedTuple):
+    last_modified: float | None
+    size: int | None
+    content_hash: str | None
+
+
+def load_file_states(sqlite_url: str, root: Path) -> dict[str, FileState]:
+    uri = f"{root}"
+    with with_db(sqlite_url) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+        SELECT uri, last_modified, size, content_hash
+        FROM documents
+        WHERE uri = ? OR (uri >= ? AND uri < ?)
+            """,
+            (uri, f"{uri}{os.sep}", f"{uri}{chr(ord(os.sep) + 1)}"),
+        )
+
+        return {
+            uri: FileState(
+                float(last_modified) if last_modified is not None else None,
+                size,
+                content_hash,
             )
-            result = cursor.fetchone()
-            new_last_modified = round(file.stat().st_mtime, 3)
-
-            if result:
-                current_last_modified = float(result[0])
-
-                if current_last_modified == new_last_modified:
-                    console.print(f'[yellow][Skip][/] already indexed "{file}".')
-                    return
-                else:
-                    doc = read_file(file)
-                    cursor.execute(
-                        """
-                    UPDATE documents
-                    SET body = ?, last_modified = ?
-                    WHERE uri = ?
-                        """,
-                        (doc.body, new_last_modified, doc.uri),
-                    )
-                    console.print(f'[yellow][Update][/] updated modified "{file}".')
-            else:
-                doc = read_file(file)
-                cursor.execute(
-                    """
-            INSERT INTO documents (uri, title, type, body, last_modified)
-            VALUES (?, ?, ?, ?, ?)
+            for uri, last_modified, size, content_hash in cursor.fetchall()
+        }
+
+
+def find_file_states(sqlite_url: str, files: Iterable[Path]) -> dict[str, FileState]:
+    with with_db(sqlite_url) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+        SELECT uri, last_modified, size, content_hash
+        FROM documents
+        WHERE uri IN (SELECT value FROM json_each(?))
             """,
-                    (
-                        doc.uri,
-                        doc.title,
-                        doc.doc_type,
-                        doc.body,
-                        new_last_modified,
-                    ),
-                )
-                console.print(f'[green][Ok][/] indexed "{file}".')
+            (json.dumps([f"{file}" for file in files]),),
+        )
+
+        return {
+            uri: FileState(
+                float(last_modified) if last_modified is not None else None,
+                size,
+                content_hash,
+            )
+            for uri, last_modified, size, content_hash in cursor.fetchall()
+        }
+
+
+# Removes the documents under `root` whose files were not seen while walking
+# it. Symlinked files are stored under the path of their link, so removing the
+# link also removes its document.
+def prune_files(sqlite_url: str, root: Path, seen: set[str]) -> int:
+    uri = f"{root}"
+    with with_db(sqlite_url) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+        DELETE FROM documents
+        WHERE (uri = ? OR (uri >= ? AND uri < ?))
+        AND uri NOT IN (SELECT value FROM json_each(?))
+            """,
+            (
+                uri,
+                f"{uri}{os.sep}",
+                f"{uri}{chr(ord(os.sep) + 1)}",
+                json.dumps(list(seen)),
+            ),
+        )
+
+        removed = cursor.rowcount
+        if removed:
+            bump_generation(cursor)
+
+        return removed
+
+
+# Removes the documents of a file, or of every file under a directory, that
+# is gone. The triggers take care of the full-text index.
+def remove_files(writer: BatchWriter, path: Path) -> None:
+    uri = f"{path}"
+    writer.execute(
+        "DELETE FROM documents WHERE uri = ? OR (uri >= ? AND uri < ?);",
+        (uri, f"{uri}{os.sep}", f"{uri}{chr(ord(os.sep) + 1)}"),
+        invalidates=True,
+    )
+
+
+def hash_file(file: Path) -> str:
+    with open(file, "rb") as f:
+        return hashlib.file_digest(f, "blake2b").hexdigest()
+
+
+# SQLite integers are signed, but inodes can use all 64 bits on some
+# filesystems, so those are stored as their two's complement.
+def stored_inode(stat: os.stat_result) -> int:
+    return stat.st_ino - (1 << 64) if stat.st_ino >= 1 << 63 else stat.st_ino
+
+
+def is_unchanged(state: FileState | None, stat: os.stat_result) -> bool:
+    if state is None or state.last_modified != round(stat.st_mtime, 3):
+        return False
+
+    # Documents indexed before sizes were recorded only have their
+    # modification time to compare against.
+    return state.size is None or state.size == stat.st_size
+
+
+def index_file(
+    writer: BatchWriter,
+    file: Path,
+    stat: os.stat_result,
+    state: FileState | None = None,
+    hash_content: bool = False,
+    read: Callable[[Path], Doc] = read_file,
+    metrics: Metrics | None = None,
+) -> None:
+    metrics = metrics or Metrics()
+    try:
+        last_modified = round(stat.st_mtime, 3)
+        content_hash = hash_file(file) if hash_content else None
+
+        if state and content_hash and state.content_hash == content_hash:
+            writer.touch(f"{file}", last_modified, stat.st_size, stored_inode(stat))
+            metrics.count("files.skipped")
+            log(f'[yellow][Skip][/] content unchanged "{file}".')
+            return
+
+        with metrics.time(f"extract.{file.suffix.lstrip('.')}"):
+            doc = read(file)
+        doc.last_modified = last_modified
+        doc.size = stat.st_size
+        doc.inode = stored_inode(stat)
+        doc.content_hash = content_hash
+        writer.upsert(doc)
+        metrics.count("files.indexed")
+        metrics.count("bytes.indexed", stat.st_size)
+
+        if doc.truncated:
+            log(f'[yellow][Truncated][/] document too large "{file}".')
+
+        if state:
+            log(f'[yellow][Update][/] updated modified "{file}".')
+        else:
+            log(f'[green][Ok][/] indexed "{file}".')
     except Exception as e:
+        metrics.count("files.failed")
         console.print(f'[red][Err][/] something went wrong while reading "{file}": {e}')
+
+
+# Before dispatching any work, the state of every document already indexed
+# under a root is loaded at once and compared against the result of `stat`, so
+# only new or modified files reach the worker threads. Documents under the root
+# whose files were not found during the walk are removed at the end.
+# Depending on `executor`, the text extraction itself runs on the worker
+# threads, on a pool of processes or, with "auto", on processes only for
+# CPU-bound formats like PDFs or EPUBs. Both pools are reused across calls to
+# `index`.
+class FileIndexer:
+    def __init__(
+        self,
+        sqlite_url: str,
+        writer: BatchWriter,
+        max_workers: int,
+        executor: str = "auto",
+        hash_content: bool = False,
+        max_bytes: int | None = None,
+        passage_size: int | None = None,
+        metrics: Metrics | None = None,
+    ) -> None:
+        if executor not in EXECUTORS:
+            raise ValueError(f'Unsupported executor "{executor}"')
+
+        self.sqlite_url = sqlite_url
+        self.writer = writer
+        self.max_workers = max_workers
+        self.executor = executor
+        self.hash_content = hash_content
+        self.max_bytes = max_bytes
+        self.passage_size = passage_size
+        self.metrics = metrics or Metrics()
+
+        self._threads = ThreadPoolExecutor(max_workers=max_workers)
+        self._processes: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "FileIndexer":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._threads.shutdown()
+        if self._processes:
+            self._processes.shutdown()
+
+    # With a `partition`, only the files it accepts are indexed, and only
+    # those are expected to be in the database.
+    def index(
+        self,
+        root: Path,
+        exclude: set[str] = set(),
+        partition: Callable[[Path], bool] | None = None,
+    ) -> None:
+        root = root.resolve()
+        states = load_file_states(self.sqlite_url, root)
+
+        errors = []
+
+        def on_error(e: OSError) -> None:
+            errors.append(e)
+            console.print(
+                f'[red][Err][/] something went wrong while listing "{e.filename}": {e}'
+            )
+
+        pending = set()
+        seen = set()
+        for file, stat in walk_files(root, exclude, self.max_workers, on_error):
+            if partition is not None and not partition(file):
+                continue
+
+            seen.add(f"{file}")
+            self.metrics.count("files.seen")
+
+            state = states.get(f"{file}")
+            if is_unchanged(state, stat):
+                self.metrics.count("files.skipped")
+                log(f'[yellow][Skip][/] already indexed "{file}".')
+                continue
+
+            pending = self._submit(pending, file, stat, state)
+
+        wait(pending)
+        self.metrics.gauge("files.pending", 0)
+
+        # Files under directories that couldn't be listed were not seen, but
+        # that doesn't mean they are gone.
+        if errors:
+            return
+
+        removed = prune_files(self.sqlite_url, root, seen)
+        if removed:
+            console.print(
+                f'[yellow][Remove][/] removed {removed} missing files from "{root}".'
+            )
+
+    # Indexes only the given files, for example because they just changed.
+    # Files that are gone are left to `remove_files`.
+    def update(self, files: Iterable[Path]) -> None:
+        files = list(files)
+        states = find_file_states(self.sqlite_url, files)
+
+        pending = set()
+        for file in files:
+            try:
+                stat = file.stat()
+            except FileNotFoundError:
+                continue
+
+            self.metrics.count("files.seen")
+            state = states.get(f"{file}")
+            if is_unchanged(state, stat):
+                self.metrics.count("files.skipped")
+                log(f'[yellow][Skip][/] already indexed "{file}".')
+                continue
+
+            pending = self._submit(pending, file, stat, state)
+
+        wait(pending)
+        self.metrics.gauge("files.pending", 0)
+
+    def _submit(
+        self,
+        pending: set[Future],
+        file: Path,
+        stat: os.stat_result,
+        state: FileState | None,
+    ) -> set[Future]:
+        # Bounds the number of files waiting to be processed, so the walk
+        # doesn't get too far ahead of the workers.
+        if len(pending) >= self.max_workers * 4:
+            _, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+        pending.add(
+            self._threads.submit(
+                index_file,
+                self.writer,
+                file,
+                stat,
+                state,
+                self.hash_content,
+                self._read,
+                self.metrics,
+            )
+        )
+        self.metrics.gauge("files.pending", len(pending))
+        return pending
+
+    def _read(self, file: Path) -> Doc:
+        if self.executor == "thread" or (
+            self.executor == "auto" and file.suffix not in COMPLEX_DOCUMENT_EXTENSIONS
+        ):
+            return read_file(file, self.max_bytes, self.passage_size)
+
+        pool = self._process_pool()
+        try:
+            return pool.submit(
+                read_file, file, self.max_bytes, self.passage_size
+            ).result()
+        except BrokenProcessPool:
+            # A worker died, for example while reading a broken PDF, and that
+            # leaves the whole pool unusable. It's replaced, and the file is
+            # retried once in case it was another one that crashed it.
+            pool = self._process_pool(broken=pool)
+            return pool.submit(
+                read_file, file, self.max_bytes, self.passage_size
+            ).result()
+
+    def _process_pool(
+        self, broken: ProcessPoolExecutor | None = None
+    ) -> ProcessPoolExecutor:
+        with self._lock:
+            if broken is not None and self._processes is broken:
+                broken.shutdown(wait=False, cancel_futures=True)
+                self._processes = None
+
+            if self._processes is None:
+                # Forking while the writer thread holds a connection is
+                # unsafe, so workers are spawned instead.
+                self._processes = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=get_context("spawn"),
+                )
+
+            return self._processes
@@ -0,0 +1,134 @@
+import json
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+from time import perf_counter
+from typing import Any
+
+# Upper bounds, in seconds, of the buckets timings are counted in. They grow
+# exponentially from 0.5ms to about a minute.
+BUCKETS = tuple(0.0005 * 2**i for i in range(18))
+
+
+class Histogram:
+    def __init__(self) -> None:
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    # Percentiles are estimated as the upper bound of the bucket they fall
+    # in, which is never above the maximum seen.
+    def percentile(self, p: float) -> float:
+        if not self.count:
+            return 0.0
+
+        rank = p * self.count
+        seen = 0
+        for bound, count in zip((*BUCKETS, self.max), self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+
+        return self.max
+
+    def summary(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "total": self.total,
+            "min": self.min if self.count else 0.0,
+            "max": self.max,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            "buckets": {
+                f"{bound:g}": count
+                for bound, count in zip((*BUCKETS, float("inf")), self.counts)
+                if count
+            },
+        }
+
+
+# Counters, gauges and timing histograms collected while indexing. They are
+# updated from the walker, the workers and the writer thread, so every update
+# takes a lock.
+class Metrics:
+    def __init__(self) -> None:
+        self.started_at = perf_counter()
+        self.counters: dict[str, int] = {}
+        self.gauges: dict[str, tuple[int, int]] = {}
+        self.timings: dict[str, Histogram] = {}
+
+        self._lock = threading.Lock()
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name: str, value: int) -> None:
+        with self._lock:
+            _, peak = self.gauges.get(name, (0, 0))
+            self.gauges[name] = (value, max(peak, value))
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self._lock:
+            if name not in self.timings:
+                self.timings[name] = Histogram()
+            self.timings[name].observe(seconds)
+
+    @contextmanager
+    def time(self, name: str):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, perf_counter() - start)
+
+    @property
+    def elapsed(self) -> float:
+        return perf_counter() - self.started_at
+
+    def get(self, name: str) -> int:
+        with self._lock:
+            return self.counters.get(name, 0)
+
+    def current(self, name: str) -> int:
+        with self._lock:
+            return self.gauges.get(name, (0, 0))[0]
+
+    def rate(self, name: str) -> float:
+        elapsed = self.elapsed
+        return self.get(name) / elapsed if elapsed > 0 else 0.0
+
+    def snapshot(self) -> dict[str, Any]:
+        elapsed = self.elapsed
+        with self._lock:
+            return {
+                "elapsed": elapsed,
+                "counters": dict(self.counters),
+                "rates": {
+                    "files_per_second": self.counters.get("files.indexed", 0) / elapsed,
+                    "bytes_per_second": self.counters.get("bytes.indexed", 0) / elapsed,
+                },
+                "gauges": {
+                    name: {"last": last, "max": peak}
+                    for name, (last, peak) in self.gauges.items()
+                },
+                "timings": {
+                    name: histogram.summary()
+                    for name, histogram in self.timings.items()
+                },
+            }
+
+    def write_json(self, path: Path) -> None:
+        path.write_text(json.dumps(self.snapshot(), indent=2))
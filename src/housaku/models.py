@@ -1,3 +1,6 @@
+from typing import NamedTuple
+
+
 class Doc:
     def __init__(
         self,
@@ -5,10 +8,50 @@ class Doc:
         title: str,
         body: str,
         doc_type: str,
-        last_modified: str | None = None,
+        last_modified: str | float | None = None,
+        size: int | None = None,
+        inode: int | None = None,
+        content_hash: str | None = None,
+        truncated: bool = False,
+        passages: list[tuple[int | None, str]] | None = None,
     ) -> None:
         self.uri = uri
         self.title = title
         self.body = body
         self.doc_type = doc_type
         self.last_modified = last_modified
+        self.size = size
+        self.inode = inode
+        self.content_hash = content_hash
+        self.truncated = truncated
+        self.passages = passages
+
+
+class SearchResult(NamedTuple):
+    uri: str
+    title: str
+    doc_type: str
+    snippet: str
+    page: int | None = None
+    highlights: tuple[tuple[int, int], ...] = ()
+    cursor: str | None = None
+
+
+class SearchFilters(NamedTuple):
+    types: tuple[str, ...] = ()
+    path: str | None = None
+    since: float | None = None
+    until: float | None = None
+
+
+class Storage(NamedTuple):
+    mode: str = "plain"
+    detail: str = "full"
+    columnsize: bool = True
+    index_uri: bool = True
+
+
+class Shard(NamedTuple):
+    name: str
+    sqlite_url: str
+    attached: bool = True
@@ -0,0 +1,60 @@
+from rich.progress import (
+    BarColumn,
+    Progress,
+    ProgressColumn,
+    SpinnerColumn,
+    Task,
+    TextColumn,
+    TimeElapsedColumn,
+)
+from rich.text import Text
+from housaku.metrics import Metrics
+
+
+class MetricsColumn(ProgressColumn):
+    def __init__(self, metrics: Metrics) -> None:
+        self.metrics = metrics
+        super().__init__()
+
+    def render(self, _: Task) -> Text:
+        files = self.metrics.get("files.indexed")
+        posts = self.metrics.get("posts.indexed")
+        mb_per_second = self.metrics.rate("bytes.indexed") / 1e6
+        writer_queue = self.metrics.current("writer.queue")
+        pending = self.metrics.current("files.pending")
+
+        return Text(
+            f"{files} files ({self.metrics.rate('files.indexed'):.1f}/s, "
+            f"{mb_per_second:.1f} MB/s) · {posts} posts · "
+            f"pending {pending} · writer queue {writer_queue}",
+            style="dim",
+        )
+
+
+# Progress bar whose task follows the metrics: files processed out of the
+# files found so far by the walk.
+class IndexProgress(Progress):
+    def __init__(self, metrics: Metrics, **kwargs) -> None:
+        self.metrics = metrics
+        super().__init__(
+            SpinnerColumn(spinner_name="arrow"),
+            TextColumn("[green]{task.description}"),
+            BarColumn(),
+            TimeElapsedColumn(),
+            MetricsColumn(metrics),
+            **kwargs,
+        )
+
+    def get_renderables(self):
+        processed = sum(
+            self.metrics.get(name)
+            for name in ("files.indexed", "files.skipped", "files.failed")
+        )
+        for task in self.tasks:
+            self.update(
+                task.id,
+                completed=processed,
+                total=self.metrics.get("files.seen") or None,
+            )
+
+        yield from super().get_renderables()
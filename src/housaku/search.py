@@ -1,25 +1,635 @@
-from housaku.db import with_db
+import base64
+import json
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+from time import monotonic, perf_counter
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable
+from housaku.db import get_generation, get_pool
+from housaku.models import SearchFilters, SearchResult, Shard
+from housaku.shards import get_shards
+
+# Used by `snippet()` to mark the matching terms. They are removed from the
+# snippets returned, and only their offsets are kept.
+HIGHLIGHT_MARKERS = ("\x02", "\x03")
+SNIPPET_ELLIPSIS = "..."
+PROGRESS_HANDLER_STEPS = 1000
+
+# Largest possible ROWID, used to skip every result with the same score in
+# shards that come before the one a cursor points to.
+MAX_ROWID = 2**63 - 1
+
+# Threads shards are searched on. They are only started once needed.
+search_threads = ThreadPoolExecutor(thread_name_prefix="housaku-search")
+
+
+def split_highlights(
+    snippet: str,
+    markers: tuple[str, str] = HIGHLIGHT_MARKERS,
+) -> tuple[str, tuple[tuple[int, int], ...]]:
+    start_marker, end_marker = markers
+    parts = re.split(f"({re.escape(start_marker)}|{re.escape(end_marker)})", snippet)
+
+    text = []
+    highlights = []
+    length = 0
+    start = None
+    for part in parts:
+        if part == start_marker:
+            start = length
+        elif part == end_marker:
+            if start is not None:
+                highlights.append((start, length))
+            start = None
+        else:
+            text.append(part)
+            length += len(part)
+
+    # Newlines are replaced one by one so the offsets stay the same.
+    return "".join(text).replace("\n", " "), tuple(highlights)
+
+
+# In-process LRU cache of search results. Every entry remembers the index
+# generation it was computed for, and is discarded once the documents change.
+class SearchCache:
+    def __init__(self, max_size: int = 256) -> None:
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        self._entries: OrderedDict[tuple, tuple[int, list[SearchResult]]] = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple, generation: int) -> list[SearchResult] | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != generation:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(entry[1])
+
+    def put(self, key: tuple, generation: int, results: list[SearchResult]) -> None:
+        if self.max_size <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (generation, results)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+            }
+
+
+search_cache = SearchCache()
+
+
+# Contentless FTS5 tables can't make snippets, so previews are made from the
+# excerpt stored with every document instead, highlighting the words that
+# start like any of the terms of the query.
+def excerpt_snippet(
+    excerpt: str,
+    query: str,
+    snippet_size: int,
+    markers: tuple[str, str] = HIGHLIGHT_MARKERS,
+) -> str:
+    start_marker, end_marker = markers
+    terms = tuple(
+        term.lower()
+        for term in re.findall(r"\w+", query)
+        if term not in ("AND", "OR", "NOT", "NEAR")
+    )
+
+    words = excerpt.split()
+    snippet = []
+    for word in words[:snippet_size]:
+        if terms and word.lower().startswith(terms):
+            word = f"{start_marker}{word}{end_marker}"
+        snippet.append(word)
+
+    if len(words) > snippet_size:
+        snippet.append(SNIPPET_ELLIPSIS)
+
+    return " ".join(snippet)
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.split())
+
+
+# Turns the last term of a query that is still being typed into a prefix
+# query, so "hous" also matches "housaku". Terms that are operators, quoted or
+# already followed by a space are left as they are.
+def as_prefix_query(query: str) -> str:
+    terms = query.split()
+    if not terms or query[-1].isspace():
+        return query
+
+    last = terms[-1]
+    if last in ("AND", "OR", "NOT") or not re.fullmatch(r"\w+", last):
+        return query
+
+    return " ".join([*terms[:-1], f"{last}*"])
+
+
+# Results from shards also keep the name of their shard in their cursor,
+# since their ROWIDs are only unique within it.
+def encode_cursor(score: float, rowid: int, shard: str | None = None) -> str:
+    value = f"{score!r}:{rowid}" if shard is None else f"{score!r}:{rowid}:{shard}"
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[float, int, str | None]:
+    try:
+        score, rowid, *shard = (
+            base64.urlsafe_b64decode(cursor.encode()).decode().split(":", 2)
+        )
+        return float(score), int(rowid), shard[0] if shard else None
+    except Exception:
+        raise ValueError(f'Invalid cursor "{cursor}"') from None
+
+
+FILTER_PATTERN = re.compile(r"^(type|path|since|until):(.+)$")
+
+
+def parse_date(value: str, end: bool = False) -> float:
+    try:
+        date = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'Invalid date "{value}"') from None
+
+    # A bare date includes the whole day when used as an upper bound.
+    if end and len(value) == 10:
+        date += timedelta(days=1)
+
+    return date.timestamp()
+
+
+def normalize_path(path: str) -> str:
+    if "://" in path:
+        return path.rstrip("/")
+
+    return f"{Path(path).expanduser().resolve()}"
+
+
+def make_filters(
+    types: Iterable[str] = (),
+    path: str | None = None,
+    since: str | None = None,
+    until: str | None = None,
+) -> SearchFilters:
+    return SearchFilters(
+        tuple(sorted({t.strip().lower() for t in types if t.strip()})),
+        normalize_path(path) if path else None,
+        parse_date(since) if since else None,
+        parse_date(until, end=True) if until else None,
+    )
+
+
+# Splits filters like "type:pdf path:~/notes since:2024-01-01" from the terms
+# of a query.
+def parse_filters(query: str) -> tuple[str, SearchFilters]:
+    terms = []
+    values: dict[str, list[str]] = {"type": [], "path": [], "since": [], "until": []}
+    for term in query.split():
+        match = FILTER_PATTERN.match(term)
+        if match:
+            values[match[1]].extend(match[2].split(","))
+        else:
+            terms.append(term)
+
+    filters = make_filters(
+        values["type"],
+        values["path"][-1] if values["path"] else None,
+        values["since"][-1] if values["since"] else None,
+        values["until"][-1] if values["until"] else None,
+    )
+    return " ".join(terms), filters
+
+
+# Combines several filters, where the values set in the later ones take
+# precedence.
+def merge_filters(*filters: SearchFilters) -> SearchFilters:
+    merged = SearchFilters()
+    for f in filters:
+        merged = merged._replace(
+            **{key: value for key, value in f._asdict().items() if value}
+        )
+
+    return merged
+
+
+# Returns the conditions, on the `d` alias of the documents table, that
+# results must meet. Types are matched with and without their leading dot, so
+# both "pdf" and ".pdf" work.
+def filter_documents(filters: SearchFilters | None) -> tuple[str, tuple]:
+    if not filters:
+        return "", ()
+
+    conditions = []
+    params: list[str | float] = []
+    if filters.types:
+        types = set(filters.types)
+        types |= {f".{t}" for t in filters.types if not t.startswith(".")}
+        conditions.append("d.type IN (SELECT value FROM json_each(?))")
+        params.append(json.dumps(sorted(types)))
+
+    if filters.path:
+        sep = "/" if "://" in filters.path else os.sep
+        conditions.append("(d.dir = ? OR (d.dir >= ? AND d.dir < ?))")
+        params.extend(
+            (filters.path, filters.path + sep, filters.path + chr(ord(sep) + 1))
+        )
+
+    if filters.since is not None:
+        conditions.append("CAST(d.last_modified AS REAL) >= ?")
+        params.append(filters.since)
+
+    if filters.until is not None:
+        conditions.append("CAST(d.last_modified AS REAL) < ?")
+        params.append(filters.until)
+
+    return "".join(f" AND {condition}" for condition in conditions), tuple(params)
+
+
+# Results are sorted by their bm25 score and then by their ROWID, so that any
+# page can be fetched either by skipping `offset` results or, more cheaply,
+# starting right after the (score, ROWID) pair encoded in a cursor.
+def rank_documents(
+    cursor: sqlite3.Cursor,
+    query: str,
+    limit: int,
+    offset: int = 0,
+    after: tuple[float, int] | None = None,
+    filters: SearchFilters | None = None,
+) -> list[tuple[int, int, float, None]]:
+    keyset = "AND (f.rank > ? OR (f.rank = ? AND f.ROWID > ?))" if after else ""
+    conditions, params = filter_documents(filters)
+    join = "JOIN documents AS d ON d.ROWID = f.ROWID" if conditions else ""
+    cursor.execute(
+        f"""
+    SELECT f.ROWID, f.ROWID, f.rank, NULL
+    FROM documents_fts AS f {join}
+    WHERE documents_fts MATCH ? {conditions} {keyset}
+    ORDER BY f.rank, f.ROWID
+    LIMIT ? OFFSET ?
+        """,
+        (
+            query,
+            *params,
+            *((after[0], after[0], after[1]) if after else ()),
+            limit,
+            offset,
+        ),
+    )
+    return cursor.fetchall()
+
+
+# Every document is ranked by its best matching passage, which is also the one
+# used for the preview.
+def rank_passages(
+    cursor: sqlite3.Cursor,
+    query: str,
+    limit: int,
+    offset: int = 0,
+    after: tuple[float, int] | None = None,
+    filters: SearchFilters | None = None,
+) -> list[tuple[int, int, float, int | None]]:
+    keyset = "HAVING score > ? OR (score = ? AND p.document_id > ?)" if after else ""
+    conditions, params = filter_documents(filters)
+    join = "JOIN documents AS d ON d.ROWID = p.document_id" if conditions else ""
+    cursor.execute(
+        f"""
+    SELECT p.document_id, p.ROWID, MIN(m.score) AS score, p.page
+    FROM (
+        SELECT ROWID, rank AS score
+        FROM passages_fts
+        WHERE passages_fts MATCH ?
+    ) AS m
+    JOIN passages AS p ON p.ROWID = m.ROWID {join}
+    WHERE 1 {conditions}
+    GROUP BY p.document_id
+    {keyset}
+    ORDER BY score, p.document_id
+    LIMIT ? OFFSET ?
+        """,
+        (
+            query,
+            *params,
+            *((after[0], after[0], after[1]) if after else ()),
+            limit,
+            offset,
+        ),
+    )
+    return cursor.fetchall()
 
 
 def search(
     sqlite_url: str,
     query: str,
     limit: int = 10,
-) -> list[tuple[str, str, str, str]]:
-    with with_db(sqlite_url) as conn:
-        cursor = conn.cursor()
-        sql_query = """
-            SELECT uri, title, type, substr(body, 0, 300)
+    passages: bool = False,
+    snippet_size: int = 32,
+    markers: tuple[str, str] = HIGHLIGHT_MARKERS,
+    timeout: float | None = None,
+    cancel: threading.Event | None = None,
+    cache: SearchCache | None = search_cache,
+    offset: int = 0,
+    after: str | None = None,
+    filters: SearchFilters | None = None,
+) -> list[SearchResult]:
+    keyset = decode_cursor(after) if after else None
+
+    with get_pool(sqlite_url).connection() as conn:
+        shards = get_shards(conn.cursor(), attached_only=True)
+
+    if not shards:
+        return search_db(
+            sqlite_url,
+            query,
+            limit,
+            passages,
+            snippet_size,
+            markers,
+            timeout,
+            cancel,
+            cache,
+            offset,
+            keyset[:2] if keyset else None,
+            filters,
+        )
+
+    return search_shards(
+        shards,
+        query,
+        limit,
+        passages,
+        snippet_size,
+        markers,
+        timeout,
+        cancel,
+        cache,
+        offset,
+        keyset,
+        filters,
+    )
+
+
+# Results are merged in the order of their cursors, that is, by score, then
+# by shard and then by ROWID.
+def merge_key(result: SearchResult) -> tuple[float, str, int]:
+    score, rowid, shard = decode_cursor(result.cursor)
+    return score, shard or "", rowid
+
+
+# Every shard is searched on its own thread for its first `offset + limit`
+# results, which are then merged by their bm25 score. Each shard scores its
+# results using its own statistics, so scores from different shards are only
+# roughly comparable. Pages after a cursor start right after the (score,
+# shard, ROWID) it holds, in every shard.
+def search_shards(
+    shards: list[Shard],
+    query: str,
+    limit: int = 10,
+    passages: bool = False,
+    snippet_size: int = 32,
+    markers: tuple[str, str] = HIGHLIGHT_MARKERS,
+    timeout: float | None = None,
+    cancel: threading.Event | None = None,
+    cache: SearchCache | None = search_cache,
+    offset: int = 0,
+    after: tuple[float, int, str | None] | None = None,
+    filters: SearchFilters | None = None,
+) -> list[SearchResult]:
+    def search_shard(shard: Shard) -> list[SearchResult]:
+        keyset = None
+        if after is not None:
+            score, rowid, name = after
+            if name is None or name == shard.name:
+                keyset = (score, rowid)
+            elif shard.name < name:
+                keyset = (score, MAX_ROWID)
+            else:
+                keyset = (score, 0)
+
+        return search_db(
+            shard.sqlite_url,
+            query,
+            limit + offset,
+            passages,
+            snippet_size,
+            markers,
+            timeout,
+            cancel,
+            cache,
+            0,
+            keyset,
+            filters,
+            shard.name,
+        )
+
+    if len(shards) == 1:
+        results = search_shard(shards[0])
+    else:
+        results = [
+            result
+            for shard_results in search_threads.map(search_shard, shards)
+            for result in shard_results
+        ]
+
+    results.sort(key=merge_key)
+    return results[offset : offset + limit]
+
+
+def search_db(
+    sqlite_url: str,
+    query: str,
+    limit: int = 10,
+    passages: bool = False,
+    snippet_size: int = 32,
+    markers: tuple[str, str] = HIGHLIGHT_MARKERS,
+    timeout: float | None = None,
+    cancel: threading.Event | None = None,
+    cache: SearchCache | None = search_cache,
+    offset: int = 0,
+    after: tuple[float, int] | None = None,
+    filters: SearchFilters | None = None,
+    shard: str | None = None,
+) -> list[SearchResult]:
+    start_marker, end_marker = markers
+    key = (
+        sqlite_url,
+        normalize_query(query),
+        limit,
+        passages,
+        snippet_size,
+        markers,
+        offset,
+        after,
+        filters,
+    )
+    fts_table, column = ("passages_fts", 0) if passages else ("documents_fts", 1)
+
+    with get_pool(sqlite_url).connection() as conn:
+        generation = get_generation(conn.cursor())
+        if cache is not None:
+            results = cache.get(key, generation)
+            if results is not None:
+                return results
+
+        # Long running queries are interrupted once they reach their
+        # deadline or are cancelled, since SQLite calls this handler every
+        # few virtual machine instructions.
+        deadline = monotonic() + timeout if timeout else None
+
+        def interrupt() -> bool:
+            if cancel is not None and cancel.is_set():
+                return True
+
+            return deadline is not None and monotonic() > deadline
+
+        conn.set_progress_handler(interrupt, PROGRESS_HANDLER_STEPS)
+        try:
+            cursor = conn.cursor()
+            rank = rank_passages if passages else rank_documents
+            ranking = rank(cursor, query, limit, offset, after, filters)
+
+            # Documents and snippets are only fetched for the page of results,
+            # after ranking them.
+            cursor.execute(
+                """
+            SELECT ROWID, uri, title, type
             FROM documents
-            WHERE ROWID IN (
-                SELECT ROWID
-                FROM documents_fts
-                WHERE documents_fts MATCH ?
-                ORDER BY bm25(documents_fts)
-                LIMIT ?
+            WHERE ROWID IN (SELECT value FROM json_each(?))
+                """,
+                (json.dumps([document_id for document_id, *_ in ranking]),),
+            )
+            documents = {rowid: row for rowid, *row in cursor.fetchall()}
+
+            cursor.execute(
+                f"""
+            SELECT ROWID, snippet({fts_table}, ?, ?, ?, ?, ?)
+            FROM {fts_table}
+            WHERE {fts_table} MATCH ?
+            AND ROWID IN (SELECT value FROM json_each(?))
+                """,
+                (
+                    column,
+                    start_marker,
+                    end_marker,
+                    SNIPPET_ELLIPSIS,
+                    snippet_size,
+                    query,
+                    json.dumps([snippet_id for _, snippet_id, *_ in ranking]),
+                ),
             )
-            """
+            snippets = dict(cursor.fetchall())
+
+            missing = [
+                document_id
+                for document_id, snippet_id, *_ in ranking
+                if snippets.get(snippet_id) is None
+            ]
+            if missing and not passages:
+                cursor.execute(
+                    """
+                SELECT ROWID, body
+                FROM documents
+                WHERE ROWID IN (SELECT value FROM json_each(?))
+                    """,
+                    (json.dumps(missing),),
+                )
+                for document_id, body in cursor.fetchall():
+                    snippets[document_id] = excerpt_snippet(
+                        body, query, snippet_size, markers
+                    )
+        except sqlite3.OperationalError as e:
+            if deadline is not None and monotonic() > deadline:
+                raise TimeoutError(f"search took longer than {timeout}s") from e
+
+            raise
+        finally:
+            conn.set_progress_handler(None, 0)
+
+        results = []
+        for document_id, snippet_id, score, page in ranking:
+            if document_id not in documents:
+                continue
+
+            uri, title, doc_type = documents[document_id]
+            text, highlights = split_highlights(snippets.get(snippet_id, ""), markers)
+            results.append(
+                SearchResult(
+                    uri,
+                    title,
+                    doc_type,
+                    text,
+                    page,
+                    highlights,
+                    encode_cursor(score, document_id, shard),
+                )
+            )
+
+        if cache is not None:
+            cache.put(key, generation, results)
 
-        cursor.execute(sql_query, (query, limit))
-        results = cursor.fetchall()
         return results
+
+
+# Most common terms of the documents, which make for the slowest queries.
+def common_terms(cursor: sqlite3.Cursor, count: int = 5) -> list[str]:
+    cursor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS temp.documents_vocab USING fts5vocab(main, documents_fts, col);"
+    )
+    cursor.execute(
+        """
+    SELECT term FROM temp.documents_vocab
+    WHERE col = 'body' AND term GLOB '[a-z][a-z][a-z]*'
+    ORDER BY doc DESC
+    LIMIT ?
+        """,
+        (count,),
+    )
+    return [term for (term,) in cursor.fetchall()]
+
+
+# Runs every query `rounds` times, bypassing the cache, and returns how many
+# seconds each search took.
+def time_searches(
+    sqlite_url: str,
+    queries: list[str],
+    rounds: int = 3,
+    passages: bool = False,
+) -> list[float]:
+    timings = []
+    for _ in range(rounds):
+        for query in queries:
+            start = perf_counter()
+            search(sqlite_url, query, passages=passages, cache=None)
+            timings.append(perf_counter() - start)
+
+    return timings
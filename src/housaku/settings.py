@@ -1,6 +1,6 @@
 import shutil
-from importlib.metadata import version
-from typing import Type, Tuple
+from functools import cache
+from typing import Literal, Type, Tuple
 from pathlib import Path
 import click
 from pydantic import BaseModel, DirectoryPath, Field
@@ -11,7 +11,9 @@ from pydantic_settings import (
     TomlConfigSettingsSource,
 )
 
-app_name = "housaku"
+from housaku import app_description, app_name
+from housaku.models import Storage
+
 app_dir = Path(click.get_app_dir(app_name=app_name))
 config_file_path = app_dir / "config.toml"
 template_file_path = Path(__file__).parent / "config_template.toml"
@@ -20,23 +22,67 @@ template_file_path = Path(__file__).parent / "config_template.toml"
 class FileSettings(BaseModel):
     include: list[DirectoryPath] = []
     exclude: list[str] = []
+    hash_content: bool = False
+    max_document_size: int = Field(default=16 * 1024 * 1024, ge=0)
 
 
 class FeedSettings(BaseModel):
     urls: list[str] = []
+    max_connections: int = Field(default=32, ge=1)
+    max_connections_per_host: int = Field(default=4, ge=1)
+    timeout: float = Field(default=30.0, gt=0)
+    retries: int = Field(default=2, ge=0)
+    parse_executor: Literal["thread", "process"] = "process"
+
+
+class PassageSettings(BaseModel):
+    enabled: bool = False
+    size: int = Field(default=200, ge=1)
+
+
+class SearchSettings(BaseModel):
+    snippet_size: int = Field(default=32, ge=1, le=64)
+    connections: int = Field(default=4, ge=1)
+    timeout: float = Field(default=5.0, gt=0)
+    cache_size: int = Field(default=256, ge=0)
+    debounce: float = Field(default=0.15, ge=0)
+    highlight_style: str = "bold underline"
+
+
+class WatchSettings(BaseModel):
+    debounce: float = Field(default=1.0, ge=0)
+    max_delay: float = Field(default=10.0, ge=0)
+    feed_interval: float = Field(default=1800.0, ge=0)
+
+
+class StorageSettings(BaseModel):
+    mode: Literal["plain", "compressed", "contentless"] = "plain"
+    detail: Literal["full", "column", "none"] = "full"
+    columnsize: bool = True
+    index_uri: bool = True
+
+    def layout(self) -> Storage:
+        return Storage(self.mode, self.detail, self.columnsize, self.index_uri)
+
+
+class ShardSettings(BaseModel):
+    mode: Literal["none", "root", "hash"] = "none"
+    count: int = Field(default=4, ge=1)
 
 
 class Settings(BaseSettings):
     name: str = app_name
-    description: str = (
-        "A powerful personal search engine built on top of SQLite's FTS5."
-    )
-    version: str = version("housaku")
+    description: str = app_description
 
     sqlite_url: str = f"{app_dir / 'db.sqlite3'}"
     theme: str = "dracula"
     files: FileSettings = Field(default_factory=FileSettings)
     feeds: FeedSettings = Field(default_factory=FeedSettings)
+    passages: PassageSettings = Field(default_factory=PassageSettings)
+    search: SearchSettings = Field(default_factory=SearchSettings)
+    storage: StorageSettings = Field(default_factory=StorageSettings)
+    shards: ShardSettings = Field(default_factory=ShardSettings)
+    watch: WatchSettings = Field(default_factory=WatchSettings)
 
     model_config = SettingsConfigDict(
         toml_file=config_file_path,
@@ -65,6 +111,29 @@ class Settings(BaseSettings):
             file_secret_settings,
         )
 
+    # Looking up the installed version is slow, so it's only done when needed.
+    @property
+    def version(self) -> str:
+        return get_version()
+
+
+@cache
+def get_version() -> str:
+    from importlib.metadata import version
+
+    return version(app_name)
+
+
+# Settings are loaded once, the first time they are needed, and the database
+# is initialized along with them.
+@cache
+def get_settings() -> Settings:
+    from housaku.db import init_db
+
+    settings = Settings()
+    init_db(settings.sqlite_url, settings.storage.layout())
+    return settings
+
 
 if __name__ == "__main__":
     settings = Settings()
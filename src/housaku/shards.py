@@ -0,0 +1,156 @@
+import hashlib
+import re
+import sqlite3
+from pathlib import Path
+from typing import Callable, NamedTuple
+from housaku.db import init_db, with_db
+from housaku.models import Shard, Storage
+
+# Documents can be split across several databases, or shards, so that every
+# one of them can be indexed, rebuilt or vacuumed on its own. With "root" every
+# include root gets its own shard, and all feeds share another one. With "hash"
+# every file and feed is assigned to one of `count` buckets by hashing its
+# path or URL, which also splits large roots. The main database keeps the
+# registry of shards, and searches go to every shard attached to it.
+SHARD_MODES = ("none", "root", "hash")
+MAIN_SHARD = "main"
+FEEDS_SHARD = "feeds"
+
+REGISTER_SHARD = """
+INSERT INTO shards (name, sqlite_url) VALUES (?, ?)
+ON CONFLICT(name) DO UPDATE SET sqlite_url = excluded.sqlite_url
+"""
+
+
+# What gets indexed into a shard. With "hash", files are only indexed by the
+# shard whose `partition` they belong to.
+class ShardPlan(NamedTuple):
+    shard: Shard
+    roots: list[Path]
+    feeds: list[str]
+    partition: Callable[[Path], bool] | None = None
+
+
+def bucket(key: str, count: int) -> int:
+    digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+    return int.from_bytes(digest) % count
+
+
+def partition(n: int, count: int) -> Callable[[Path], bool]:
+    return lambda file: bucket(f"{file}", count) == n
+
+
+def shard_url(sqlite_url: str, name: str) -> str:
+    return f"{Path(sqlite_url).parent / 'shards' / f'{name}.sqlite3'}"
+
+
+# Names are readable but still unique for roots with the same name.
+def root_shard_name(root: Path) -> str:
+    slug = re.sub(r"\W+", "_", root.name.lower()).strip("_") or "root"
+    digest = hashlib.blake2b(f"{root}".encode(), digest_size=4).hexdigest()
+    return f"{slug}_{digest}"
+
+
+def plan_shards(
+    sqlite_url: str,
+    roots: list[Path],
+    feeds: list[str],
+    mode: str = "none",
+    count: int = 4,
+) -> list[ShardPlan]:
+    if mode not in SHARD_MODES:
+        raise ValueError(f'Invalid shard mode "{mode}"')
+
+    if mode == "none":
+        return [ShardPlan(Shard(MAIN_SHARD, sqlite_url), roots, feeds)]
+
+    plans = []
+    if mode == "root":
+        for root in roots:
+            name = root_shard_name(root.resolve())
+            plans.append(
+                ShardPlan(Shard(name, shard_url(sqlite_url, name)), [root], [])
+            )
+
+        if feeds:
+            shard = Shard(FEEDS_SHARD, shard_url(sqlite_url, FEEDS_SHARD))
+            plans.append(ShardPlan(shard, [], feeds))
+
+        return plans
+
+    for n in range(count):
+        name = f"bucket_{n}"
+        plans.append(
+            ShardPlan(
+                Shard(name, shard_url(sqlite_url, name)),
+                roots,
+                [url for url in feeds if bucket(url, count) == n],
+                partition(n, count),
+            )
+        )
+
+    return plans
+
+
+def get_shards(cursor: sqlite3.Cursor, attached_only: bool = False) -> list[Shard]:
+    cursor.execute(
+        f"""
+    SELECT name, sqlite_url, attached
+    FROM shards
+    {"WHERE attached" if attached_only else ""}
+    ORDER BY name
+        """
+    )
+    return [
+        Shard(name, url, bool(attached)) for name, url, attached in cursor.fetchall()
+    ]
+
+
+def register_shard(sqlite_url: str, shard: Shard) -> None:
+    with with_db(sqlite_url) as conn:
+        conn.execute(REGISTER_SHARD, (shard.name, shard.sqlite_url))
+
+
+# Creates the database of a shard, if it doesn't exist yet, and adds it to the
+# registry. Returns the storage layout the shard uses.
+def create_shard(
+    sqlite_url: str, shard: Shard, storage: Storage = Storage()
+) -> Storage:
+    Path(shard.sqlite_url).parent.mkdir(parents=True, exist_ok=True)
+    storage = init_db(shard.sqlite_url, storage)
+    register_shard(sqlite_url, shard)
+    return storage
+
+
+# Detached shards are left as they are, but searches skip them until they are
+# attached again. Returns False if there is no shard with that name.
+def set_attached(sqlite_url: str, name: str, attached: bool) -> bool:
+    with with_db(sqlite_url) as conn:
+        cursor = conn.execute(
+            "UPDATE shards SET attached = ? WHERE name = ?", (attached, name)
+        )
+        return cursor.rowcount > 0
+
+
+def unregister_shards(sqlite_url: str) -> list[Shard]:
+    with with_db(sqlite_url) as conn:
+        shards = get_shards(conn.cursor())
+        conn.execute("DELETE FROM shards")
+
+    return shards
+
+
+# Every database documents may be in: the main one and all registered shards,
+# optionally only those in `names`.
+def list_databases(sqlite_url: str, names: tuple[str, ...] = ()) -> list[Shard]:
+    with with_db(sqlite_url) as conn:
+        databases = [Shard(MAIN_SHARD, sqlite_url), *get_shards(conn.cursor())]
+
+    if names:
+        missing = set(names) - {database.name for database in databases}
+        if missing:
+            raise ValueError(f"Unknown shards: {', '.join(sorted(missing))}")
+
+        databases = [database for database in databases if database.name in names]
+
+    return databases
@@ -1,11 +1,13 @@
-import textwrap
 from time import perf_counter
+import asyncio
+import threading
 import urllib.parse
 from textual import on
 from textual.app import App, ComposeResult
 from textual.binding import Binding
 from textual.containers import Horizontal, Container
 from textual.reactive import reactive
+from textual.timer import Timer
 from textual.validation import Number, ValidationResult, Validator
 from textual.widgets import (
     Button,
@@ -16,10 +18,12 @@ from textual.widgets import (
     ListView,
     Static,
 )
-from housaku.db import init_db
+from housaku.db import get_pool
 from housaku.files import SUPPORTED_EXTENSIONS
-from housaku.settings import Settings
-from housaku.search import search
+from housaku.models import SearchFilters, SearchResult
+from housaku.settings import Settings, get_settings
+from housaku.search import as_prefix_query, parse_filters, search, search_cache
+from housaku.utils import highlight_snippet
 
 
 class SearchInputValidator(Validator):
@@ -37,6 +41,10 @@ class ItemMetadata(Static):
         super().__init__(*args, **kwargs)
 
 
+class LoadMoreItem(ListItem):
+    pass
+
+
 class HousakuApp(App):
     TITLE = "housaku"
     CSS_PATH = "global.tcss"
@@ -47,14 +55,25 @@ class HousakuApp(App):
     ]
 
     search_query: reactive[str] = reactive("")
+    search_filters: reactive[str] = reactive("")
     max_results: reactive[int] = reactive(10)
 
+    found: int = 0
+    elapsed_time: float = 0.0
+    next_cursor: str | None = None
+    search_timer: Timer | None = None
+    cancel_search: threading.Event | None = None
+    last_search: tuple[str, SearchFilters] = ("", SearchFilters())
+
     def __init__(self, settings: Settings):
         super().__init__()
 
         self.settings = settings
         self.theme = self.settings.theme
 
+        get_pool(self.settings.sqlite_url, self.settings.search.connections)
+        search_cache.max_size = self.settings.search.cache_size
+
     def compose(self) -> ComposeResult:
         yield Container(
             Static(
@@ -79,6 +98,15 @@ class HousakuApp(App):
                 ),
                 classes="query",
             ),
+            Container(
+                Label("filters", classes="filters__label"),
+                Input(
+                    placeholder="type:pdf since:2024-01-01",
+                    type="text",
+                    classes="filters__input",
+                ),
+                classes="filters",
+            ),
             Container(
                 Label("#", classes="nresults__label"),
                 Input(
@@ -118,11 +146,20 @@ class HousakuApp(App):
             )
             return
 
-        await self._search()
+        if self.search_timer is not None:
+            self.search_timer.stop()
+
+        self.run_worker(self._search(), group="search", exclusive=True)
 
     @on(Input.Changed, selector=".query__input")
     def update_search_query(self, event: Input.Changed) -> None:
         self.search_query = event.value
+        self._search_as_you_type()
+
+    @on(Input.Changed, selector=".filters__input")
+    def update_search_filters(self, event: Input.Changed) -> None:
+        self.search_filters = event.value
+        self._search_as_you_type()
 
     @on(Input.Changed, selector=".nresults__input")
     def update_max_results(self, event: Input.Changed) -> None:
@@ -132,44 +169,137 @@ class HousakuApp(App):
             self.max_results = 10
 
     @on(ListView.Selected)
-    def open_search_result(self, event: ListView.Selected) -> None:
+    async def open_search_result(self, event: ListView.Selected) -> None:
+        if isinstance(event.item, LoadMoreItem):
+            await self._load_more()
+            return
+
         link = event.item.query_exactly_one(ItemMetadata).link
         self.open_url(link)
 
-    async def _search(self) -> None:
-        self.results.clear()
-        self.results.loading = True
-        start_time = perf_counter()
+    # Searches once the query stops changing for a moment. Only the latest
+    # search renders its results, since starting a new one cancels the
+    # previous worker and interrupts its query.
+    def _search_as_you_type(self) -> None:
+        if self.search_timer is not None:
+            self.search_timer.stop()
+
+        if not self.search_query.strip():
+            if self.cancel_search is not None:
+                self.cancel_search.set()
+            return
+
+        self.search_timer = self.set_timer(
+            self.settings.search.debounce,
+            lambda: self.run_worker(
+                self._search(prefix=True), group="search", exclusive=True
+            ),
+        )
+
+    async def _search(self, prefix: bool = False) -> None:
+        if self.cancel_search is not None:
+            self.cancel_search.set()
+        cancel = self.cancel_search = threading.Event()
 
         try:
-            documents = search(
-                self.settings.sqlite_url, self.search_query, self.max_results
-            )
-        except Exception as e:
-            self.notify(
-                f"Something went wrong with your query: {e}.",
-                severity="error",
-            )
-            self.results.loading = False
+            query, filters = parse_filters(f"{self.search_query} {self.search_filters}")
+        except ValueError as e:
+            if not prefix:
+                self.notify(f"{e}.", severity="error")
             return
 
-        end_time = perf_counter()
+        if prefix:
+            query = as_prefix_query(query)
 
-        if not documents:
-            self.notify(
-                "No results found.",
-                severity="warning",
-            )
+        self.elapsed_time = 0.0
+        self.results.loading = not prefix
+        try:
+            documents = await self._fetch(query, filters, cancel, notify=not prefix)
+        finally:
             self.results.loading = False
+
+        if documents is None or cancel.is_set():
             return
 
-        for uri, title, doc_type, content in documents:
+        self.last_search = (query, filters)
+        self.found = 0
+        await self.results.clear()
+        if not documents:
+            if not prefix:
+                self.notify(
+                    "No results found.",
+                    severity="warning",
+                )
+            self.results.border_subtitle = ""
+            return
+
+        self._mount_results(documents)
+        if not prefix:
+            self.results.focus()
+            self.results.index = 0
+
+    async def _load_more(self) -> None:
+        index = self.results.index
+        await self.results.query(LoadMoreItem).remove()
+
+        cancel = self.cancel_search = threading.Event()
+        documents = await self._fetch(*self.last_search, cancel, self.next_cursor)
+        if documents:
+            self._mount_results(documents)
+            self.results.index = index
+
+    async def _fetch(
+        self,
+        query: str,
+        filters: SearchFilters,
+        cancel: threading.Event,
+        after: str | None = None,
+        notify: bool = True,
+    ) -> list[SearchResult] | None:
+        start_time = perf_counter()
+
+        try:
+            documents = await asyncio.to_thread(
+                search,
+                self.settings.sqlite_url,
+                query,
+                self.max_results,
+                self.settings.passages.enabled,
+                self.settings.search.snippet_size,
+                timeout=self.settings.search.timeout,
+                cancel=cancel,
+                after=after,
+                filters=filters,
+            )
+        except asyncio.CancelledError:
+            cancel.set()
+            raise
+        except Exception as e:
+            # Queries are often invalid while they are being typed, so errors
+            # are only shown for searches that were explicitly submitted.
+            if notify and not cancel.is_set():
+                self.notify(
+                    f"Something went wrong with your query: {e}.",
+                    severity="error",
+                )
+            return None
+
+        self.elapsed_time += perf_counter() - start_time
+        return documents
+
+    # Results are mounted one page at a time, followed by an item to load the
+    # next page if there might be more of them.
+    def _mount_results(self, documents: list[SearchResult]) -> None:
+        for uri, title, doc_type, content, page, highlights, _ in documents:
             encoded_uri = urllib.parse.quote(uri, safe=":/")
+            fragment = f"#page={page}" if page else ""
             doc_title = title if title else uri
-            truncated_content = textwrap.shorten(content, width=280, placeholder="...")
+            snippet = highlight_snippet(
+                content, highlights, self.settings.search.highlight_style
+            )
 
             if doc_type in SUPPORTED_EXTENSIONS:
-                link = f"[link=file://{encoded_uri}]{uri}[/]"
+                link = f"[link=file://{encoded_uri}{fragment}]{uri}[/]"
             else:
                 link = f"[link={uri}]{uri}[/]"
 
@@ -179,25 +309,28 @@ class HousakuApp(App):
                     Container(
                         Static(doc_title, classes="result__title"),
                         Static(link, classes="result__link"),
-                        Static(truncated_content, classes="result__content"),
+                        Static(snippet, classes="result__content"),
                         ItemMetadata(encoded_uri),
                     ),
                     classes="result",
                 )
             )
 
-        elapsed_time = end_time - start_time
-        self.results.loading = False
-        self.results.focus()
-        self.results.index = 0
+        self.found += len(documents)
+        self.next_cursor = documents[-1].cursor
+        if len(documents) >= self.max_results:
+            self.results.mount(
+                LoadMoreItem(
+                    Static("Load more results", classes="more__label"),
+                    classes="more",
+                )
+            )
+
         self.results.border_subtitle = (
-            f"Found {len(documents)} results in {elapsed_time:.3f}s"
+            f"Found {self.found} results in {self.elapsed_time:.3f}s"
         )
 
 
 if __name__ == "__main__":
-    settings = Settings()
-    init_db(settings.sqlite_url)
-
-    app = HousakuApp(settings)
+    app = HousakuApp(get_settings())
     app.run()
@@ -1,17 +1,110 @@
+import os
+from typing import Iterable
+from urllib.parse import urlparse
 from rich.console import Console
-from selectolax.parser import HTMLParser
+from rich.text import Text
 
 console = Console()
 
+# Messages about every single document are only shown when running with
+# `--verbose`, since printing them is slow on large runs.
+verbose = False
+
+
+def set_verbose(value: bool) -> None:
+    global verbose
+    verbose = value
+
+
+def log(message: str) -> None:
+    if verbose:
+        console.print(message)
+
+
+# Returns the directory of a file, or the equivalent for a URL, which is used
+# to filter search results by their location.
+def uri_dir(uri: str) -> str:
+    url = urlparse(uri)
+    if url.scheme and url.netloc:
+        return f"{url.scheme}://{url.netloc}{os.path.dirname(url.path)}".rstrip("/")
+
+    return os.path.dirname(uri)
+
+
+def highlight_snippet(
+    snippet: str,
+    highlights: Iterable[tuple[int, int]],
+    style: str = "bold",
+    base_style: str = "",
+) -> Text:
+    text = Text(snippet, style=base_style)
+    for start, end in highlights:
+        text.stylize(style, start, end)
+
+    return text
+
 
 def clean_html(html: str) -> str:
+    from selectolax.parser import HTMLParser
+
     tree = HTMLParser(html)
     for tag in tree.css("script, style, video, img, canvas"):
         tag.decompose()
 
-    text = "".join(node.text(deep=True) for node in tree.css("main"))
+    # Pages without a <main> element fall back to their articles, and then to
+    # the whole body.
+    text = ""
+    for selector in ("main", "article", "body"):
+        text = "".join(node.text(deep=True) for node in tree.css(selector))
+        if text.strip():
+            break
+
     lines = (line.strip() for line in text.splitlines())
     chunks = (phrase.strip() for line in lines for phrase in line.split(" "))
     cleaned_text = " ".join(chunk for chunk in chunks if chunk)
 
     return cleaned_text
+
+
+# Splits a document into passages of at most `size` words. Passages never span
+# more than one page, so each of them keeps the page it comes from. Chunks
+# without pages, like the ones of plain text files, might end in the middle of
+# a word, which is carried over to the next chunk.
+def split_passages(
+    chunks: Iterable[tuple[int | None, str]],
+    size: int,
+) -> list[tuple[int | None, str]]:
+    passages = []
+    words = []
+    page = None
+    partial = ""
+
+    def flush() -> None:
+        if words:
+            passages.append((page, " ".join(words)))
+            words.clear()
+
+    for chunk_page, text in chunks:
+        if chunk_page != page:
+            if partial:
+                words.append(partial)
+                partial = ""
+
+            flush()
+            page = chunk_page
+
+        tokens = (partial + text).split()
+        partial = ""
+        if tokens and text and not text[-1].isspace():
+            partial = tokens.pop()
+
+        for token in tokens:
+            words.append(token)
+            if len(words) >= size:
+                flush()
+
+    if partial:
+        words.append(partial)
+
+    flush()
+    return passages
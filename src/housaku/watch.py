@@ -0,0 +1,304 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+from pathlib import Path
+from time import monotonic
+from typing import Callable, Iterable, NamedTuple
+from housaku.files import (
+    SUPPORTED_EXTENSIONS,
+    FileIndexer,
+    compile_patterns,
+    remove_files,
+)
+from housaku.shards import ShardPlan
+from housaku.utils import log
+
+# Constants from <sys/inotify.h>.
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+# Files are only indexed once they are closed after being written or moved
+# into place, which is also how most editors save them.
+WATCH_MASK = (
+    IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_ONLYDIR
+)
+
+EVENT_HEADER = struct.Struct("iIII")
+READ_SIZE = 64 * 1024
+
+
+class InotifyEvent(NamedTuple):
+    path: Path
+    mask: int
+
+
+# Thin wrapper around the inotify API of Linux, which only takes care of
+# watching directories and turning what is read from its file descriptor
+# into events with full paths.
+class Inotify:
+    def __init__(self) -> None:
+        if not sys.platform.startswith("linux"):
+            raise OSError("watching files is only supported on Linux")
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._libc.inotify_add_watch.argtypes = (
+            ctypes.c_int,
+            ctypes.c_char_p,
+            ctypes.c_uint32,
+        )
+        self._libc.inotify_rm_watch.argtypes = (ctypes.c_int, ctypes.c_int)
+
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            self._raise()
+
+        self.watches: dict[int, Path] = {}
+        self._descriptors: dict[Path, int] = {}
+
+    def __enter__(self) -> "Inotify":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def add_watch(self, path: Path, mask: int = WATCH_MASK) -> None:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            self._raise(path)
+
+        self.watches[wd] = path
+        self._descriptors[path] = wd
+
+    # Removes the watches of a directory and of everything under it, for
+    # example because it was moved somewhere else.
+    def remove_watches(self, path: Path) -> None:
+        for watched in [p for p in self._descriptors if p.is_relative_to(path)]:
+            wd = self._descriptors.pop(watched)
+            self.watches.pop(wd, None)
+            self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self) -> list[InotifyEvent]:
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, READ_SIZE)
+            except BlockingIOError:
+                return events
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset : offset + length].rstrip(b"\0")
+                offset += length
+
+                if mask & IN_IGNORED:
+                    path = self.watches.pop(wd, None)
+                    if path is not None and self._descriptors.get(path) == wd:
+                        del self._descriptors[path]
+                    continue
+
+                dir = self.watches.get(wd)
+                if dir is None and not mask & IN_Q_OVERFLOW:
+                    continue
+
+                path = dir / os.fsdecode(name) if dir and name else dir
+                events.append(InotifyEvent(path or Path(), mask))
+
+    def _raise(self, path: Path | None = None) -> None:
+        code = ctypes.get_errno()
+        if code == errno.ENOSPC:
+            raise OSError(
+                code,
+                "too many directories to watch, "
+                "raise fs.inotify.max_user_watches to watch all of them",
+            )
+
+        raise OSError(code, os.strerror(code), path and f"{path}")
+
+
+class Changes(NamedTuple):
+    changed: set[Path]
+    deleted: set[Path]
+    rescan: bool = False
+
+
+# Watches every directory under `roots`, except the ones excluded, and
+# collects the files that changed or were deleted. Bursts of events are
+# coalesced: changes are only passed on once there were no new events for
+# `debounce` seconds, or at most `max_delay` seconds after the first one.
+# While there is nothing to pass on, it just blocks waiting for events.
+class Watcher:
+    def __init__(
+        self,
+        roots: Iterable[Path],
+        exclude: Iterable[str] = (),
+        debounce: float = 1.0,
+        max_delay: float = 10.0,
+    ) -> None:
+        self.roots = [root.resolve() for root in roots]
+        self.debounce = debounce
+        self.max_delay = max_delay
+
+        self._excluded = compile_patterns(exclude)
+        self._inotify = Inotify()
+        self._stop_read, self._stop_write = os.pipe()
+
+        for root in self.roots:
+            self._watch_tree(root)
+
+    def __enter__(self) -> "Watcher":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._inotify.close()
+        for fd in (self._stop_read, self._stop_write):
+            os.close(fd)
+
+    # Can be called from any thread to make `run` return.
+    def stop(self) -> None:
+        os.write(self._stop_write, b"\0")
+
+    def run(self, on_changes: Callable[[Changes], None]) -> None:
+        changes = Changes(set(), set())
+        first_event = last_event = None
+
+        while True:
+            timeout = None
+            if first_event is not None:
+                now = monotonic()
+                timeout = min(
+                    last_event + self.debounce - now,
+                    first_event + self.max_delay - now,
+                )
+
+            # Once `max_delay` passed, the changes collected so far are passed
+            # on before reading more events, even if they keep coming.
+            if timeout is None or timeout > 0:
+                ready, _, _ = select.select(
+                    [self._inotify.fd, self._stop_read], [], [], timeout
+                )
+                if self._stop_read in ready:
+                    return
+
+                if ready:
+                    events = self._inotify.read()
+                    for event in events:
+                        changes = self._collect(event, changes)
+
+                    if events:
+                        last_event = monotonic()
+                        first_event = first_event or last_event
+                    continue
+
+            if changes.changed or changes.deleted or changes.rescan:
+                on_changes(changes)
+
+            changes = Changes(set(), set())
+            first_event = last_event = None
+
+    def _is_excluded(self, path: Path) -> bool:
+        return bool(self._excluded and self._excluded.match(path.name))
+
+    def _watch_tree(self, root: Path) -> list[Path]:
+        files = []
+        for dir, dirs, names in os.walk(root):
+            dirs[:] = [d for d in dirs if not self._is_excluded(Path(d))]
+            try:
+                self._inotify.add_watch(Path(dir))
+            except FileNotFoundError:
+                continue
+
+            files.extend(
+                Path(dir) / name for name in names if not self._is_excluded(Path(name))
+            )
+
+        return files
+
+    def _collect(self, event: InotifyEvent, changes: Changes) -> Changes:
+        if event.mask & IN_Q_OVERFLOW:
+            return changes._replace(rescan=True)
+
+        path = event.path
+        if self._is_excluded(path):
+            return changes
+
+        if event.mask & IN_ISDIR:
+            if event.mask & (IN_CREATE | IN_MOVED_TO):
+                # Files can be created in a new directory before it's watched,
+                # so all of them are indexed.
+                for file in self._watch_tree(path):
+                    changes.changed.add(file)
+                    changes.deleted.discard(file)
+            elif event.mask & IN_MOVED_FROM:
+                self._inotify.remove_watches(path)
+                changes.deleted.add(path)
+            elif event.mask & IN_DELETE:
+                changes.deleted.add(path)
+        elif event.mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+            changes.changed.add(path)
+            changes.deleted.discard(path)
+        elif event.mask & (IN_DELETE | IN_MOVED_FROM):
+            changes.deleted.add(path)
+            changes.changed.discard(path)
+
+        return changes
+
+
+# Passes the changes on to the indexer of the shard each file belongs to.
+# Removals go to every shard with the same root, since a directory can hold
+# files of several of them.
+def apply_changes(
+    targets: list[tuple[ShardPlan, FileIndexer]],
+    changes: Changes,
+    exclude: set[str] = set(),
+) -> None:
+    for plan, indexer in targets:
+        roots = [root.resolve() for root in plan.roots]
+        if changes.rescan:
+            for root in roots:
+                indexer.index(root, exclude, plan.partition)
+            continue
+
+        for path in changes.deleted:
+            if any(path.is_relative_to(root) for root in roots):
+                remove_files(indexer.writer, path)
+                log(f'[yellow][Remove][/] removed "{path}".')
+
+        files = [
+            file
+            for file in changes.changed
+            if file.suffix in SUPPORTED_EXTENSIONS
+            and any(file.is_relative_to(root) for root in roots)
+            and (plan.partition is None or plan.partition(file))
+        ]
+        if files:
+            indexer.update(files)
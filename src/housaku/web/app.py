@@ -1,43 +1,157 @@
+import asyncio
+import threading
+from contextlib import asynccontextmanager
 from pathlib import Path
 from starlette.applications import Starlette
+from starlette.requests import Request
 from starlette.routing import Mount, Route
 from starlette.staticfiles import StaticFiles
-from starlette.responses import HTMLResponse, JSONResponse
-from housaku.db import init_db
-from housaku.settings import Settings
-from housaku.search import search
-
-settings = Settings()
-init_db(settings.sqlite_url)
+from starlette.responses import HTMLResponse, JSONResponse, Response
+from housaku.db import get_pool
+from housaku.settings import get_settings
+from housaku.search import (
+    as_prefix_query,
+    make_filters,
+    merge_filters,
+    parse_filters,
+    search,
+    search_cache,
+)
 
 base_dir = Path(__file__).resolve().parent
 
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+# Settings and the database are only loaded once the server starts, and not
+# when this module is imported.
+@asynccontextmanager
+async def lifespan(app: Starlette):
+    settings = get_settings()
+    get_pool(settings.sqlite_url, settings.search.connections)
+    search_cache.max_size = settings.search.cache_size
+
+    # Searches run on worker threads, and no more of them than connections in
+    # the pool run at the same time so none of them have to wait for one.
+    app.state.settings = settings
+    app.state.search_limiter = asyncio.Semaphore(settings.search.connections)
+    yield
+
 
 async def homepage(_):
     index_page = base_dir / "index.html"
     return HTMLResponse(index_page.open().read())
 
 
-async def search_results(request):
-    data = await request.json()
-    query = data["query"]
+async def wait_for_disconnect(request: Request) -> None:
+    while not await request.is_disconnected():
+        await asyncio.sleep(0.1)
+
+
+async def search_results(request: Request):
     try:
-        results = search(settings.sqlite_url, query, 100)
+        data = await request.json()
+        query = data["query"]
+        if not isinstance(query, str):
+            raise TypeError("query must be a string")
+
+        limit = min(int(data.get("limit", PAGE_SIZE)), MAX_PAGE_SIZE)
+        page = int(data.get("page", 1))
+        after = data.get("cursor")
+
+        # Filters can be written in the query, in their own string, or sent
+        # as separate fields.
+        terms, filters = parse_filters(f"{query} {data.get('filters') or ''}")
+        filters = merge_filters(
+            filters,
+            make_filters(
+                data.get("types") or (),
+                data.get("path"),
+                data.get("since"),
+                data.get("until"),
+            ),
+        )
+    except KeyError as e:
+        return JSONResponse({"detail": f"missing {e}"}, status_code=400)
+    except (TypeError, ValueError) as e:
+        return JSONResponse({"detail": f"{e}"}, status_code=400)
+
+    # Queries sent while typing match the last term as a prefix.
+    if data.get("prefix"):
+        terms = as_prefix_query(terms)
+
+    if limit < 1 or page < 1:
+        return JSONResponse(
+            {"detail": "limit and page must be positive integers"},
+            status_code=400,
+        )
+
+    settings = request.app.state.settings
+    async with request.app.state.search_limiter:
+        cancel = threading.Event()
+        search_task = asyncio.create_task(
+            asyncio.to_thread(
+                search,
+                settings.sqlite_url,
+                terms,
+                limit,
+                settings.passages.enabled,
+                settings.search.snippet_size,
+                timeout=settings.search.timeout,
+                cancel=cancel,
+                offset=0 if after else (page - 1) * limit,
+                after=after,
+                filters=filters,
+            )
+        )
+        disconnect_task = asyncio.create_task(wait_for_disconnect(request))
+
+        try:
+            await asyncio.wait(
+                {search_task, disconnect_task},
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+        finally:
+            disconnect_task.cancel()
+
+        # Nobody is waiting for the results anymore, so the query is
+        # interrupted to release its connection as soon as possible.
+        if not search_task.done():
+            cancel.set()
+            await asyncio.wait({search_task})
+
+            # The interrupted query fails, which is expected, so its error is
+            # retrieved only to keep it from being logged as unhandled.
+            if not search_task.cancelled():
+                search_task.exception()
+            return Response(status_code=499)
+
+    try:
+        results = search_task.result()
         return JSONResponse(
             {
                 "query": query,
                 "results": results,
+                "next_cursor": results[-1].cursor if len(results) == limit else None,
             }
         )
+    except TimeoutError as e:
+        return JSONResponse({"detail": f"{e}"}, status_code=504)
     except Exception as e:
-        return 404, {"detail": f"{e}"}
+        return JSONResponse({"detail": f"{e}"}, status_code=400)
+
+
+async def stats(_):
+    return JSONResponse({"cache": search_cache.info()})
 
 
 routes = [
     Route("/", homepage, methods=["GET"]),
     Route("/search", search_results, methods=["POST"]),
+    Route("/stats", stats, methods=["GET"]),
     Mount("/static", app=StaticFiles(directory=base_dir / "static"), name="static"),
 ]
 
 
-app = Starlette(routes=routes)
+app = Starlette(routes=routes, lifespan=lifespan)
@@ -0,0 +1,145 @@
+import asyncio
+import random
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+import pymupdf
+from aiohttp import web
+
+FORMATS = ("txt", "csv", "pdf")
+
+WORDS = """
+the of and to in is was that it for on with as by at from be this which or an
+are not but had have were one all they their there been has more when who will
+would no if out so said what up its about into than them can only other time
+new some could these two may first then do any like my now over such our man me
+even most made after also did many before must through back years where much
+your way well down should because each just those people how too little state
+good very make world still own see men work long get here between both life
+being under never day same another know while last might us great old year off
+come since against go came right used take three ocean whale ship sea captain
+harpoon voyage island storm sailor monster laboratory creature science lightning
+library archive search engine index query document passage snippet ranking
+""".split()
+
+# Frequent words appear much more often than rare ones, roughly like in real
+# text, so queries match a realistic share of documents.
+WEIGHTS = [1 / rank for rank in range(1, len(WORDS) + 1)]
+
+
+def make_text(rng: random.Random, size: int) -> str:
+    lines = []
+    length = 0
+    while length < size:
+        line = " ".join(rng.choices(WORDS, WEIGHTS, k=rng.randint(8, 16)))
+        lines.append(line.capitalize() + ".")
+        length += len(line) + 2
+
+    return "\n".join(lines)
+
+
+def make_csv(rng: random.Random, size: int) -> str:
+    rows = ["id,title,description"]
+    length = 0
+    while length < size:
+        title = " ".join(rng.choices(WORDS, WEIGHTS, k=3))
+        description = " ".join(rng.choices(WORDS, WEIGHTS, k=12))
+        row = f'{len(rows)},{title},"{description}"'
+        rows.append(row)
+        length += len(row) + 1
+
+    return "\n".join(rows)
+
+
+def make_pdf(rng: random.Random, size: int, file: Path) -> None:
+    text = make_text(rng, size)
+    page_size = 2500
+
+    with pymupdf.open() as doc:
+        for start in range(0, len(text), page_size):
+            page = doc.new_page()
+            page.insert_textbox(
+                page.rect + (36, 36, -36, -36),
+                text[start : start + page_size],
+                fontsize=7,
+            )
+        doc.save(file)
+
+
+# Writes `count` documents of about `size` bytes each under `root`, cycling
+# through `formats` and spreading them over a few directories. The same seed
+# always produces the same corpus.
+def make_corpus(
+    root: Path,
+    count: int = 30,
+    size: int = 20_000,
+    formats: tuple[str, ...] = FORMATS,
+    seed: int = 42,
+) -> list[Path]:
+    rng = random.Random(seed)
+    files = []
+    for n in range(count):
+        extension = formats[n % len(formats)]
+        directory = root / f"dir_{n % 5}"
+        directory.mkdir(parents=True, exist_ok=True)
+
+        file = directory / f"doc_{n}.{extension}"
+        if extension == "pdf":
+            make_pdf(rng, size, file)
+        elif extension == "csv":
+            file.write_text(make_csv(rng, size))
+        else:
+            file.write_text(make_text(rng, size))
+
+        files.append(file)
+
+    return files
+
+
+# Serves a feed with `count` posts from a local aiohttp server running on its
+# own thread, and yields the URL of the feed.
+@contextmanager
+def serve_feed(count: int = 50, size: int = 5_000, seed: int = 42) -> Iterator[str]:
+    rng = random.Random(seed)
+    posts = [make_text(rng, size) for _ in range(count)]
+
+    async def feed(request: web.Request) -> web.Response:
+        items = "".join(
+            f"<item><title>Post {n}</title>"
+            f"<link>{request.url.origin()}/posts/{n}</link></item>"
+            for n in range(count)
+        )
+        return web.Response(
+            text=f'<?xml version="1.0"?><rss version="2.0"><channel>'
+            f"<title>Bench</title>{items}</channel></rss>",
+            content_type="application/rss+xml",
+        )
+
+    async def post(request: web.Request) -> web.Response:
+        body = posts[int(request.match_info["n"])].replace("\n", "</p><p>")
+        return web.Response(
+            text=f"<html><body><main><p>{body}</p></main></body></html>",
+            content_type="text/html",
+        )
+
+    app = web.Application()
+    app.router.add_get("/feed", feed)
+    app.router.add_get("/posts/{n}", post)
+
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    loop.run_until_complete(site.start())
+    port = site._server.sockets[0].getsockname()[1]
+
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{port}/feed"
+    finally:
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
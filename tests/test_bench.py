@@ -0,0 +1,121 @@
+import asyncio
+import os
+from itertools import count
+from pathlib import Path
+import pytest
+from housaku.db import BatchWriter, init_db, rebuild_fts
+from housaku.feeds import index_feed
+from housaku.files import FileIndexer, list_files, read_file
+from housaku.search import search
+from tests.corpus import FORMATS, make_corpus, serve_feed
+
+# The corpus is small by default so the suite stays fast. Larger ones can be
+# generated for a real comparison, e.g. with HOUSAKU_BENCH_FILES=1000.
+BENCH_FILES = int(os.environ.get("HOUSAKU_BENCH_FILES", 15))
+BENCH_SIZE = int(os.environ.get("HOUSAKU_BENCH_SIZE", 20_000))
+BENCH_POSTS = int(os.environ.get("HOUSAKU_BENCH_POSTS", 50))
+PASSAGE_SIZE = 200
+
+QUERIES = {
+    "term": "ocean",
+    "phrase": '"the whale"',
+    "prefix": "lab*",
+    "boolean": "ocean AND (whale OR ship) NOT housaku",
+}
+
+
+@pytest.fixture(scope="module")
+def corpus(tmp_path_factory) -> Path:
+    root = tmp_path_factory.mktemp("corpus")
+    make_corpus(root, BENCH_FILES, BENCH_SIZE)
+    return root
+
+
+@pytest.fixture(scope="module")
+def indexed(corpus, tmp_path_factory) -> str:
+    sqlite_url = f"{tmp_path_factory.mktemp('db') / 'db.sqlite3'}"
+    init_db(sqlite_url)
+    with BatchWriter(sqlite_url) as writer:
+        with FileIndexer(
+            sqlite_url, writer, 2, "thread", passage_size=PASSAGE_SIZE
+        ) as indexer:
+            indexer.index(corpus)
+
+    return sqlite_url
+
+
+def fresh_db(tmp_path: Path):
+    numbers = count()
+
+    def setup():
+        sqlite_url = f"{tmp_path / f'db_{next(numbers)}.sqlite3'}"
+        init_db(sqlite_url)
+        return (sqlite_url,), {}
+
+    return setup
+
+
+# Percentiles of the rounds are kept with the rest of the results, which are
+# missing when benchmarks are disabled.
+def record_percentiles(benchmark) -> None:
+    if benchmark.stats is None:
+        return
+
+    data = sorted(benchmark.stats.stats.data)
+    for p in (50, 90, 99):
+        benchmark.extra_info[f"p{p}"] = data[min(len(data) - 1, len(data) * p // 100)]
+
+
+def test_bench_corpus_list_files(benchmark, corpus):
+    files = benchmark(list_files, corpus)
+    assert len(files) == BENCH_FILES
+
+
+@pytest.mark.parametrize("extension", FORMATS)
+def test_bench_corpus_read_file(benchmark, corpus, extension):
+    file = next(corpus.rglob(f"*.{extension}"))
+    doc = benchmark(read_file, file)
+    benchmark.extra_info["bytes"] = file.stat().st_size
+    assert doc.body
+
+
+@pytest.mark.parametrize("threads", [1, 4])
+def test_bench_index_files(benchmark, corpus, tmp_path, threads):
+    def index(sqlite_url: str) -> None:
+        with BatchWriter(sqlite_url) as writer:
+            with FileIndexer(sqlite_url, writer, threads) as indexer:
+                indexer.index(corpus)
+
+    benchmark.pedantic(index, setup=fresh_db(tmp_path), rounds=3)
+    record_percentiles(benchmark)
+    if benchmark.stats is not None:
+        benchmark.extra_info["files_per_second"] = (
+            BENCH_FILES / benchmark.stats.stats.mean
+        )
+
+
+def test_bench_rebuild_fts(benchmark, indexed):
+    benchmark.pedantic(rebuild_fts, args=(indexed,), rounds=3)
+
+
+@pytest.mark.parametrize("passages", [False, True], ids=["documents", "passages"])
+@pytest.mark.parametrize("kind", QUERIES)
+def test_bench_search(benchmark, indexed, kind, passages):
+    results = benchmark(search, indexed, QUERIES[kind], passages=passages, cache=None)
+    record_percentiles(benchmark)
+    assert results
+
+
+def test_bench_index_feed(benchmark, tmp_path):
+    with serve_feed(BENCH_POSTS) as feed_url:
+
+        def index(sqlite_url: str) -> None:
+            asyncio.run(index_feed(sqlite_url, [feed_url]))
+
+        benchmark.pedantic(index, setup=fresh_db(tmp_path), rounds=3)
+
+    record_percentiles(benchmark)
+    if benchmark.stats is not None:
+        benchmark.extra_info["posts_per_second"] = (
+            BENCH_POSTS / benchmark.stats.stats.mean
+        )
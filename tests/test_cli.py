@@ -0,0 +1,67 @@
+import os
+import subprocess
+import sys
+import pytest
+from housaku.commands import commands
+
+HEAVY_MODULES = (
+    "pymupdf",
+    "textual",
+    "uvicorn",
+    "starlette",
+    "aiohttp",
+    "feedparser",
+    "selectolax",
+)
+
+
+# Imports the CLI in a fresh interpreter, runs `setup` and returns every
+# module that ended up being imported.
+def imported_modules(setup: str, env: dict | None = None) -> set[str]:
+    code = f"""
+import sys
+from housaku.cli import cli
+{setup}
+print(",".join(sorted(set(sys.modules))))
+"""
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+        env=env,
+    )
+    return set(result.stdout.strip().splitlines()[-1].split(","))
+
+
+def heavy(modules: set[str]) -> set[str]:
+    return {module.split(".")[0] for module in modules} & set(HEAVY_MODULES)
+
+
+def test_help_does_not_import_settings_or_heavy_modules():
+    modules = imported_modules(
+        "try:\n    cli(['--help'])\nexcept SystemExit:\n    pass"
+    )
+    assert "pydantic" not in modules
+    assert "housaku.settings" not in modules
+    assert not heavy(modules)
+
+
+# Resolving a command imports its module, but nothing the command only needs
+# once it runs.
+@pytest.mark.parametrize("command", sorted(commands))
+def test_commands_do_not_import_heavy_modules_until_they_run(command):
+    modules = imported_modules(
+        f"import click\ncli.get_command(click.Context(cli), {command!r})"
+    )
+    assert not heavy(modules)
+    assert "housaku.settings" not in modules
+
+
+def test_search_only_imports_what_it_needs(tmp_path):
+    modules = imported_modules(
+        "try:\n    cli(['search', '-q', 'ocean'])\nexcept SystemExit:\n    pass",
+        env={**os.environ, "XDG_CONFIG_HOME": f"{tmp_path}"},
+    )
+    assert "housaku.settings" in modules
+    assert not heavy(modules)
@@ -0,0 +1,338 @@
+import sqlite3
+import pytest
+from housaku.db import (
+    BatchWriter,
+    ConnectionPool,
+    connect,
+    get_generation,
+    init_db,
+    migrate_db,
+    rebuild_fts,
+)
+from housaku.feeds import FeedState, save_feed_state
+from housaku.metrics import Metrics
+from housaku.models import Doc, Storage
+from housaku.search import search
+
+requires_contentless_delete = pytest.mark.skipif(
+    sqlite3.sqlite_version_info < (3, 43, 0),
+    reason="contentless storage needs SQLite 3.43 or newer",
+)
+
+
+def make_doc(n: int, body: str = "lorem ipsum") -> Doc:
+    return Doc(
+        uri=f"/tmp/doc_{n}.txt",
+        title=f"doc_{n}.txt",
+        body=body,
+        doc_type=".txt",
+        last_modified=1.0,
+    )
+
+
+def test_batch_writer_inserts_documents(tmp_path):
+    sqlite_url = f"{tmp_path / 'db.sqlite3'}"
+    init_db(sqlite_url)
+
+    with BatchWriter(sqlite_url, batch_size=7, flush_interval=0.05) as writer:
+        for n in range(100):
+            writer.upsert(make_doc(n))
+
+    conn = sqlite3.connect(sqlite_url)
+    assert conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0] == 100
+    conn.close()
+
+
+def test_batch_writer_updates_existing_documents(tmp_path):
+    sqlite_url = f"{tmp_path / 'db.sqlite3'}"
+    init_db(sqlite_url)
+
+    with BatchWriter(sqlite_url) as writer:
+        writer.upsert(make_doc(1, "first"))
+        writer.upsert(make_doc(1, "second"))
+
+    conn = sqlite3.connect(sqlite_url)
+    rows = conn.execute("SELECT body FROM documents").fetchall()
+    assert rows == [("second",)]
+    conn.close()
+
+
+def test_batch_writer_keeps_batch_on_failed_statement(tmp_path):
+    sqlite_url = f"{tmp_path / 'db.sqlite3'}"
+    init_db(sqlite_url)
+
+    with BatchWriter(sqlite_url, batch_size=10, flush_interval=1) as writer:
+        writer.upsert(make_doc(1))
+        writer.execute("INSERT INTO missing_table VALUES (?)", (1,))
+        writer.upsert(make_doc(2))
+
+    conn = sqlite3.connect(sqlite_url)
+    assert conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0] == 2
+    conn.close()
+
+
+def test_batch_writer_bounds_the_size_of_queued_documents(tmp_path):
+    sqlite_url = f"{tmp_path / 'db.sqlite3'}"
+    init_db(sqlite_url)
+
+    metrics = Metrics()
+    with BatchWriter(
+        sqlite_url, flush_interval=0.01, metrics=metrics, max_queue_bytes=100
+    ) as writer:
+        for n in range(20):
+            writer.upsert(make_doc(n, "x" * 60))
+
+    conn = sqlite3.connect(sqlite_url)
+    assert conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0] == 20
+    conn.close()
+    assert metrics.gauges["writer.queue_bytes"][1] <= 100
+
+
+def test_batch_writer_survives_values_sqlite_cannot_store(tmp_path):
+    sqlite_url = f"{tmp_path / 'db.sqlite3'}"
+    init_db(sqlite_url)
+
+    with BatchWriter(sqlite_url, batch_size=10, flush_interval=1) as writer:
+        writer.upsert(make_doc(1))
+        bad = make_doc(2)
+        bad.inode = 2**64 - 5
+        writer.upsert(bad)
+        writer.upsert(make_doc(3))
+
+    conn = sqlite3.connect(sqlite_url)
+    uris = {uri for (uri,) in conn.execute("SELECT uri FROM documents")}
+    conn.close()
+    assert uris == {make_doc(1).uri, make_doc(3).uri}
+
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_batch_writer_fails_fast_once_its_thread_stopped(tmp_path):
+    writer = BatchWriter(f"{tmp_path / 'missing' / 'db.sqlite3'}", batch_size=1)
+    writer.start()
+    writer._thread.join()
+
+    with pytest.raises(RuntimeError):
+        for n in range(10):
+            writer.upsert(make_doc(n))
+    writer.close()
+
+
+def test_batch_writer_only_bumps_generation_when_documents_change(tmp_path):
+    sqlite_url = f"{tmp_path / 'db.sqlite3'}"
+    init_db(sqlite_url)
+
+    def generation() -> int:
+        conn = connect(sqlite_url)
+        value = get_generation(conn.cursor())
+        conn.close()
+        return value
+
+    with BatchWriter(sqlite_url) as writer:
+        writer.upsert(make_doc(1))
+    after_upsert = generation()
+
+    with BatchWriter(sqlite_url) as writer:
+        save_feed_state(writer, "https://example.com/feed", FeedState(None, None, ()))
+    assert generation() == after_upsert
+
+    # Touches change the modification time that dates are filtered on.
+    with BatchWriter(sqlite_url) as writer:
+        writer.touch(make_doc(1).uri, 2.0, 10, 1)
+    after_touch = generation()
+    assert after_touch > after_upsert
+
+    with BatchWriter(sqlite_url) as writer:
+        writer.execute(
+            "DELETE FROM documents WHERE uri = ?",
+            (make_doc(1).uri,),
+            invalidates=True,
+        )
+    assert generation() > after_touch
+
+
+def test_fts_follows_documents(tmp_path):
+    sqlite_url = f"{tmp_path / 'db.sqlite3'}"
+    init_db(sqlite_url)
+
+    def matches(query: str) -> int:
+        conn = sqlite3.connect(sqlite_url)
+        (count,) = conn.execute(
+            "SELECT COUNT(*) FROM documents_fts WHERE documents_fts MATCH ?",
+            (query,),
+        ).fetchone()
+        conn.close()
+        return count
+
+    with BatchWriter(sqlite_url) as writer:
+        writer.upsert(make_doc(1, "whales and ships"))
+    assert matches("whales") == 1
+
+    with BatchWriter(sqlite_url) as writer:
+        writer.upsert(make_doc(1, "monsters and laboratories"))
+    assert matches("whales") == 0
+    assert matches("monsters") == 1
+
+    with BatchWriter(sqlite_url) as writer:
+        writer.execute(
+            "DELETE FROM documents WHERE uri = ?",
+            (make_doc(1).uri,),
+            invalidates=True,
+        )
+    assert matches("monsters") == 0
+
+
+def test_connection_pool_reuses_read_only_connections(tmp_path):
+    sqlite_url = f"{tmp_path / 'db.sqlite3'}"
+    init_db(sqlite_url)
+
+    pool = ConnectionPool(sqlite_url, size=2)
+    with pool.connection() as first:
+        with pool.connection() as second:
+            assert first is not second
+
+    with pool.connection() as conn:
+        assert conn in (first, second)
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute("DELETE FROM documents")
+
+    pool.close()
+
+
+def test_init_db_adds_prefix_indexes_to_existing_fts_tables(tmp_path):
+    sqlite_url = f"{tmp_path / 'db.sqlite3'}"
+    init_db(sqlite_url)
+    with BatchWriter(sqlite_url) as writer:
+        writer.upsert(make_doc(1, "whales and ships"))
+
+    conn = sqlite3.connect(sqlite_url)
+    conn.execute("DROP TABLE documents_fts")
+    conn.execute(
+        "CREATE VIRTUAL TABLE documents_fts USING fts5 (uri, body, content=documents)"
+    )
+    conn.commit()
+    conn.close()
+
+    init_db(sqlite_url)
+
+    conn = sqlite3.connect(sqlite_url)
+    (sql,) = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE name = 'documents_fts'"
+    ).fetchone()
+    assert "prefix" in sql
+    assert conn.execute(
+        "SELECT COUNT(*) FROM documents_fts WHERE documents_fts MATCH 'wha*'"
+    ).fetchone() == (1,)
+    conn.close()
+
+
+def write_docs(sqlite_url: str, *bodies: str) -> None:
+    with BatchWriter(sqlite_url) as writer:
+        for n, body in enumerate(bodies):
+            writer.upsert(make_doc(n, body))
+
+
+def body_types(sqlite_url: str) -> set[str]:
+    conn = sqlite3.connect(sqlite_url)
+    types = {t for (t,) in conn.execute("SELECT typeof(body) FROM documents")}
+    conn.close()
+    return types
+
+
+def check_fts(sqlite_url: str) -> None:
+    conn = connect(sqlite_url)
+    conn.execute("INSERT INTO documents_fts(documents_fts) VALUES('integrity-check')")
+    conn.close()
+
+
+def test_compressed_storage_keeps_fts_in_sync(tmp_path):
+    sqlite_url = f"{tmp_path / 'db.sqlite3'}"
+    assert init_db(sqlite_url, Storage("compressed")) == Storage("compressed")
+    write_docs(sqlite_url, "whales and ships", "monsters and laboratories")
+
+    assert body_types(sqlite_url) == {"blob"}
+    results = search(sqlite_url, "whales", cache=None)
+    assert [result.snippet for result in results] == ["whales and ships"]
+
+    write_docs(sqlite_url, "ships only")
+    with BatchWriter(sqlite_url) as writer:
+        writer.execute(
+            "DELETE FROM documents WHERE uri = ?",
+            (make_doc(1).uri,),
+            invalidates=True,
+        )
+
+    assert search(sqlite_url, "whales", cache=None) == []
+    assert search(sqlite_url, "monsters", cache=None) == []
+    check_fts(sqlite_url)
+
+
+def test_migrate_db_moves_documents_between_layouts(tmp_path):
+    sqlite_url = f"{tmp_path / 'db.sqlite3'}"
+    init_db(sqlite_url)
+    write_docs(sqlite_url, "whales and ships", "monsters and laboratories")
+
+    assert migrate_db(sqlite_url, Storage("compressed"))
+    assert not migrate_db(sqlite_url, Storage("compressed"))
+    assert body_types(sqlite_url) == {"blob"}
+    assert init_db(sqlite_url) == Storage("compressed")
+    assert len(search(sqlite_url, "ships", cache=None)) == 1
+
+    compact = Storage("plain", detail="column", columnsize=False, index_uri=False)
+    assert migrate_db(sqlite_url, compact)
+    assert body_types(sqlite_url) == {"text"}
+    assert init_db(sqlite_url) == compact
+    assert len(search(sqlite_url, "monsters", cache=None)) == 1
+    assert search(sqlite_url, "tmp", cache=None) == []
+
+    rebuild_fts(sqlite_url)
+    check_fts(sqlite_url)
+
+
+@requires_contentless_delete
+def test_contentless_storage_only_keeps_excerpts(tmp_path):
+    sqlite_url = f"{tmp_path / 'db.sqlite3'}"
+    init_db(sqlite_url, Storage("contentless"))
+    write_docs(sqlite_url, " ".join(["ocean"] * 100 + ["whales"]))
+
+    conn = sqlite3.connect(sqlite_url)
+    (body,) = conn.execute("SELECT body FROM documents").fetchone()
+    conn.close()
+    assert body.split() == ["ocean"] * 64
+
+    (result,) = search(sqlite_url, "whales OR ocean", snippet_size=3, cache=None)
+    assert result.snippet == "ocean ocean ocean ..."
+    assert result.highlights[0] == (0, 5)
+
+    write_docs(sqlite_url, "ships")
+    assert search(sqlite_url, "whales", cache=None) == []
+    assert len(search(sqlite_url, "ships", cache=None)) == 1
+
+    rebuild_fts(sqlite_url)
+    assert len(search(sqlite_url, "ships", cache=None)) == 1
+    with pytest.raises(ValueError):
+        migrate_db(sqlite_url, Storage("plain"))
+
+
+@requires_contentless_delete
+def test_migrate_db_to_contentless_storage(tmp_path):
+    sqlite_url = f"{tmp_path / 'db.sqlite3'}"
+    init_db(sqlite_url, Storage("compressed"))
+    write_docs(sqlite_url, "whales and ships", "monsters and laboratories")
+
+    assert migrate_db(sqlite_url, Storage("contentless"))
+    assert body_types(sqlite_url) == {"text"}
+    assert [result.snippet for result in search(sqlite_url, "ship", cache=None)] == [
+        "whales and ships"
+    ]
+
+    write_docs(sqlite_url, "ocean")
+    assert search(sqlite_url, "whales", cache=None) == []
+
+
+@pytest.mark.skipif(
+    sqlite3.sqlite_version_info >= (3, 43, 0),
+    reason="contentless storage is supported",
+)
+def test_contentless_storage_needs_a_recent_sqlite(tmp_path):
+    with pytest.raises(ValueError):
+        init_db(f"{tmp_path / 'db.sqlite3'}", Storage("contentless"))
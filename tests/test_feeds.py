@@ -0,0 +1,291 @@
+import asyncio
+import json
+import sqlite3
+import time
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from housaku.db import BatchWriter, init_db
+from housaku import feeds
+from housaku.feeds import Crawler, Parser, fetch_post, index_feed
+from housaku.models import Doc
+
+POSTS = 6
+
+
+def make_state(fail_first: bool = False) -> dict:
+    return {
+        "attempts": {},
+        "active": 0,
+        "max_active": 0,
+        "feed_requests": 0,
+        "fail_first": fail_first,
+    }
+
+
+def make_app(state: dict) -> web.Application:
+    async def feed(request: web.Request) -> web.Response:
+        state["feed_requests"] += 1
+        if request.headers.get("If-None-Match") == '"v1"':
+            return web.Response(status=304)
+
+        items = "".join(
+            f"""
+            <item>
+                <title>Post {n}</title>
+                <link>{request.url.origin()}/posts/{n}</link>
+                <pubDate>Mon, 01 Jan 2024 00:00:00 GMT</pubDate>
+            </item>
+            """
+            for n in range(POSTS)
+        )
+        return web.Response(
+            text=f'<?xml version="1.0"?><rss version="2.0"><channel><title>Blog</title>{items}</channel></rss>',
+            content_type="application/rss+xml",
+            headers={"ETag": '"v1"'},
+        )
+
+    async def post(request: web.Request) -> web.Response:
+        n = request.match_info["n"]
+
+        # The first request for every post fails, so all of them are retried.
+        state["attempts"][n] = state["attempts"].get(n, 0) + 1
+        if state["attempts"][n] == 1 and state["fail_first"]:
+            return web.Response(status=503)
+
+        state["active"] += 1
+        state["max_active"] = max(state["max_active"], state["active"])
+        await asyncio.sleep(0.05)
+        state["active"] -= 1
+
+        return web.Response(
+            text=f"<html><body><main><p>whales post {n}</p></main></body></html>",
+            content_type="text/html",
+        )
+
+    # Entries don't need a link, for example when the guid is not a permalink.
+    async def feed_without_links(request: web.Request) -> web.Response:
+        return web.Response(
+            text=f"""<?xml version="1.0"?><rss version="2.0"><channel><title>Notes</title>
+            <item><title>Note</title><guid isPermaLink="false">note-1</guid></item>
+            <item><title>Linked</title><link>{request.url.origin()}/posts/linked</link></item>
+            </channel></rss>""",
+            content_type="application/rss+xml",
+        )
+
+    app = web.Application()
+    app.router.add_get("/feed", feed)
+    app.router.add_get("/notes", feed_without_links)
+    app.router.add_get("/posts/{n}", post)
+    return app
+
+
+@pytest.mark.parametrize("parse_executor", ["thread", "process"])
+def test_index_feed_fetches_posts_concurrently_with_retries(tmp_path, parse_executor):
+    sqlite_url = f"{tmp_path / 'db.sqlite3'}"
+    init_db(sqlite_url)
+    state = make_state(fail_first=True)
+
+    async def run() -> None:
+        async with TestServer(make_app(state)) as server:
+            await index_feed(
+                sqlite_url,
+                [f"{server.make_url('/feed')}"],
+                max_connections_per_host=3,
+                retries=1,
+                parse_executor=parse_executor,
+            )
+
+    asyncio.run(run())
+
+    conn = sqlite3.connect(sqlite_url)
+    rows = conn.execute("SELECT title, body FROM documents ORDER BY title").fetchall()
+    conn.close()
+
+    assert [title for title, _ in rows] == [f"Post {n}" for n in range(POSTS)]
+    assert all("whales" in body for _, body in rows)
+    assert 1 < state["max_active"] <= 3
+
+
+def test_index_feed_skips_feeds_that_did_not_change(tmp_path):
+    sqlite_url = f"{tmp_path / 'db.sqlite3'}"
+    init_db(sqlite_url)
+    state = make_state()
+
+    async def run() -> None:
+        async with TestServer(make_app(state)) as server:
+            for _ in range(2):
+                await index_feed(sqlite_url, [f"{server.make_url('/feed')}"])
+
+    asyncio.run(run())
+
+    assert state["feed_requests"] == 2
+    assert all(attempts == 1 for attempts in state["attempts"].values())
+
+    conn = sqlite3.connect(sqlite_url)
+    (etag, entry_ids) = conn.execute("SELECT etag, entry_ids FROM feeds").fetchone()
+    conn.close()
+    assert etag == '"v1"'
+    assert len(json.loads(entry_ids)) == POSTS
+
+
+def test_index_feed_only_fetches_posts_not_indexed_yet(tmp_path):
+    sqlite_url = f"{tmp_path / 'db.sqlite3'}"
+    init_db(sqlite_url)
+    state = make_state()
+
+    async def run() -> None:
+        async with TestServer(make_app(state)) as server:
+            feed_url = f"{server.make_url('/feed')}"
+            with BatchWriter(sqlite_url) as writer:
+                writer.upsert(
+                    Doc(f"{server.make_url('/posts/0')}", "Post 0", "ocean", "http")
+                )
+
+            await index_feed(sqlite_url, [feed_url])
+
+    asyncio.run(run())
+
+    assert sorted(state["attempts"]) == [f"{n}" for n in range(1, POSTS)]
+
+    conn = sqlite3.connect(sqlite_url)
+    (count,) = conn.execute("SELECT COUNT(*) FROM documents").fetchone()
+    conn.close()
+    assert count == POSTS
+
+
+def test_index_feed_skips_entries_without_links(tmp_path):
+    sqlite_url = f"{tmp_path / 'db.sqlite3'}"
+    init_db(sqlite_url)
+    state = make_state()
+
+    async def run() -> None:
+        async with TestServer(make_app(state)) as server:
+            await index_feed(
+                sqlite_url,
+                [f"{server.make_url('/notes')}", f"{server.make_url('/feed')}"],
+                parse_executor="thread",
+            )
+
+    asyncio.run(run())
+
+    conn = sqlite3.connect(sqlite_url)
+    titles = {title for (title,) in conn.execute("SELECT title FROM documents")}
+    conn.close()
+    assert titles == {"Linked", *(f"Post {n}" for n in range(POSTS))}
+
+
+def test_crawler_does_not_hold_slots_while_waiting_for_a_busy_host():
+    async def slow(_: web.Request) -> web.Response:
+        await asyncio.sleep(0.2)
+        return web.Response(text="slow")
+
+    async def fast(_: web.Request) -> web.Response:
+        return web.Response(text="fast")
+
+    slow_app, fast_app = web.Application(), web.Application()
+    slow_app.router.add_get("/", slow)
+    fast_app.router.add_get("/", fast)
+
+    async def run() -> float:
+        async with (
+            TestServer(slow_app) as slow_server,
+            TestServer(fast_app) as fast_server,
+            Crawler(max_connections=2, max_connections_per_host=1) as crawler,
+        ):
+            busy = [
+                asyncio.create_task(crawler.fetch(f"{slow_server.make_url('/')}"))
+                for _ in range(8)
+            ]
+            await asyncio.sleep(0.05)
+
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            assert await crawler.fetch(f"{fast_server.make_url('/')}") == "fast"
+            elapsed = loop.time() - start
+
+            await asyncio.gather(*busy)
+            return elapsed
+
+    assert asyncio.run(run()) < 0.15
+
+
+def test_downloads_wait_for_parsing_to_catch_up(monkeypatch):
+    counts = {"downloads": 0, "parsed": 0, "max_unparsed": 0}
+    text = aiohttp.ClientResponse.text
+
+    async def counted_text(self, *args, **kwargs) -> str:
+        body = await text(self, *args, **kwargs)
+        counts["downloads"] += 1
+        unparsed = counts["downloads"] - counts["parsed"]
+        counts["max_unparsed"] = max(counts["max_unparsed"], unparsed)
+        return body
+
+    def slow_clean_html(html: str) -> str:
+        time.sleep(0.02)
+        counts["parsed"] += 1
+        return html
+
+    async def page(_: web.Request) -> web.Response:
+        return web.Response(text="<p>page</p>")
+
+    monkeypatch.setattr(aiohttp.ClientResponse, "text", counted_text)
+    monkeypatch.setattr(feeds, "clean_html", slow_clean_html)
+    app = web.Application()
+    app.router.add_get("/", page)
+
+    async def run() -> None:
+        async with (
+            TestServer(app) as server,
+            Crawler(max_connections=8, max_connections_per_host=8) as crawler,
+            Parser("thread", max_workers=1, max_pending=2) as parser,
+        ):
+            url = f"{server.make_url('/')}"
+            await asyncio.gather(*[fetch_post(crawler, parser, url) for _ in range(10)])
+
+    asyncio.run(run())
+    assert counts["parsed"] == 10
+    assert counts["max_unparsed"] <= 2
+
+
+# Posts waiting on a busy host must not hold the parse slots posts from other
+# hosts need.
+def test_posts_of_a_busy_host_do_not_hold_parse_slots(monkeypatch):
+    async def slow(_: web.Request) -> web.Response:
+        await asyncio.sleep(0.05)
+        return web.Response(text="<p>slow</p>")
+
+    async def fast(_: web.Request) -> web.Response:
+        return web.Response(text="<p>fast</p>")
+
+    monkeypatch.setattr(feeds, "clean_html", lambda html: html)
+    slow_app, fast_app = web.Application(), web.Application()
+    slow_app.router.add_get("/", slow)
+    fast_app.router.add_get("/", fast)
+
+    async def run() -> float:
+        async with (
+            TestServer(slow_app) as slow_server,
+            TestServer(fast_app) as fast_server,
+            Crawler(max_connections=8, max_connections_per_host=1) as crawler,
+            Parser("thread", max_workers=1, max_pending=2) as parser,
+        ):
+            busy = [
+                asyncio.create_task(
+                    fetch_post(crawler, parser, f"{slow_server.make_url('/')}")
+                )
+                for _ in range(20)
+            ]
+            await asyncio.sleep(0.02)
+
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            url = f"{fast_server.make_url('/')}"
+            assert await fetch_post(crawler, parser, url) == "<p>fast</p>"
+            elapsed = loop.time() - start
+
+            await asyncio.gather(*busy)
+            return elapsed
+
+    assert asyncio.run(run()) < 0.15
@@ -1,5 +1,21 @@
+import os
+import sqlite3
 from pathlib import Path
-from housaku.files import list_files, read_file, read_plain_text, read_complex
+import pytest
+from housaku.db import BatchWriter, init_db
+from housaku.metrics import Metrics
+from housaku.files import (
+    FileIndexer,
+    index_file,
+    iter_text,
+    is_unchanged,
+    load_file_states,
+    list_files,
+    read_file,
+    read_plain_text,
+    read_complex,
+    walk_files,
+)
 
 TEST_FILES_DIR = Path(__file__).parent / "examples"
 
@@ -11,6 +27,21 @@ def test_list_files():
     )
 
 
+def test_walk_files_excludes_patterns(tmp_path):
+    for name in ["a.md", "b.tmp", "nested/c.md", "backup/d.md", "nested/e/f.txt"]:
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(name)
+
+    files = {
+        file.relative_to(tmp_path).as_posix(): stat
+        for file, stat in walk_files(tmp_path, {"*.tmp", "backup"}, max_workers=2)
+    }
+
+    assert set(files) == {"a.md", "nested/c.md", "nested/e/f.txt"}
+    assert files["a.md"].st_size == len("a.md")
+
+
 def test_read_text_file():
     for test_file in TEST_FILES_DIR.glob("*.txt"):
         doc = read_file(test_file)
@@ -51,6 +82,147 @@ def test_read_docx_file():
         assert doc.body
 
 
+@pytest.mark.parametrize("executor", ["thread", "process", "auto"])
+def test_file_indexer(tmp_path, executor):
+    sqlite_url = f"{tmp_path / 'db.sqlite3'}"
+    init_db(sqlite_url)
+
+    files = list_files(TEST_FILES_DIR)
+    with BatchWriter(sqlite_url) as writer:
+        with FileIndexer(sqlite_url, writer, 2, executor) as indexer:
+            indexer.index(TEST_FILES_DIR)
+
+    conn = sqlite3.connect(sqlite_url)
+    count = conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+    conn.close()
+    assert count == len(files)
+
+
+def test_index_skips_touched_files_with_same_content(tmp_path):
+    sqlite_url = f"{tmp_path / 'db.sqlite3'}"
+    init_db(sqlite_url)
+
+    notes = tmp_path / "notes"
+    notes.mkdir()
+    note = notes / "note.md"
+    note.write_text("# Whales")
+
+    with BatchWriter(sqlite_url) as writer:
+        with FileIndexer(sqlite_url, writer, 1, "thread", True) as indexer:
+            indexer.index(notes)
+
+    states = load_file_states(sqlite_url, notes)
+    state = states[f"{note.resolve()}"]
+    assert is_unchanged(state, note.stat())
+
+    os.utime(note, (0, 0))
+    assert not is_unchanged(state, note.stat())
+
+    def read(_: Path):
+        raise AssertionError("touched files should not be read again")
+
+    with BatchWriter(sqlite_url) as writer:
+        index_file(writer, note.resolve(), note.stat(), state, True, read)
+
+    states = load_file_states(sqlite_url, notes)
+    assert is_unchanged(states[f"{note.resolve()}"], note.stat())
+
+
+def test_index_skips_unchanged_symlinks_to_files_outside_the_root(tmp_path):
+    sqlite_url = f"{tmp_path / 'db.sqlite3'}"
+    init_db(sqlite_url)
+
+    notes = tmp_path / "notes"
+    notes.mkdir()
+    (notes / "a.md").write_text("# Whales")
+    target = tmp_path / "elsewhere" / "target.md"
+    target.parent.mkdir()
+    target.write_text("# Ships")
+    (notes / "link.md").symlink_to(target)
+
+    for _ in range(2):
+        metrics = Metrics()
+        with BatchWriter(sqlite_url) as writer:
+            with FileIndexer(
+                sqlite_url, writer, 1, "thread", metrics=metrics
+            ) as indexer:
+                indexer.index(notes)
+
+    assert metrics.get("files.indexed") == 0
+    assert metrics.get("files.skipped") == 2
+    assert f"{notes.resolve() / 'link.md'}" in load_file_states(sqlite_url, notes)
+
+
+def test_index_file_stores_inodes_above_the_signed_range(tmp_path):
+    sqlite_url = f"{tmp_path / 'db.sqlite3'}"
+    init_db(sqlite_url)
+    note = tmp_path / "note.md"
+    note.write_text("# Whales")
+
+    stat = note.stat()
+    stat = os.stat_result((stat.st_mode, 2**64 - 5, *stat[2:10]))
+    with BatchWriter(sqlite_url) as writer:
+        index_file(writer, note, stat)
+
+    conn = sqlite3.connect(sqlite_url)
+    (inode,) = conn.execute("SELECT inode FROM documents").fetchone()
+    conn.close()
+    assert inode == -5
+
+
+def test_index_removes_missing_files(tmp_path):
+    sqlite_url = f"{tmp_path / 'db.sqlite3'}"
+    init_db(sqlite_url)
+
+    notes = tmp_path / "notes"
+    (notes / "nested").mkdir(parents=True)
+    for name in ["a.md", "b.md", "nested/c.md"]:
+        (notes / name).write_text(f"# {name}")
+
+    # Shares a prefix with the include root, but is not inside it.
+    other = tmp_path / "notes_old.md"
+    other.write_text("# old")
+
+    with BatchWriter(sqlite_url) as writer:
+        with FileIndexer(sqlite_url, writer, 1, "thread") as indexer:
+            indexer.index(notes)
+            indexer.index(other)
+
+    (notes / "b.md").unlink()
+    (notes / "nested" / "c.md").unlink()
+
+    with BatchWriter(sqlite_url) as writer:
+        with FileIndexer(sqlite_url, writer, 1, "thread") as indexer:
+            indexer.index(notes)
+
+    conn = sqlite3.connect(sqlite_url)
+    uris = {uri for (uri,) in conn.execute("SELECT uri FROM documents")}
+    (matches,) = conn.execute(
+        "SELECT COUNT(*) FROM documents_fts WHERE documents_fts MATCH 'nested'"
+    ).fetchone()
+    conn.close()
+
+    assert uris == {f"{(notes / 'a.md').resolve()}", f"{other.resolve()}"}
+    assert matches == 0
+
+
+def test_read_file_truncates_large_documents():
+    test_file = TEST_FILES_DIR / "gutenberg_moby_dick.txt"
+    doc = read_file(test_file, max_bytes=1000)
+    assert doc.truncated
+    assert len(doc.body.encode()) <= 1000
+    assert test_file.read_text().startswith(doc.body)
+
+    doc = read_file(test_file)
+    assert not doc.truncated
+
+
+def test_read_file_keeps_pdf_pages():
+    test_file = TEST_FILES_DIR / "gutenberg_the_modern_prometheus.pdf"
+    pages = [page for page, _ in iter_text(test_file)]
+    assert pages[:3] == [1, 2, 3]
+
+
 def test_bench_list_files(benchmark):
     file_list = benchmark(list_files, TEST_FILES_DIR)
     assert file_list
@@ -72,3 +244,46 @@ def test_bench_read_epub_file(benchmark):
     test_file = TEST_FILES_DIR / "fundamental_accessibility.epub"
     body = benchmark(read_complex, test_file)
     assert body
+
+
+def test_index_removes_deleted_symlinks(tmp_path):
+    sqlite_url = f"{tmp_path / 'db.sqlite3'}"
+    init_db(sqlite_url)
+
+    notes = tmp_path / "notes"
+    notes.mkdir()
+    target = tmp_path / "elsewhere" / "target.md"
+    target.parent.mkdir()
+    target.write_text("# Ships")
+    link = notes / "link.md"
+    link.symlink_to(target)
+
+    for _ in range(2):
+        with BatchWriter(sqlite_url) as writer:
+            with FileIndexer(sqlite_url, writer, 1, "thread") as indexer:
+                indexer.index(notes)
+
+        link.unlink(missing_ok=True)
+
+    conn = sqlite3.connect(sqlite_url)
+    (count,) = conn.execute("SELECT COUNT(*) FROM documents").fetchone()
+    conn.close()
+    assert count == 0
+
+
+def test_file_indexer_replaces_a_broken_process_pool(tmp_path):
+    sqlite_url = f"{tmp_path / 'db.sqlite3'}"
+    init_db(sqlite_url)
+    pdf = next(TEST_FILES_DIR.glob("*.pdf"))
+
+    with BatchWriter(sqlite_url) as writer:
+        with FileIndexer(sqlite_url, writer, 1, "process") as indexer:
+            assert indexer._read(pdf).body
+
+            # Kills the worker like a crash while reading a document would.
+            for process in indexer._processes._processes.values():
+                process.kill()
+                process.join()
+
+            assert indexer._read(pdf).body
+            assert indexer._read(pdf).body
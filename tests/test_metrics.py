@@ -0,0 +1,44 @@
+import json
+from housaku.db import BatchWriter, init_db
+from housaku.files import FileIndexer, list_files
+from housaku.metrics import Histogram, Metrics
+from tests.test_files import TEST_FILES_DIR
+
+
+def test_histogram_percentiles():
+    histogram = Histogram()
+    for n in range(1, 101):
+        histogram.observe(n / 1000)
+
+    summary = histogram.summary()
+    assert summary["count"] == 100
+    assert summary["min"] == 0.001
+    assert summary["max"] == 0.1
+    assert 0.05 <= summary["p50"] <= 0.064
+    assert summary["p99"] == 0.1
+    assert sum(summary["buckets"].values()) == 100
+
+
+def test_file_indexer_collects_metrics(tmp_path):
+    sqlite_url = f"{tmp_path / 'db.sqlite3'}"
+    init_db(sqlite_url)
+    metrics = Metrics()
+
+    files = list_files(TEST_FILES_DIR)
+    for _ in range(2):
+        with BatchWriter(sqlite_url, metrics=metrics) as writer:
+            with FileIndexer(
+                sqlite_url, writer, 2, "thread", metrics=metrics
+            ) as indexer:
+                indexer.index(TEST_FILES_DIR)
+
+    assert metrics.get("files.seen") == len(files) * 2
+    assert metrics.get("files.indexed") == len(files)
+    assert metrics.get("files.skipped") == len(files)
+    assert metrics.get("bytes.indexed") == sum(f.stat().st_size for f in files)
+
+    metrics.write_json(tmp_path / "metrics.json")
+    snapshot = json.loads((tmp_path / "metrics.json").read_text())
+    assert snapshot["timings"]["writer.commit"]["count"] >= 1
+    assert snapshot["timings"]["extract.pdf"]["count"] == 1
+    assert "writer.queue" in snapshot["gauges"]
@@ -0,0 +1,197 @@
+import sqlite3
+import threading
+import pytest
+import housaku.search
+from housaku.db import BatchWriter, init_db
+from housaku.models import Doc
+from housaku.search import (
+    SearchCache,
+    as_prefix_query,
+    parse_filters,
+    search,
+    split_highlights,
+)
+from housaku.utils import split_passages
+
+DOCUMENTS = {
+    "/tmp/whales.txt": "whales swim in the ocean and sing to each other",
+    "/tmp/ships.txt": "ships sail across the ocean carrying whalers",
+    "/tmp/monsters.txt": "the monster was created in a laboratory",
+}
+
+
+def make_db(tmp_path, passage_size: int | None = 3) -> str:
+    sqlite_url = f"{tmp_path / 'db.sqlite3'}"
+    init_db(sqlite_url)
+
+    with BatchWriter(sqlite_url) as writer:
+        for uri, body in DOCUMENTS.items():
+            passages = None
+            if passage_size:
+                passages = split_passages([(1, body)], passage_size)
+
+            writer.upsert(
+                Doc(
+                    uri=uri,
+                    title=uri.rsplit("/", 1)[-1],
+                    body=body,
+                    doc_type=".txt",
+                    passages=passages,
+                )
+            )
+
+    return sqlite_url
+
+
+def test_search_documents(tmp_path):
+    sqlite_url = make_db(tmp_path)
+
+    results = search(sqlite_url, "ocean")
+    assert {result.uri for result in results} == {"/tmp/whales.txt", "/tmp/ships.txt"}
+
+    results = search(sqlite_url, "ocean", limit=1)
+    assert len(results) == 1
+
+
+def test_search_passages(tmp_path):
+    sqlite_url = make_db(tmp_path, passage_size=3)
+
+    results = search(sqlite_url, "ocean", passages=True)
+    assert sorted(result.uri for result in results) == [
+        "/tmp/ships.txt",
+        "/tmp/whales.txt",
+    ]
+    for result in results:
+        assert "ocean" in result.snippet
+        assert result.page == 1
+
+
+def test_split_passages_carries_partial_words():
+    chunks = [(None, "one two thr"), (None, "ee four"), (2, "five six")]
+    assert split_passages(chunks, 2) == [
+        (None, "one two"),
+        (None, "three four"),
+        (2, "five six"),
+    ]
+
+
+def test_search_highlights_matches(tmp_path):
+    sqlite_url = make_db(tmp_path)
+
+    for passages in [False, True]:
+        (result,) = search(sqlite_url, "laboratory", passages=passages)
+        assert [result.snippet[start:end] for start, end in result.highlights] == [
+            "laboratory"
+        ]
+
+
+def test_split_highlights():
+    assert split_highlights("a \x02b\x03 c\n\x02d\x03") == ("a b c d", ((2, 3), (6, 7)))
+
+
+def test_search_can_be_cancelled(tmp_path, monkeypatch):
+    sqlite_url = make_db(tmp_path)
+    monkeypatch.setattr(housaku.search, "PROGRESS_HANDLER_STEPS", 1)
+
+    cancel = threading.Event()
+    cancel.set()
+    with pytest.raises(sqlite3.OperationalError):
+        search(sqlite_url, "ocean", cancel=cancel)
+
+    with pytest.raises(TimeoutError):
+        search(sqlite_url, "ocean", timeout=1e-9)
+
+    assert search(sqlite_url, "ocean", timeout=5)
+
+
+def test_search_cache_is_invalidated_by_new_documents(tmp_path):
+    sqlite_url = make_db(tmp_path)
+    cache = SearchCache()
+
+    first = search(sqlite_url, "ocean", cache=cache)
+    assert search(sqlite_url, "  ocean ", cache=cache) == first
+    assert cache.info()["hits"] == 1
+
+    with BatchWriter(sqlite_url) as writer:
+        writer.upsert(Doc("/tmp/ocean.txt", "ocean.txt", "ocean", ".txt"))
+
+    assert len(search(sqlite_url, "ocean", cache=cache)) == len(first) + 1
+    assert cache.info() == {"hits": 1, "misses": 2, "size": 1, "max_size": 256}
+
+
+def test_search_pagination(tmp_path):
+    sqlite_url = make_db(tmp_path)
+    with BatchWriter(sqlite_url) as writer:
+        for n in range(25):
+            writer.upsert(Doc(f"/tmp/{n}.txt", f"{n}.txt", "ocean " * n, ".txt"))
+
+    for passages in [False, True]:
+        everything = search(sqlite_url, "ocean", limit=100, passages=passages)
+
+        pages = []
+        after = None
+        while page := search(
+            sqlite_url, "ocean", limit=4, passages=passages, after=after
+        ):
+            pages.extend(page)
+            after = page[-1].cursor
+
+        offset = search(sqlite_url, "ocean", limit=4, passages=passages, offset=8)
+
+        assert [result.uri for result in pages] == [r.uri for r in everything]
+        assert [result.uri for result in offset] == [r.uri for r in everything[8:12]]
+
+
+def test_search_filters(tmp_path):
+    sqlite_url = make_db(tmp_path)
+    with BatchWriter(sqlite_url) as writer:
+        for uri, doc_type, last_modified in [
+            ("/tmp/docs/ocean.pdf", ".pdf", "1704067200.0"),
+            ("https://example.com/blog/ocean", "https", 0.0),
+        ]:
+            writer.upsert(
+                Doc(
+                    uri,
+                    "ocean",
+                    "ocean",
+                    doc_type,
+                    last_modified,
+                    passages=[(None, "ocean")],
+                )
+            )
+
+    def uris(query: str, passages: bool = False) -> list[str]:
+        terms, filters = parse_filters(query)
+        results = search(sqlite_url, terms, passages=passages, filters=filters)
+        return sorted(result.uri for result in results)
+
+    for passages in [False, True]:
+        assert uris("ocean type:pdf", passages) == ["/tmp/docs/ocean.pdf"]
+        assert uris("ocean type:https,.txt", passages) == [
+            "/tmp/ships.txt",
+            "/tmp/whales.txt",
+            "https://example.com/blog/ocean",
+        ]
+
+    assert uris("ocean path:/tmp/docs") == ["/tmp/docs/ocean.pdf"]
+    assert uris("ocean path:https://example.com/") == ["https://example.com/blog/ocean"]
+    assert uris("ocean since:2023-06-01") == ["/tmp/docs/ocean.pdf"]
+    assert uris("ocean until:1999-12-31 type:https") == [
+        "https://example.com/blog/ocean"
+    ]
+
+    with pytest.raises(ValueError):
+        parse_filters("ocean since:yesterday")
+
+
+def test_as_prefix_query(tmp_path):
+    assert as_prefix_query("whales oce") == "whales oce*"
+    assert as_prefix_query("whales oce ") == "whales oce "
+    assert as_prefix_query('"whales oce"') == '"whales oce"'
+    assert as_prefix_query("whales AND") == "whales AND"
+    assert as_prefix_query("") == ""
+
+    sqlite_url = make_db(tmp_path)
+    for passages in [False, True]:
+        results = search(sqlite_url, as_prefix_query("labo"), passages=passages)
+        assert [result.uri for result in results] == ["/tmp/monsters.txt"]
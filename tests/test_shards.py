@@ -0,0 +1,102 @@
+from pathlib import Path
+from housaku.db import BatchWriter, init_db
+from housaku.files import FileIndexer
+from housaku.models import Doc
+from housaku.search import search
+from housaku.shards import create_shard, plan_shards, set_attached, shard_url
+
+BODIES = [
+    "whales swim in the ocean",
+    "ships sail across the ocean",
+    "the ocean is deep and the ocean is wide",
+    "an ocean of monsters",
+    "laboratories far from the ocean",
+    "ocean ocean ocean",
+]
+
+
+def make_shards(tmp_path, count: int = 3) -> str:
+    sqlite_url = f"{tmp_path / 'db.sqlite3'}"
+    init_db(sqlite_url)
+
+    for plan in plan_shards(sqlite_url, [], [], "hash", count):
+        create_shard(sqlite_url, plan.shard)
+        with BatchWriter(plan.shard.sqlite_url) as writer:
+            for n, body in enumerate(BODIES):
+                if n % count == int(plan.shard.name.split("_")[-1]):
+                    writer.upsert(Doc(f"/tmp/{n}.txt", f"{n}.txt", body, ".txt"))
+
+    return sqlite_url
+
+
+def test_plan_shards_by_root_and_by_hash(tmp_path):
+    sqlite_url = f"{tmp_path / 'db.sqlite3'}"
+    roots = [Path("/tmp/notes"), Path("/tmp/books")]
+    feeds = [f"https://example.com/{n}/feed" for n in range(10)]
+
+    assert [plan.shard.name for plan in plan_shards(sqlite_url, roots, feeds)] == [
+        "main"
+    ]
+
+    plans = plan_shards(sqlite_url, roots, feeds, "root")
+    assert [plan.roots for plan in plans] == [[roots[0]], [roots[1]], []]
+    assert plans[-1].shard.name == "feeds" and plans[-1].feeds == feeds
+    assert plans[0].shard.sqlite_url == shard_url(sqlite_url, plans[0].shard.name)
+
+    plans = plan_shards(sqlite_url, roots, feeds, "hash", 3)
+    assert sorted(url for plan in plans for url in plan.feeds) == sorted(feeds)
+    files = [Path(f"/tmp/notes/{n}.txt") for n in range(50)]
+    for file in files:
+        assert sum(plan.partition(file) for plan in plans) == 1
+
+
+def test_index_partitions_files_across_shards(tmp_path):
+    root = tmp_path / "docs"
+    root.mkdir()
+    for n in range(12):
+        (root / f"{n}.txt").write_text(f"ocean {n}")
+
+    sqlite_url = f"{tmp_path / 'db.sqlite3'}"
+    init_db(sqlite_url)
+    for plan in plan_shards(sqlite_url, [root], [], "hash", 3):
+        create_shard(sqlite_url, plan.shard)
+        with BatchWriter(plan.shard.sqlite_url) as writer:
+            with FileIndexer(plan.shard.sqlite_url, writer, 2, "thread") as indexer:
+                indexer.index(root, partition=plan.partition)
+
+    results = search(sqlite_url, "ocean", limit=20, cache=None)
+    assert len(results) == 12
+    assert len({result.uri for result in results}) == 12
+
+
+def test_search_merges_shards_by_score(tmp_path):
+    sqlite_url = make_shards(tmp_path)
+
+    results = search(sqlite_url, "ocean", limit=10, cache=None)
+    assert len(results) == len(BODIES)
+    assert results[0].uri == "/tmp/5.txt"
+
+    pages = []
+    after = None
+    while True:
+        page = search(sqlite_url, "ocean", limit=2, after=after, cache=None)
+        if not page:
+            break
+
+        pages.extend(page)
+        after = page[-1].cursor
+
+    assert pages == results
+    assert search(sqlite_url, "ocean", limit=2, offset=2, cache=None) == results[2:4]
+
+
+def test_detached_shards_are_not_searched(tmp_path):
+    sqlite_url = make_shards(tmp_path)
+
+    assert set_attached(sqlite_url, "bucket_0", False)
+    uris = {result.uri for result in search(sqlite_url, "ocean", cache=None)}
+    assert uris == {"/tmp/1.txt", "/tmp/2.txt", "/tmp/4.txt", "/tmp/5.txt"}
+
+    assert set_attached(sqlite_url, "bucket_0", True)
+    assert len(search(sqlite_url, "ocean", cache=None)) == len(BODIES)
+    assert not set_attached(sqlite_url, "missing", True)
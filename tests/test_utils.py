@@ -0,0 +1,19 @@
+from housaku.utils import clean_html
+
+
+def test_clean_html_uses_main_element():
+    html = """
+    <html><body>
+        <nav>menu</nav>
+        <main><h1>Title</h1><p>Some   text</p><script>alert(1)</script></main>
+    </body></html>
+    """
+    assert clean_html(html) == "TitleSome text"
+
+
+def test_clean_html_falls_back_without_main_element():
+    article = "<html><body><nav>menu</nav><article><p>post</p></article></body></html>"
+    assert clean_html(article) == "post"
+
+    body = "<html><body><div><p>just a body</p></div><style>p {}</style></body></html>"
+    assert clean_html(body) == "just a body"
@@ -0,0 +1,108 @@
+import os
+import sys
+import threading
+import time
+import pytest
+from housaku.db import BatchWriter, init_db
+from housaku.files import FileIndexer
+from housaku.search import search
+from housaku.shards import plan_shards
+
+pytestmark = pytest.mark.skipif(
+    not sys.platform.startswith("linux"), reason="inotify is only available on Linux"
+)
+
+
+def wait_for(condition, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+
+def uris(sqlite_url: str, query: str) -> set[str]:
+    return {result.uri for result in search(sqlite_url, query, limit=20, cache=None)}
+
+
+def test_watch_indexes_changes_as_they_happen(tmp_path):
+    from housaku.watch import Watcher, apply_changes
+
+    root = tmp_path / "docs"
+    (root / "skipped").mkdir(parents=True)
+    sqlite_url = f"{tmp_path / 'db.sqlite3'}"
+    init_db(sqlite_url)
+
+    with (
+        BatchWriter(sqlite_url, flush_interval=0.01) as writer,
+        FileIndexer(sqlite_url, writer, 2, "thread") as indexer,
+        Watcher([root], {"skipped"}, debounce=0.1, max_delay=1.0) as watcher,
+    ):
+        targets = [(plan, indexer) for plan in plan_shards(sqlite_url, [root], [])]
+        thread = threading.Thread(
+            target=watcher.run,
+            args=(lambda changes: apply_changes(targets, changes, {"skipped"}),),
+        )
+        thread.start()
+
+        try:
+            (root / "a.txt").write_text("whales in the ocean")
+            (root / "skipped" / "b.txt").write_text("ocean")
+            (root / "notes").mkdir()
+            (root / "notes" / "c.md").write_text("a deep ocean")
+            wait_for(lambda: len(uris(sqlite_url, "ocean")) == 2)
+            assert uris(sqlite_url, "ocean") == {
+                f"{root.resolve() / 'a.txt'}",
+                f"{root.resolve() / 'notes' / 'c.md'}",
+            }
+
+            (root / "a.txt").write_text("ships on the sea")
+            wait_for(lambda: uris(sqlite_url, "ships"))
+            assert uris(sqlite_url, "whales") == set()
+
+            (root / "notes" / "c.md").rename(tmp_path / "c.md")
+            (root / "a.txt").unlink()
+            wait_for(lambda: not uris(sqlite_url, "ocean OR ships"))
+        finally:
+            watcher.stop()
+            thread.join()
+
+
+# Stands in for inotify during a burst that never stops: its descriptor is
+# always readable, and every read returns another change.
+class EndlessEvents:
+    def __init__(self, path) -> None:
+        self.path = path
+        self.fd, self._write = os.pipe()
+        os.write(self._write, b"\0")
+
+    def read(self):
+        from housaku.watch import IN_CLOSE_WRITE, InotifyEvent
+
+        time.sleep(0.01)
+        return [InotifyEvent(self.path, IN_CLOSE_WRITE)]
+
+    def close(self) -> None:
+        os.close(self.fd)
+        os.close(self._write)
+
+
+def test_watch_passes_changes_on_within_max_delay(tmp_path):
+    from housaku.watch import Watcher
+
+    flushed = []
+    with Watcher([tmp_path], debounce=0.5, max_delay=0.3) as watcher:
+        watcher._inotify.close()
+        watcher._inotify = EndlessEvents(tmp_path / "a.txt")
+
+        def on_changes(changes) -> None:
+            flushed.append(changes)
+            watcher.stop()
+
+        thread = threading.Thread(target=watcher.run, args=(on_changes,))
+        thread.start()
+        thread.join(3)
+        if thread.is_alive():
+            watcher.stop()
+            thread.join()
+
+    assert flushed and flushed[0].changed == {tmp_path / "a.txt"}
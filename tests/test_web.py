@@ -0,0 +1,170 @@
+import asyncio
+import importlib
+import json
+import sqlite3
+import threading
+import time
+from types import SimpleNamespace
+from starlette.routing import request_response
+from housaku.db import BatchWriter, init_db
+from housaku.models import Doc
+
+# The package exports the app itself under the same name as the module.
+web = importlib.import_module("housaku.web.app")
+
+
+def make_settings(sqlite_url: str) -> SimpleNamespace:
+    return SimpleNamespace(
+        sqlite_url=sqlite_url,
+        passages=SimpleNamespace(enabled=False),
+        search=SimpleNamespace(snippet_size=32, timeout=5.0),
+    )
+
+
+def setup_app(sqlite_url: str, connections: int = 4) -> None:
+    web.app.state.settings = make_settings(sqlite_url)
+    web.app.state.search_limiter = asyncio.Semaphore(connections)
+
+
+# Sends a search through the ASGI interface, optionally disconnecting right
+# after the body was sent, and returns the status and the decoded response.
+async def post(body: dict, disconnect: bool = False) -> tuple[int, dict | None]:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/search",
+        "raw_path": b"/search",
+        "query_string": b"",
+        "headers": [(b"content-type", b"application/json")],
+        "server": ("testserver", 80),
+        "client": ("testclient", 50000),
+        "root_path": "",
+        "app": web.app,
+    }
+    messages = [
+        {"type": "http.request", "body": json.dumps(body).encode()},
+    ]
+    done = asyncio.Event()
+
+    async def receive() -> dict:
+        if messages:
+            return messages.pop(0)
+        if disconnect:
+            return {"type": "http.disconnect"}
+
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    sent = []
+
+    async def send(message: dict) -> None:
+        sent.append(message)
+
+    await request_response(web.search_results)(scope, receive, send)
+    done.set()
+
+    status = sent[0]["status"]
+    content = b"".join(m.get("body", b"") for m in sent[1:])
+    return status, json.loads(content) if content else None
+
+
+def test_search_pages_through_results_with_cursors(tmp_path):
+    sqlite_url = f"{tmp_path / 'db.sqlite3'}"
+    init_db(sqlite_url)
+    with BatchWriter(sqlite_url) as writer:
+        for n in range(5):
+            writer.upsert(Doc(f"/tmp/{n}.txt", f"{n}.txt", "whales " * (n + 1), ".txt"))
+    setup_app(sqlite_url)
+
+    async def run() -> list[str]:
+        uris = []
+        status, page = await post({"query": "whales", "limit": 2})
+        while True:
+            assert status == 200
+            uris.extend(result[0] for result in page["results"])
+            if page["next_cursor"] is None:
+                return uris
+
+            status, page = await post(
+                {"query": "whales", "limit": 2, "cursor": page["next_cursor"]}
+            )
+
+    uris = asyncio.run(run())
+    assert sorted(uris) == sorted(f"/tmp/{n}.txt" for n in range(5))
+
+    status, page = asyncio.run(post({"query": "whales", "limit": 2, "page": 3}))
+    assert status == 200
+    assert [result[0] for result in page["results"]] == uris[4:]
+
+
+def test_search_rejects_bad_requests(tmp_path):
+    setup_app(f"{tmp_path / 'db.sqlite3'}")
+
+    status, body = asyncio.run(post({"limit": 2}))
+    assert status == 400 and "query" in body["detail"]
+
+    status, _ = asyncio.run(post({"query": "whales", "page": 0}))
+    assert status == 400
+
+
+def test_search_times_out(tmp_path, monkeypatch):
+    def slow_search(*_, **__):
+        raise TimeoutError("search took too long")
+
+    monkeypatch.setattr(web, "search", slow_search)
+    setup_app(f"{tmp_path / 'db.sqlite3'}")
+
+    status, body = asyncio.run(post({"query": "whales"}))
+    assert status == 504
+    assert body["detail"] == "search took too long"
+
+
+def test_search_is_interrupted_when_the_client_disconnects(tmp_path, monkeypatch):
+    cancelled = threading.Event()
+
+    def blocking_search(*_, cancel: threading.Event, **__):
+        if cancel.wait(5):
+            cancelled.set()
+        raise sqlite3.OperationalError("interrupted")
+
+    monkeypatch.setattr(web, "search", blocking_search)
+    setup_app(f"{tmp_path / 'db.sqlite3'}")
+
+    errors = []
+
+    async def run() -> int:
+        asyncio.get_running_loop().set_exception_handler(
+            lambda _, context: errors.append(context)
+        )
+        status, _ = await post({"query": "whales"}, disconnect=True)
+        return status
+
+    assert asyncio.run(run()) == 499
+    assert cancelled.is_set()
+    assert errors == []
+
+
+def test_searches_are_limited_to_the_connections(tmp_path, monkeypatch):
+    lock = threading.Lock()
+    counts = {"active": 0, "max_active": 0}
+
+    def counted_search(*_, **__):
+        with lock:
+            counts["active"] += 1
+            counts["max_active"] = max(counts["max_active"], counts["active"])
+        time.sleep(0.05)
+        with lock:
+            counts["active"] -= 1
+        return []
+
+    monkeypatch.setattr(web, "search", counted_search)
+    setup_app(f"{tmp_path / 'db.sqlite3'}", connections=2)
+
+    async def run() -> list[tuple[int, dict | None]]:
+        return await asyncio.gather(*[post({"query": "whales"}) for _ in range(6)])
+
+    assert all(status == 200 for status, _ in asyncio.run(run()))
+    assert counts["max_active"] == 2